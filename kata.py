@@ -8,24 +8,52 @@ try:
 except AssertionError:
     exit("Kata requires Python 3.12 or above")
 
-from http.client import HTTPSConnection
-from json import dumps
-from os import chmod, environ, getgid, getuid, listdir, makedirs, remove, stat
-from os.path import abspath, dirname, exists, join, realpath
-from re import sub
-from shutil import copyfile, rmtree, which
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from fcntl import LOCK_EX, LOCK_NB, flock
+from fnmatch import fnmatch
+from glob import glob
+from gzip import open as gzip_open
+from hashlib import sha256
+from heapq import heappop, heappush, merge
+from http.client import HTTPConnection, HTTPSConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from queue import Empty, Queue
+from os import (chmod, close, cpu_count, dup, dup2, environ, fstat, getgid, getpid,
+                getuid, kill, listdir, lstat, makedirs, pipe, read, remove,
+                rename, replace, stat, symlink, uname, utime, walk, write)
+from os.path import (abspath, basename, dirname, exists, getmtime, getsize,
+                     isdir, isfile, islink, join, lexists, realpath, relpath,
+                     samestat)
+from re import findall, fullmatch, sub
+from shlex import quote, split
+from shutil import copyfile, copyfileobj, rmtree, which
+from socket import AF_UNIX, SOCK_STREAM, socket
 from stat import S_IRUSR, S_IWUSR, S_IXUSR
-from subprocess import STDOUT, call, check_output, run
-from sys import argv, stderr, stdin, stdout
+from subprocess import DEVNULL, PIPE, STDOUT, Popen, call, check_output, run
+from sys import argv, executable, stderr, stdin, stdout
 from tempfile import NamedTemporaryFile
+from threading import Lock, Thread
+from time import sleep, time
 from traceback import format_exc
 from urllib.parse import urlparse
 
-from click import UNPROCESSED, argument
+from click import UNPROCESSED, Choice, argument
 from click import echo as click_echo
-from click import group, option
+from click import clear, group, option
 from yaml import safe_dump, safe_load
 
+try:
+    from compression.zstd import open as zstd_open  # Python 3.14+
+except ImportError:
+    try:
+        from zstandard import open as zstd_open
+    except ImportError:
+        zstd_open = None  # deploy logs fall back to gzip
+
 # === Make sure we can access all system and user binaries ===
 
 if 'sbin' not in environ['PATH']:
@@ -50,24 +78,131 @@ PGID = getgid()
 DOCKER_COMPOSE = ".docker-compose.yaml"
 KATA_COMPOSE = "kata-compose.yaml"
 KATA_MODE_FILE = ".kata-mode"  # stores 'swarm' or 'compose' per app
+KATA_RELEASE_FILE = ".kata-release"  # marks a complete release checkout
+RELEASES_DIR = "releases"  # APP_ROOT/<app>/releases/<rev>
+CURRENT_RELEASE = "current"  # APP_ROOT/<app>/current -> releases/<rev>
+KATA_DEPLOY_LOCK = ".kata-deploy.lock"  # held while an app is being deployed
+KATA_DEPLOY_QUEUE = ".kata-deploy-queue"  # newest revision waiting to be deployed
+KATA_RELEASES_KEEP = int(environ.get('KATA_RELEASES_KEEP', 5))
+KATA_HEALTH_TIMEOUT = int(environ.get('KATA_HEALTH_TIMEOUT', 60))
 TRAEFIK_IMAGE = "traefik:v3.6.5"
+KATA_SWARM_CONFIGS = environ.get('KATA_SWARM_CONFIGS', '0') == '1'  # default for x-kata-configs
+SWARM_COMPOSE = ".docker-compose.swarm.yaml"  # DOCKER_COMPOSE as deployed to swarm (registry images, configs)
+CONFIG_MAX_BYTES = 500 * 1024  # Docker's size limit for a single config
+KATA_REGISTRY = environ.get('KATA_REGISTRY', '')  # host[:port] swarm deploys push kata/* images to ('' to disable)
+KATA_REGISTRY_PORT = int(environ.get('KATA_REGISTRY_PORT', 5000))  # published port for `kata registry:start`
+REGISTRY_IMAGE = "registry:2"
+KATA_SCALE_FILE = ".kata-scale.json"  # replica counts set with `kata scale`, kept across deploys
+KATA_TRAEFIK_METRICS_URL = environ.get('KATA_TRAEFIK_METRICS_URL', 'http://127.0.0.1:8082/metrics')  # read by `kata autoscale`
+KATA_TRAEFIK_PROVIDER = environ.get('KATA_TRAEFIK_PROVIDER', 'docker')  # 'docker' (labels) or 'file'
+KATA_TRAEFIK_CONFIG = abspath(join(KATA_ROOT, "kata-traefik.yaml"))  # host-level settings for the shared Traefik
+# kata-traefik.yaml section -> {key: (flag, type)}; entrypoint flags are repeated for web and websecure
+TRAEFIK_HOST_OPTIONS = {
+    'entrypoints': {
+        'read_timeout': ('--entrypoints.{ep}.transport.respondingtimeouts.readtimeout', 'duration'),
+        'write_timeout': ('--entrypoints.{ep}.transport.respondingtimeouts.writetimeout', 'duration'),
+        'idle_timeout': ('--entrypoints.{ep}.transport.respondingtimeouts.idletimeout', 'duration'),
+        'keepalive_max_requests': ('--entrypoints.{ep}.transport.keepalivemaxrequests', int),
+        'keepalive_max_time': ('--entrypoints.{ep}.transport.keepalivemaxtime', 'duration'),
+        'trusted_ips': ('--entrypoints.{ep}.forwardedheaders.trustedips', list),
+        'insecure_forwarded_headers': ('--entrypoints.{ep}.forwardedheaders.insecure', bool),
+    },
+    'servers_transport': {
+        'max_idle_conns_per_host': ('--serverstransport.maxidleconnsperhost', int),
+        'dial_timeout': ('--serverstransport.forwardingtimeouts.dialtimeout', 'duration'),
+        'response_header_timeout': ('--serverstransport.forwardingtimeouts.responseheadertimeout', 'duration'),
+        'idle_conn_timeout': ('--serverstransport.forwardingtimeouts.idleconntimeout', 'duration'),
+    },
+    'access_log': {
+        'buffering': ('--accesslog.bufferingsize', int),
+        'format': ('--accesslog.format', str),
+    },
+}
+TRAEFIK_DYNAMIC_ROOT = abspath(join(KATA_ROOT, ".kata-traefik"))  # one dynamic config file per app (file provider)
+TRAEFIK_DYNAMIC_MOUNT = "/etc/kata-traefik"
+# traefik block middleware presets, in chain order: preset -> (shorthand option, {option: type})
+TRAEFIK_MIDDLEWARES = {
+    'ratelimit': ('average', {'average': int, 'burst': int, 'period': 'duration'}),
+    'inflightreq': ('amount', {'amount': int}),
+    'circuitbreaker': ('expression', {'expression': str, 'checkperiod': 'duration', 'fallbackduration': 'duration',
+                                      'recoveryduration': 'duration', 'responsecode': int}),
+    'retry': ('attempts', {'attempts': int, 'initialinterval': 'duration'}),
+    'buffering': (None, {'maxrequestbodybytes': int, 'memrequestbodybytes': int, 'maxresponsebodybytes': int,
+                         'memresponsebodybytes': int, 'retryexpression': str}),
+    'compress': (None, {'minresponsebodybytes': int, 'excludedcontenttypes': list, 'includedcontenttypes': list,
+                        'encodings': list}),
+}
+TRAEFIK_MIDDLEWARE_DEFAULTS = {  # used when a preset is set to `true`
+    'retry': {'attempts': 3, 'initialinterval': '100ms'},
+    'circuitbreaker': {'expression': 'NetworkErrorRatio() > 0.30 || ResponseCodeRatio(500, 600, 0, 600) > 0.25'},
+}
+TRASH_ROOT = abspath(join(KATA_ROOT, ".kata-trash"))  # destroyed app directories awaiting deletion
+KATA_REAP_JOBS = int(environ.get('KATA_REAP_JOBS', 2))  # trash entries deleted in parallel
+KATA_LOG_BUFFER = int(environ.get('KATA_LOG_BUFFER', 10000))  # max log lines held in memory by `kata logs`
+KATA_LOG_MAX_BYTES = int(environ.get('KATA_LOG_MAX_BYTES', 10 * 1024 * 1024))  # rotate saved logs at this size
+KATA_LOG_KEEP = int(environ.get('KATA_LOG_KEEP', 10))  # compressed log files kept per app
+KATA_DEPLOY_LOGS_KEEP = int(environ.get('KATA_DEPLOY_LOGS_KEEP', 20))  # deploy logs kept per app
+KATA_DEPLOY_LOGS_MAX_BYTES = int(environ.get('KATA_DEPLOY_LOGS_MAX_BYTES', 50 * 1024 * 1024))  # per app, compressed
+DEPLOY_LOG_EXT = '.log.zst' if zstd_open else '.log.gz'
+LOG_REORDER_WINDOW = 0.5  # seconds a followed line may wait for older lines from other sources
+METRICS_ROOT = abspath(join(KATA_ROOT, ".kata-metrics"))  # event log read by `kata metrics:serve`
+KATA_METRICS_MAX_BYTES = int(environ.get('KATA_METRICS_MAX_BYTES', 5 * 1024 * 1024))  # rotate the event log at this size
+SCHEDULER_ROOT = abspath(join(KATA_ROOT, ".kata-scheduler"))  # host-wide deploy slots and queue
+KATA_DEPLOY_SLOTS = int(environ.get('KATA_DEPLOY_SLOTS', max(1, (cpu_count() or 4) // 4)))
+DEPLOY_PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}  # x-kata-priority classes
+KATA_FLEET_JOBS = int(environ.get('KATA_FLEET_JOBS', cpu_count() or 4))  # parallel apps for bulk operations
+KATA_INSTALL_CPUS = environ.get('KATA_INSTALL_CPUS', '1')  # --cpus for installer containers ('' to disable)
+KATA_INSTALL_MEMORY = environ.get('KATA_INSTALL_MEMORY', '')  # --memory for installer containers ('' for no limit)
 ROOT_FOLDERS = ['APP_ROOT', 'DATA_ROOT', 'ENV_ROOT', 'CONFIG_ROOT', 'GIT_ROOT', 'LOG_ROOT']
 if KATA_BIN not in environ['PATH']:
     environ['PATH'] = KATA_BIN + ":" + environ['PATH']
 
 # === Make sure we can access kata user-installed binaries === #
 
-PYTHON_DOCKERFILE = """
+def dockerfile_write(path: str, lines: list) -> str:
+    """Shell snippet for a Dockerfile RUN that writes `lines` (which must not contain single quotes) to `path`"""
+    return "printf '%s\\n' " + " ".join(f"'{line}'" for line in lines) + f" > {path}"
+
+
+# Debian runtimes share this layer; each one adds a slim image to run apps and a
+# kata/<runtime>-build child with the compilers and package managers installs need
+BASE_DOCKERFILE = r"""
 FROM debian:trixie-slim
 ARG DEBIAN_FRONTEND=noninteractive
-RUN apt update \
- && apt dist-upgrade -y \
- && apt-get -qq install \
-    git \
-    openssh-client \
-    python3-pip \
-    python3-dev \
-    python3-venv
+RUN apt-get update \
+ && apt-get -qq dist-upgrade -y \
+ && apt-get -qq install --no-install-recommends ca-certificates \
+ && rm -rf /var/lib/apt/lists/* /var/cache/apt/archives/*
+"""
+
+PYTHON_DOCKERFILE = r"""
+FROM kata/base
+ARG DEBIAN_FRONTEND=noninteractive
+RUN apt-get update \
+ && apt-get -qq install --no-install-recommends \
+    python3 \
+    python3-venv \
+ && rm -rf /var/lib/apt/lists/* /var/cache/apt/archives/* \
+ && printf '%s\n' \
+    '#!/bin/sh' \
+    '# kata-serve SERVER INTERFACE MODULE:APP [WORKERS] - run an app under a production server' \
+    'server="$1"; interface="$2"; target="$3"; workers="${4:-$WEB_CONCURRENCY}"' \
+    'cpus=$(nproc)' \
+    'if [ -r /sys/fs/cgroup/cpu.max ]; then' \
+    '  read -r quota period < /sys/fs/cgroup/cpu.max' \
+    '  [ "$quota" = max ] || cpus=$(( (quota + period - 1) / period ))' \
+    'fi' \
+    '[ "$cpus" -ge 1 ] || cpus=1' \
+    'case "$server" in' \
+    '  gunicorn) exec gunicorn --workers "${workers:-$((cpus * 2 + 1))}" --bind "0.0.0.0:${PORT:-8000}" \' \
+    '    --forwarded-allow-ips "*" --access-logfile - "$target" ;;' \
+    '  uvicorn) exec uvicorn --workers "${workers:-$cpus}" --host 0.0.0.0 --port "${PORT:-8000}" \' \
+    '    --proxy-headers --forwarded-allow-ips "*" "$target" ;;' \
+    '  granian) exec granian --interface "$interface" --workers "${workers:-$cpus}" --host 0.0.0.0 \' \
+    '    --port "${PORT:-8000}" "$target" ;;' \
+    'esac' \
+    'echo "kata-serve: unsupported server $server" >&2; exit 1' > /usr/local/bin/kata-serve \
+ && chmod +x /usr/local/bin/kata-serve
 ENV VIRTUAL_ENV=/venv
 ENV PATH=/venv/bin:$PATH
 VOLUME ["/app", "/config", "/data", "/venv"]
@@ -75,17 +210,80 @@ WORKDIR /app
 CMD ["python3", "-m", "app"]
 """
 
-NODEJS_DOCKERFILE = """
-FROM debian:trixie-slim
+PYTHON_BUILD_DOCKERFILE = r"""
+FROM kata/python
 ARG DEBIAN_FRONTEND=noninteractive
-RUN apt update \
- && apt dist-upgrade -y \
- && apt-get -qq install \
+RUN apt-get update \
+ && apt-get -qq install --no-install-recommends \
+    build-essential \
     git \
     openssh-client \
-    nodejs \
-    npm \
-    yarnpkg
+    python3-dev \
+ && rm -rf /var/lib/apt/lists/* /var/cache/apt/archives/*
+"""
+
+PYTHON_SERVERS = {  # server: (pip requirement, supported interfaces)
+    'gunicorn': ('gunicorn', ('wsgi',)),
+    'uvicorn': ('uvicorn[standard]', ('asgi',)),
+    'granian': ('granian', ('wsgi', 'asgi')),
+}
+PYTHON_DEFAULT_SERVERS = {'wsgi': 'gunicorn', 'asgi': 'uvicorn'}
+PYTHON_ENTRYPOINTS = ['app.py', 'main.py', 'application.py', 'server.py', 'wsgi.py', 'asgi.py',
+                      'app/__init__.py', 'app/main.py', '*/wsgi.py', '*/asgi.py']  # searched in order
+PYTHON_APP_FACTORIES = {  # callables whose result is a WSGI/ASGI app, by interface
+    'asgi': ('FastAPI', 'Starlette', 'Quart', 'Litestar', 'get_asgi_application'),
+    'wsgi': ('Flask', 'Bottle', 'get_wsgi_application', 'make_wsgi_app', 'falcon.App', 'falcon.API'),
+}
+
+NODE_CLUSTER_SCRIPT = "/usr/local/lib/kata-cluster.js"
+NODE_CLUSTER_JS = [  # written into the nodejs and bun images; no single quotes (printf-quoted)
+    '// kata-cluster WORKERS ENTRY [ARGS...] - run ENTRY in WORKERS processes sharing the listening socket',
+    'const cluster = require("node:cluster");',
+    'const fs = require("node:fs");',
+    'const os = require("node:os");',
+    'const path = require("node:path");',
+    'const [workersArg, entry, ...args] = process.argv.slice(2);',
+    'function cpuQuota() {',
+    '  try {',
+    '    const [quota, period] = fs.readFileSync("/sys/fs/cgroup/cpu.max", "utf8").trim().split(" ");',
+    '    if (quota !== "max") return Math.max(1, Math.ceil(Number(quota) / Number(period)));',
+    '  } catch (e) {}',
+    '  return os.availableParallelism ? os.availableParallelism() : os.cpus().length;',
+    '}',
+    'const workers = Number(workersArg) || Number(process.env.WEB_CONCURRENCY) || cpuQuota();',
+    'const crashes = [];',
+    'let stopping = false;',
+    'cluster.setupPrimary({ exec: path.resolve(entry), args });',
+    'cluster.on("exit", (worker, code, signal) => {',
+    '  if (stopping) {',
+    '    if (Object.keys(cluster.workers).length === 0) process.exit(0);',
+    '    return;',
+    '  }',
+    '  const now = Date.now();',
+    '  crashes.push(now);',
+    '  while (now - crashes[0] > 60000) crashes.shift();',
+    '  const delay = Math.min(30000, 100 * 2 ** Math.max(0, crashes.length - workers));',
+    '  console.error("kata-cluster: worker " + worker.process.pid + " exited (" + (signal || code) + "), restarting in " + delay + "ms");',
+    '  setTimeout(() => stopping || cluster.fork(), delay);',
+    '});',
+    'for (const signal of ["SIGTERM", "SIGINT"]) {',
+    '  process.on(signal, () => {',
+    '    stopping = true;',
+    '    for (const worker of Object.values(cluster.workers)) worker.process.kill(signal);',
+    '    setTimeout(() => process.exit(0), 10000).unref();',
+    '  });',
+    '}',
+    'for (let i = 0; i < workers; i++) cluster.fork();',
+    'console.log("kata-cluster: " + workers + " workers running " + entry);',
+]
+
+NODEJS_DOCKERFILE = f"""
+FROM kata/base
+ARG DEBIAN_FRONTEND=noninteractive
+RUN apt-get update \\
+ && apt-get -qq install --no-install-recommends nodejs \\
+ && rm -rf /var/lib/apt/lists/* /var/cache/apt/archives/* \\
+ && {dockerfile_write(NODE_CLUSTER_SCRIPT, NODE_CLUSTER_JS)}
 ENV NODE_PATH=/venv
 ENV NPM_CONFIG_PREFIX=/venv
 ENV PATH=/venv/bin:/venv/.bin:$PATH
@@ -94,30 +292,147 @@ WORKDIR /app
 CMD ["node", "app.js"]
 """
 
-PHP_DOCKERFILE = """
-FROM debian:trixie-slim
+NODEJS_BUILD_DOCKERFILE = """
+FROM kata/nodejs
 ARG DEBIAN_FRONTEND=noninteractive
-RUN apt update \
- && apt dist-upgrade -y \
- && apt-get -qq install \
-    git \
-    openssh-client \
-    php-cli \
-    php-curl \
-    php-mbstring \
-    php-xml \
-    php-zip \
-    composer
+RUN apt-get update \\
+ && apt-get -qq install --no-install-recommends \\
+    build-essential \\
+    git \\
+    npm \\
+    openssh-client \\
+    python3 \\
+    yarnpkg \\
+ && rm -rf /var/lib/apt/lists/* /var/cache/apt/archives/*
+"""
+
+PHP_FPM_SOCKET = "/run/php-fpm.sock"
+PHP_OPCACHE_INI = [
+    'opcache.enable=1',
+    'opcache.memory_consumption=${PHP_OPCACHE_MEMORY:-128}',
+    'opcache.interned_strings_buffer=16',
+    'opcache.max_accelerated_files=20000',
+    'opcache.validate_timestamps=${PHP_OPCACHE_VALIDATE_TIMESTAMPS:-0}',
+    'opcache.preload=${PHP_OPCACHE_PRELOAD:-}',
+    'opcache.preload_user=www-data',
+    'realpath_cache_size=4096K',
+    'realpath_cache_ttl=600',
+    'expose_php=Off',
+]
+PHP_NGINX_CONF = [
+    'upstream php {',
+    f'    server unix:{PHP_FPM_SOCKET};',
+    '    keepalive 16;',
+    '}',
+    'server {',
+    '    listen __PORT__ reuseport backlog=4096;',
+    '    root __DOCROOT__;',
+    '    index index.php index.html;',
+    '    access_log off;',
+    '    client_max_body_size 64m;',
+    '    sendfile on;',
+    r'    location ~ /\.(?!well-known/) {',
+    '        return 404;',
+    '    }',
+    '    location / {',
+    '        try_files $uri $uri/ /index.php$is_args$args;',
+    '    }',
+    r'    location ~ \.php$ {',
+    '        try_files $uri =404;',
+    '        include fastcgi_params;',
+    '        fastcgi_param SCRIPT_FILENAME $realpath_root$fastcgi_script_name;',
+    '        fastcgi_param DOCUMENT_ROOT $realpath_root;',
+    '        fastcgi_keep_conn on;',
+    '        fastcgi_buffer_size 32k;',
+    '        fastcgi_buffers 16 16k;',
+    '        fastcgi_pass php;',
+    '    }',
+    '}',
+]
+PHP_LAUNCHER = [
+    '#!/bin/bash',
+    '# kata-php - size the PHP-FPM pool from the container limits, then run it behind nginx',
+    'cpus=$(nproc)',
+    'if [ -r /sys/fs/cgroup/cpu.max ]; then',
+    '  read -r quota period < /sys/fs/cgroup/cpu.max',
+    '  [ "$quota" = max ] || cpus=$(( (quota + period - 1) / period ))',
+    'fi',
+    'memory=$(( $(awk "/^MemTotal/ {print \\$2}" /proc/meminfo) / 1024 ))',
+    'if [ -r /sys/fs/cgroup/memory.max ] && [ "$(cat /sys/fs/cgroup/memory.max)" != max ]; then',
+    '  memory=$(( $(cat /sys/fs/cgroup/memory.max) / 1048576 ))',
+    'fi',
+    '# One child per PHP_FPM_CHILD_MEMORY MB left after the master and opcache, at most 8 per CPU',
+    'children=$(( (memory - 64 - ${PHP_OPCACHE_MEMORY:-128}) / ${PHP_FPM_CHILD_MEMORY:-64} ))',
+    '(( children <= cpus * 8 )) || children=$(( cpus * 8 ))',
+    '(( children >= 2 )) || children=2',
+    'children=${PHP_FPM_MAX_CHILDREN:-$children}',
+    'spare=$(( cpus < children ? cpus : children ))',
+    'for pool in /etc/php/*/fpm/pool.d; do',
+    '  printf "%s\\n" "[kata]" "user = root" "group = root" "listen = ' + PHP_FPM_SOCKET + '" \\',
+    '    "listen.owner = www-data" "listen.backlog = 4096" "pm = dynamic" "pm.max_children = $children" \\',
+    '    "pm.start_servers = $spare" "pm.min_spare_servers = $spare" \\',
+    '    "pm.max_spare_servers = $(( spare * 2 < children ? spare * 2 : children ))" "pm.max_requests = 1000" \\',
+    '    "clear_env = no" "catch_workers_output = yes" "decorate_workers_output = no" > "$pool/kata.conf"',
+    'done',
+    'if [ -z "${PHP_OPCACHE_PRELOAD+set}" ]; then',
+    '  for preload in /app/config/preload.php /app/preload.php; do',
+    '    [ -f "$preload" ] && export PHP_OPCACHE_PRELOAD="$(realpath "$preload")" && break',
+    '  done',
+    'fi',
+    'sed -e "s|__PORT__|${PORT:-8000}|" -e "s|__DOCROOT__|${DOCROOT:-/app}|" /etc/nginx/kata-php.conf > /etc/nginx/conf.d/default.conf',
+    'mkdir -p /run/php',
+    'echo "kata-php: $children PHP-FPM workers ($cpus CPUs, ${memory}MB)"',
+    'trap "kill -TERM \\$(jobs -p) 2>/dev/null" TERM INT',
+    '/usr/sbin/php-fpm* --nodaemonize --allow-to-run-as-root &',
+    'nginx -g "daemon off;" &',
+    '# Exit (and let Docker restart the container) as soon as either process stops',
+    'wait -n',
+]
+
+PHP_DOCKERFILE = f"""
+FROM kata/base
+ARG DEBIAN_FRONTEND=noninteractive
+RUN apt-get update \\
+ && apt-get -qq install --no-install-recommends \\
+    php-cli \\
+    php-fpm \\
+    php-curl \\
+    php-mbstring \\
+    php-xml \\
+    php-zip \\
+    nginx \\
+ && apt-get -qq install --no-install-recommends "php$(ls /etc/php)-opcache" \\
+ && rm -rf /var/lib/apt/lists/* /var/cache/apt/archives/* \\
+ && rm -f /etc/nginx/sites-enabled/default /etc/php/*/fpm/pool.d/www.conf \\
+ && sed -i "s|^;*error_log = .*|error_log = /proc/self/fd/2|" /etc/php/*/fpm/php-fpm.conf \\
+ && ln -sf /dev/stderr /var/log/nginx/error.log \\
+ && for ini in /etc/php/*/fpm/conf.d; do {dockerfile_write('$ini/99-kata.ini', PHP_OPCACHE_INI)}; done \\
+ && {dockerfile_write('/etc/nginx/kata-php.conf', PHP_NGINX_CONF)} \\
+ && {dockerfile_write('/usr/local/bin/kata-php', PHP_LAUNCHER)} \\
+ && chmod +x /usr/local/bin/kata-php
+ENV PORT=8000
+ENV DOCROOT=/app
+EXPOSE 8000
 VOLUME ["/app", "/config", "/data", "/venv"]
 WORKDIR /app
-CMD ["php", "-S", "0.0.0.0:8000", "-t", "/app"]
+CMD ["kata-php"]
 """
 
-BUN_DOCKERFILE = """
+PHP_BUILD_DOCKERFILE = """
+FROM kata/php
+ARG DEBIAN_FRONTEND=noninteractive
+RUN apt-get update \\
+ && apt-get -qq install --no-install-recommends \\
+    composer \\
+    git \\
+    openssh-client \\
+    unzip \\
+ && rm -rf /var/lib/apt/lists/* /var/cache/apt/archives/*
+"""
+
+BUN_DOCKERFILE = f"""
 FROM oven/bun:1-alpine
-RUN apk add --no-cache \
-    git \
-    openssh-client
+RUN {dockerfile_write(NODE_CLUSTER_SCRIPT, NODE_CLUSTER_JS)}
 ENV NODE_PATH=/venv
 ENV BUN_INSTALL=/venv
 ENV PATH=/venv/bin:$PATH
@@ -126,22 +441,103 @@ WORKDIR /app
 CMD ["bun", "run", "index.js"]
 """
 
-STATIC_DOCKERFILE = """
-FROM busybox:stable-musl
+BUN_BUILD_DOCKERFILE = """
+FROM kata/bun
+RUN apk add --no-cache \\
+    git \\
+    openssh-client
+"""
+
+STATIC_DOCKERFILE = r"""
+FROM alpine:3
+RUN apk add --no-cache nginx nginx-mod-http-brotli brotli gzip \
+ && mkdir -p /run/nginx \
+ && ln -sf /dev/stderr /var/log/nginx/error.log \
+ && rm -f /etc/nginx/http.d/default.conf \
+ && printf '%s\n' \
+    'server {' \
+    '    listen __PORT__ reuseport backlog=4096;' \
+    '    root __DOCROOT__;' \
+    '    index index.html;' \
+    '    access_log off;' \
+    '    sendfile on;' \
+    '    tcp_nopush on;' \
+    '    tcp_nodelay on;' \
+    '    keepalive_requests 10000;' \
+    '    open_file_cache max=10000 inactive=60s;' \
+    '    open_file_cache_valid 30s;' \
+    '    open_file_cache_errors on;' \
+    '    gzip_static on;' \
+    '    brotli_static on;' \
+    '    gzip on;' \
+    '    gzip_comp_level 5;' \
+    '    gzip_min_length 1024;' \
+    '    gzip_vary on;' \
+    '    gzip_types text/css text/plain text/xml application/javascript application/json application/xml image/svg+xml application/wasm;' \
+    '    location ~ /\.(?!well-known/) {' \
+    '        return 404;' \
+    '    }' \
+    '    location ~ "[.-]((?=[0-9a-f]*[a-f])(?=[0-9a-f]*[0-9])[0-9a-f]{8,}|(?=[A-Za-z0-9_-]*[A-Z])(?=[A-Za-z0-9_-]*[a-z])(?=[A-Za-z0-9_-]*[0-9])[A-Za-z0-9_-]{8})\.[A-Za-z0-9]+$" {' \
+    '        add_header Cache-Control "public, max-age=31536000, immutable";' \
+    '        try_files $uri =404;' \
+    '    }' \
+    '    location / {' \
+    '        add_header Cache-Control "no-cache";' \
+    '        try_files $uri $uri/ =404;' \
+    '    }' \
+    '}' > /etc/nginx/kata-static.conf \
+ && printf '%s\n' \
+    '#!/bin/sh' \
+    '# Write .gz/.br siblings for compressible assets that changed since the last run' \
+    'find "${1:-/app}" -type f -size +1k ! -path "*/.git/*" ! -path "*/node_modules/*" \( -name "*.html" -o -name "*.htm" \' \
+    '  -o -name "*.css" -o -name "*.js" -o -name "*.mjs" -o -name "*.json" -o -name "*.map" -o -name "*.svg" \' \
+    '  -o -name "*.xml" -o -name "*.txt" -o -name "*.wasm" -o -name "*.ico" -o -name "*.webmanifest" \) |' \
+    'while read -r f; do' \
+    '  [ "$f.gz" -nt "$f" ] || gzip -9 -k -f -n "$f"' \
+    '  [ "$f.br" -nt "$f" ] || brotli -q 11 -k -f "$f"' \
+    'done' > /usr/local/bin/kata-precompress \
+ && chmod +x /usr/local/bin/kata-precompress
 ENV PORT=8000
 ENV DOCROOT=/app
 EXPOSE 8000
 VOLUME ["/app"]
 WORKDIR /app
-CMD ["sh", "-c", "httpd -f -p ${PORT} -h ${DOCROOT}"]
+CMD ["sh", "-c", "sed -e \"s|__PORT__|${PORT}|\" -e \"s|__DOCROOT__|${DOCROOT}|\" /etc/nginx/kata-static.conf > /etc/nginx/http.d/default.conf && exec nginx -g 'daemon off;'"]
 """
 
-RUNTIME_IMAGES = {
+CACHE_PATH = "/var/cache/kata"
+CACHE_PORT = 8080
+CACHE_DOCKERFILE = f"""
+FROM nginx:stable-alpine
+ENV KATA_CACHE_CONF=""
+RUN mkdir -p {CACHE_PATH} && chown nginx {CACHE_PATH}
+EXPOSE {CACHE_PORT}
+CMD ["sh", "-c", "printf '%s' \\"$KATA_CACHE_CONF\\" > /etc/nginx/nginx.conf && exec nginx -g 'daemon off;'"]
+"""
+
+RESOURCE_KEYS = ('cpus', 'memory', 'reserve_cpus', 'reserve_memory')  # x-kata-resources settings
+RUNTIME_RESOURCES = {  # default limits/reservations per runtime image; override with x-kata-resources
+    'python': {'cpus': 2, 'memory': '1g', 'reserve_cpus': 0.25, 'reserve_memory': '256m'},
+    'nodejs': {'cpus': 2, 'memory': '1g', 'reserve_cpus': 0.25, 'reserve_memory': '256m'},
+    'bun': {'cpus': 2, 'memory': '1g', 'reserve_cpus': 0.25, 'reserve_memory': '256m'},
+    'php': {'cpus': 2, 'memory': '512m', 'reserve_cpus': 0.25, 'reserve_memory': '128m'},
+    'static': {'cpus': 1, 'memory': '256m', 'reserve_cpus': 0.1, 'reserve_memory': '32m'},
+    'cache': {'cpus': 1, 'memory': '256m', 'reserve_cpus': 0.1, 'reserve_memory': '64m'},
+}
+
+RUNTIMES = ['python', 'nodejs', 'php', 'bun', 'static']  # valid `runtime:` values
+RUNTIME_IMAGES = {  # parents come before the images built FROM them
+    'kata/base': BASE_DOCKERFILE,
     'kata/python': PYTHON_DOCKERFILE,
+    'kata/python-build': PYTHON_BUILD_DOCKERFILE,
     'kata/nodejs': NODEJS_DOCKERFILE,
+    'kata/nodejs-build': NODEJS_BUILD_DOCKERFILE,
     'kata/php': PHP_DOCKERFILE,
+    'kata/php-build': PHP_BUILD_DOCKERFILE,
     'kata/bun': BUN_DOCKERFILE,
-    'kata/static': STATIC_DOCKERFILE
+    'kata/bun-build': BUN_BUILD_DOCKERFILE,
+    'kata/static': STATIC_DOCKERFILE,
+    'kata/cache': CACHE_DOCKERFILE
 }
 
 
@@ -245,6 +641,75 @@ def ensure_shared_traefik() -> None:
     run_shared_traefik(enable_dashboard=False)
 
 
+def traefik_provider_args() -> tuple:
+    """Provider flags and volumes for a Traefik container, per KATA_TRAEFIK_PROVIDER."""
+    if KATA_TRAEFIK_PROVIDER == 'file':
+        # Routes come from files kata writes atomically; no Docker socket access needed
+        makedirs(TRAEFIK_DYNAMIC_ROOT, exist_ok=True)
+        return ([f'--providers.file.directory={TRAEFIK_DYNAMIC_MOUNT}', '--providers.file.watch=true'],
+                [f'{TRAEFIK_DYNAMIC_ROOT}:{TRAEFIK_DYNAMIC_MOUNT}:ro'])
+    return (['--providers.docker=true', '--providers.docker.exposedbydefault=false'],
+            ['/var/run/docker.sock:/var/run/docker.sock:ro'])
+
+
+def traefik_host_args(websecure_bind: str = '443:443') -> tuple:
+    """Flags and extra port bindings from KATA_TRAEFIK_CONFIG; raises ValueError on bad settings."""
+    if not exists(KATA_TRAEFIK_CONFIG):
+        return [], []
+    try:
+        cfg = safe_load(open(KATA_TRAEFIK_CONFIG, 'r', encoding='utf-8')) or {}
+    except Exception as e:
+        raise ValueError(f"cannot read {KATA_TRAEFIK_CONFIG}: {e}")
+    if not isinstance(cfg, dict):
+        raise ValueError(f"{KATA_TRAEFIK_CONFIG} must be a mapping")
+    unknown = set(cfg) - set(TRAEFIK_HOST_OPTIONS) - {'http3', 'metrics'}
+    if unknown:
+        raise ValueError(f"unknown section(s) in {KATA_TRAEFIK_CONFIG}: {', '.join(sorted(unknown))}")
+
+    args, ports = [], []
+    if cfg.get('http3'):
+        # QUIC runs over UDP on the same port as websecure
+        args.append('--entrypoints.websecure.http3=true')
+        if websecure_bind:
+            ports.append(f"{websecure_bind}/udp")
+            host_port = websecure_bind.split(':')[-2] if websecure_bind.count(':') else websecure_bind
+            if host_port != '443':
+                args.append(f'--entrypoints.websecure.http3.advertisedport={host_port}')
+    if cfg.get('metrics'):
+        # Prometheus metrics on a loopback-only port, read by `kata autoscale`
+        args += ['--entrypoints.metrics.address=:8082', '--metrics.prometheus=true',
+                 '--metrics.prometheus.entrypoint=metrics', '--metrics.prometheus.addservicelabels=true']
+        ports.append('127.0.0.1:8082:8082')
+    if cfg.get('access_log') is True:
+        cfg['access_log'] = {}
+    if isinstance(cfg.get('access_log'), dict):
+        args.append('--accesslog=true')
+    for section, options in TRAEFIK_HOST_OPTIONS.items():
+        values = cfg.get(section)
+        if not values:
+            continue
+        if not isinstance(values, dict):
+            raise ValueError(f"'{section}' must be a mapping")
+        for key, value in values.items():
+            if key not in options:
+                raise ValueError(f"unknown option '{section}.{key}' (expected one of: {', '.join(options)})")
+            flag, kind = options[key]
+            if kind is int:
+                if isinstance(value, bool) or not fullmatch(r'\d+', str(value)):
+                    raise ValueError(f"'{section}.{key}' must be a non-negative integer, got '{value}'")
+            elif kind is bool:
+                if not isinstance(value, bool):
+                    raise ValueError(f"'{section}.{key}' must be true or false")
+                value = str(value).lower()
+            elif kind is list:
+                value = ",".join(as_list(value))
+            elif kind == 'duration' and not fullmatch(r'0|(\d+(\.\d+)?(ns|us|ms|s|m|h))+', str(value)):
+                raise ValueError(f"'{section}.{key}' must be a duration like 30s or 2m, got '{value}'")
+            for ep in (['web', 'websecure'] if '{ep}' in flag else [None]):
+                args.append(f"{flag.format(ep=ep)}={value}")
+    return args, ports
+
+
 def run_shared_traefik(enable_dashboard: bool = False,
                        dashboard_bind: str = '127.0.0.1',
                        dashboard_port: int = 8080,
@@ -261,9 +726,14 @@ def run_shared_traefik(enable_dashboard: bool = False,
         ports.append(web_bind)
     if websecure_bind:
         ports.append(websecure_bind)
-    entrypoints = [
-        '--providers.docker=true',
-        '--providers.docker.exposedbydefault=false',
+    try:
+        host_args, host_ports = traefik_host_args(websecure_bind)
+    except ValueError as e:
+        echo(f"Error: {e}", fg='red')
+        return
+    ports.extend(host_ports)
+    provider_args, provider_volumes = traefik_provider_args()
+    entrypoints = provider_args + host_args + [
         '--entrypoints.web.address=:80',
         '--entrypoints.websecure.address=:443',
         f'--certificatesresolvers.default.acme.email={acme_email}',
@@ -287,8 +757,9 @@ def run_shared_traefik(enable_dashboard: bool = False,
     ]
     for p in ports:
         cmd += ['-p', p]
+    for v in provider_volumes:
+        cmd += ['-v', v]
     cmd += [
-        '-v', '/var/run/docker.sock:/var/run/docker.sock:ro',
         '-v', f'{volume_name}:/etc/traefik',
         TRAEFIK_IMAGE
     ]
@@ -297,15 +768,275 @@ def run_shared_traefik(enable_dashboard: bool = False,
 
 
 
+def label_dict(labels) -> dict:
+    """Normalize compose labels (list of 'k=v' or dict) into a dict."""
+    if isinstance(labels, dict):
+        return labels
+    converted = {}
+    if isinstance(labels, list):
+        for item in labels:
+            if '=' in item:
+                k, v = item.split('=', 1)
+                converted[k] = v
+    return converted
+
+
+def as_list(value) -> list:
+    """Accept a comma-separated string or a list and return a list of non-empty strings."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = str(value).split(',')
+    return [str(v).strip() for v in items if v is not None and str(v).strip()]
+
+
+def add_network_alias(service: dict, network: str, alias: str) -> None:
+    """Attach a compose service to `network` under an extra DNS alias."""
+    networks = service.get('networks')
+    if networks is None:
+        networks = []
+    if isinstance(networks, str):
+        networks = [networks]
+    if isinstance(networks, list):
+        networks = {name: {} for name in networks}
+    entry = networks.get(network) or {}
+    aliases = entry.setdefault('aliases', [])
+    if alias not in aliases:
+        aliases.append(alias)
+    networks[network] = entry
+    service['networks'] = networks
+
+
+def traefik_middleware_options(cfg: dict) -> dict:
+    """Validate the middleware presets set in a traefik block or route.
+
+    Returns {preset: {option: value}} in chain order; raises ValueError on bad input.
+    """
+    presets = {}
+    for preset, (shorthand, options) in TRAEFIK_MIDDLEWARES.items():
+        value = cfg.get(preset)
+        if value is None or value is False:
+            continue
+        if value is True:
+            value = {}
+        elif not isinstance(value, dict):
+            if not shorthand:
+                raise ValueError(f"'{preset}' takes true or a mapping of options")
+            value = {shorthand: value}
+        normalized = {}
+        for key, option_value in {**TRAEFIK_MIDDLEWARE_DEFAULTS.get(preset, {}), **value}.items():
+            option = str(key).replace('_', '').lower()
+            kind = options.get(option)
+            if kind is None:
+                raise ValueError(f"unknown option '{key}' for '{preset}' (expected one of: {', '.join(options)})")
+            if kind is int:
+                if isinstance(option_value, bool) or not fullmatch(r'\d+', str(option_value).strip()):
+                    raise ValueError(f"'{preset}.{key}' must be a non-negative integer, got '{option_value}'")
+                option_value = int(option_value)
+            elif kind == 'duration':
+                option_value = str(option_value).strip()
+                if not fullmatch(r'(\d+(\.\d+)?(ns|us|ms|s|m|h))+', option_value):
+                    raise ValueError(f"'{preset}.{key}' must be a duration like 500ms or 10s, got '{option_value}'")
+            elif kind is list:
+                option_value = ",".join(as_list(option_value))
+                if not option_value:
+                    raise ValueError(f"'{preset}.{key}' must not be empty")
+            else:
+                option_value = str(option_value)
+            normalized[option] = option_value
+        if shorthand and not normalized.get(shorthand):
+            raise ValueError(f"'{preset}' needs a non-zero '{shorthand}'")
+        presets[preset] = normalized
+    return presets
+
+
+def traefik_routes(app_name, traefik_cfg, services) -> list:
+    """Resolve the traefik block into a list of routes, one router + load balancer each.
+
+    The block either describes a single route with its top-level keys, or lists
+    several under `routes:`. Keys a route does not set fall back to the top level:
+      name: suffix for the router/service name (default: position in the list)
+      host: hostname(s), comma-separated string or list (`hosts` also accepted)
+      path: path prefix(es) matched with PathPrefix (`paths` also accepted)
+      strip_prefix: remove the matched prefix before forwarding (default False)
+      service, port, entrypoints, tls, certresolver, enable_http_redirect, priority
+      replicas: number of replicas for the target service (deploy.replicas)
+      healthcheck: path, or {path, interval, timeout} for load balancer health checks
+      sticky: true, or a cookie name, for cookie-based session affinity
+      ratelimit, inflightreq, circuitbreaker, retry, buffering, compress: middleware
+        presets chained onto the router (see TRAEFIK_MIDDLEWARES)
+    """
+    route_cfgs = traefik_cfg.get('routes')
+    if route_cfgs is None:
+        route_cfgs = [{}]
+    elif not isinstance(route_cfgs, list) or not all(isinstance(r, dict) for r in route_cfgs):
+        echo("Warning: 'traefik.routes' must be a list of mappings; skipping traefik labels", fg='yellow')
+        return []
+    defaults = {k: v for k, v in traefik_cfg.items() if k != 'routes'}
+
+    routes = []
+    for index, route_cfg in enumerate(route_cfgs):
+        cfg = {**defaults, **route_cfg}
+        if 'routes' in traefik_cfg:
+            suffix = sub(r'[^a-z0-9-]+', '-', str(route_cfg.get('name', index)).lower()).strip('-')
+            router_name = f"{app_name}-{suffix}"
+        else:
+            router_name = app_name
+        if any(r['router'] == router_name for r in routes):
+            echo(f"Warning: duplicate traefik route name '{router_name}'; skipping it", fg='yellow')
+            continue
+
+        hostnames = as_list(cfg.get('hosts', cfg.get('host')))
+        if not hostnames:
+            echo(f"Warning: 'traefik.host' missing for route '{router_name}'; skipping it", fg='yellow')
+            continue
+        paths = as_list(cfg.get('paths', cfg.get('path')))
+        for path in paths:
+            if not path.startswith('/'):
+                echo(f"Warning: path prefix '{path}' for route '{router_name}' must start with '/'; skipping it", fg='yellow')
+                paths = None
+                break
+        if paths is None:
+            continue
+        rule = " || ".join([f"Host(`{h}`)" for h in hostnames])
+        if paths:
+            path_rule = " || ".join([f"PathPrefix(`{p}`)" for p in paths])
+            if len(hostnames) > 1:
+                rule = f"({rule})"
+            rule += f" && ({path_rule})" if len(paths) > 1 else f" && {path_rule}"
+
+        service_name = cfg.get('service')
+        if not service_name:
+            # pick first declared service
+            service_name = next(iter(services.keys()))
+        if service_name not in services:
+            echo(f"Warning: traefik.service '{service_name}' not found; skipping route '{router_name}'", fg='yellow')
+            continue
+        # Host network_mode services cannot be attached to traefik-proxy
+        if isinstance(services[service_name], dict) and services[service_name].get('network_mode'):
+            echo(f"Warning: service '{service_name}' uses network_mode; skipping route '{router_name}'", fg='yellow')
+            continue
+
+        port = cfg.get('port', None)
+        if port is None:
+            echo(f"Warning: 'traefik.port' missing for route '{router_name}'; defaulting to 8000", fg='yellow')
+            port = 8000
+
+        entrypoints = as_list(cfg.get('entrypoints', ['websecure'])) or ['websecure']
+        tls_enabled = cfg.get('tls')
+        if tls_enabled is None:
+            tls_enabled = 'websecure' in entrypoints
+
+        replicas = cfg.get('replicas')
+        if replicas is not None:
+            try:
+                replicas = int(replicas)
+                if replicas < 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                echo(f"Warning: invalid replicas '{cfg.get('replicas')}' for route '{router_name}'; ignoring it", fg='yellow')
+                replicas = None
+
+        healthcheck = cfg.get('healthcheck')
+        if isinstance(healthcheck, str):
+            healthcheck = {'path': healthcheck}
+        if healthcheck is not None and not (isinstance(healthcheck, dict) and str(healthcheck.get('path', '')).startswith('/')):
+            echo(f"Warning: healthcheck for route '{router_name}' needs a path starting with '/'; ignoring it", fg='yellow')
+            healthcheck = None
+
+        try:
+            middlewares = traefik_middleware_options(cfg)
+        except ValueError as e:
+            echo(f"Warning: invalid middleware for route '{router_name}': {e}; skipping it", fg='yellow')
+            continue
+
+        routes.append({
+            'router': router_name,
+            'service': service_name,
+            'rule': rule,
+            'paths': paths,
+            'strip_prefix': bool(cfg.get('strip_prefix', False)) and bool(paths),
+            'port': port,
+            'entrypoints': entrypoints,
+            'tls': bool(tls_enabled),
+            'certresolver': cfg.get('certresolver', 'default'),
+            'redirect': bool(cfg.get('enable_http_redirect', False)),
+            'priority': cfg.get('priority'),
+            'replicas': replicas,
+            'healthcheck': healthcheck,
+            'sticky': cfg.get('sticky', False),
+            'middlewares': middlewares,
+            'cache_service': cfg.get('cache_service'),
+        })
+    return routes
+
+
+def traefik_route_labels(route) -> dict:
+    """Traefik labels for one route: its router, load balancer and middlewares."""
+    router = f"traefik.http.routers.{route['router']}"
+    lb = f"traefik.http.services.{route['router']}.loadbalancer"
+    labels = {
+        "traefik.enable": "true",
+        f"{router}.rule": route['rule'],
+        f"{router}.entrypoints": ",".join(route['entrypoints']),
+        f"{router}.service": route['router'],
+        f"{lb}.server.port": str(route['port']),
+    }
+    if route['priority'] is not None:
+        labels[f"{router}.priority"] = str(route['priority'])
+    if route['tls']:
+        labels[f"{router}.tls"] = "true"
+        labels[f"{router}.tls.certresolver"] = route['certresolver']
+
+    healthcheck = route['healthcheck']
+    if healthcheck:
+        labels[f"{lb}.healthcheck.path"] = str(healthcheck['path'])
+        labels[f"{lb}.healthcheck.interval"] = str(healthcheck.get('interval', '10s'))
+        labels[f"{lb}.healthcheck.timeout"] = str(healthcheck.get('timeout', '3s'))
+    sticky = route['sticky']
+    if sticky:
+        labels[f"{lb}.sticky.cookie"] = "true"
+        labels[f"{lb}.sticky.cookie.httponly"] = "true"
+        if route['tls']:
+            labels[f"{lb}.sticky.cookie.secure"] = "true"
+        if isinstance(sticky, str):
+            labels[f"{lb}.sticky.cookie.name"] = sticky
+
+    middlewares = []
+    if route['redirect']:
+        # add middleware to redirect web -> websecure
+        labels[f"{router}.entrypoints"] = "websecure"
+        labels[f"traefik.http.middlewares.{route['router']}-redirect.redirectscheme.scheme"] = "https"
+        labels[f"traefik.http.middlewares.{route['router']}-redirect.redirectscheme.permanent"] = "true"
+        middlewares.append(f"{route['router']}-redirect")
+    for preset, options in route['middlewares'].items():
+        name = f"{route['router']}-{preset}"
+        for key, value in options.items():
+            labels[f"traefik.http.middlewares.{name}.{preset}.{key}"] = str(value)
+        if not options:
+            labels[f"traefik.http.middlewares.{name}.{preset}"] = "true"
+        middlewares.append(name)
+    if route['strip_prefix']:
+        labels[f"traefik.http.middlewares.{route['router']}-strip.stripprefix.prefixes"] = ",".join(route['paths'])
+        middlewares.append(f"{route['router']}-strip")
+    if middlewares:
+        labels[f"{router}.middlewares"] = ",".join(middlewares)
+    return labels
+
+
 def apply_traefik(app_name, compose_def, traefik_cfg):
     """Inject traefik service + labels based on a simplified traefik config block.
 
-    traefik_cfg expected keys:
+    traefik_cfg expected keys (per route, see traefik_routes):
       host: required hostname
       port: upstream service port (int/str)
       service: target service name (defaults to first service)
       entrypoints: list[str] (default ["websecure"])
       enable_http_redirect: bool (default False)
+      routes: list of routes overriding the keys above
+    and for the shared router:
       acme_email: str (default "admin@example.com")
       certresolver: str (default "default")
     """
@@ -317,123 +1048,63 @@ def apply_traefik(app_name, compose_def, traefik_cfg):
         echo("Warning: no services defined; skipping traefik label generation", fg='yellow')
         return
 
-    host = str(traefik_cfg.get('host', '')).strip()
-    if not host:
-        echo("Warning: 'traefik.host' missing; skipping traefik labels", fg='yellow')
-        return
-
-    # Support comma-separated hostnames; build an OR rule for compatibility
-    hostnames = [h.strip() for h in host.split(',') if h and h.strip()]
-    if not hostnames:
-        hostnames = [host]
-    if len(hostnames) == 1:
-        host_rule = f"Host(`{hostnames[0]}`)"
-    else:
-        host_rule = " || ".join([f"Host(`{h}`)" for h in hostnames])
-
-    service_name = traefik_cfg.get('service')
-    if not service_name:
-        # pick first declared service
-        service_name = next(iter(services.keys()))
-    if service_name not in services:
-        echo(f"Warning: traefik.service '{service_name}' not found; skipping traefik labels", fg='yellow')
+    routes = traefik_routes(app_name, traefik_cfg, services)
+    if not routes:
         return
 
-    port = traefik_cfg.get('port', None)
-    if port is None:
-        echo("Warning: 'traefik.port' missing; defaulting to 8000", fg='yellow')
-        port = 8000
-
-    entrypoints = traefik_cfg.get('entrypoints', ['websecure'])
-    if isinstance(entrypoints, str):
-        entrypoints = [entrypoints]
-    entrypoints = [str(e) for e in entrypoints if e]
-    if not entrypoints:
-        entrypoints = ['websecure']
-
-    certresolver = traefik_cfg.get('certresolver', 'default')
-    enable_redirect = bool(traefik_cfg.get('enable_http_redirect', False))
-    tls_enabled = traefik_cfg.get('tls')
-    if tls_enabled is None:
-        tls_enabled = 'websecure' in entrypoints
     acme_email = traefik_cfg.get('acme_email', 'admin@example.com')
     inject_service = bool(traefik_cfg.get('inject_service', True))
     acme_volume_external = bool(traefik_cfg.get('acme_volume_external', True))
 
-    target_service = services[service_name]
-
-    # Host network_mode services cannot be attached to traefik-proxy; skip labels.
-    if isinstance(target_service, dict) and target_service.get('network_mode'):
-        echo(f"Warning: service '{service_name}' uses network_mode; skipping Traefik labels and network attachment.", fg='yellow')
-        return
-
     # Shared traefik network/volume (external) so one Traefik can front multiple stacks
     network_name = traefik_cfg.get('network', 'traefik-proxy')
     volume_name = traefik_cfg.get('acme_volume', 'traefik-acme')
 
-    # Normalize labels container form (dict) for compose; stack deploy will map deploy.labels separately if needed.
-    labels = target_service.get('labels')
-    if labels is None:
-        labels = {}
-    elif isinstance(labels, list):
-        # convert list ['k=v'] into dict
-        converted = {}
-        for item in labels:
-            if '=' in item:
-                k, v = item.split('=', 1)
-                converted[k] = v
-        labels = converted
-    elif not isinstance(labels, dict):
-        labels = {}
-
-    router_name = app_name
-    service_key = app_name
-
-    labels[f"traefik.enable"] = "true"
-    labels[f"traefik.http.routers.{router_name}.rule"] = host_rule
-    labels[f"traefik.http.routers.{router_name}.entrypoints"] = ",".join(entrypoints)
-    labels[f"traefik.http.routers.{router_name}.service"] = service_key
-    labels[f"traefik.http.services.{service_key}.loadbalancer.server.port"] = str(port)
-    if tls_enabled:
-        labels[f"traefik.http.routers.{router_name}.tls"] = "true"
-        labels[f"traefik.http.routers.{router_name}.tls.certresolver"] = certresolver
-
-    if enable_redirect:
-        # add middleware to redirect web -> websecure
-        labels[f"traefik.http.routers.{router_name}.entrypoints"] = "websecure"
-        labels[f"traefik.http.middlewares.{router_name}-redirect.redirectscheme.scheme"] = "https"
-        labels[f"traefik.http.middlewares.{router_name}-redirect.redirectscheme.permanent"] = "true"
-        labels[f"traefik.http.routers.{router_name}.middlewares"] = f"{router_name}-redirect"
-
-    target_service['labels'] = labels
-    deploy = target_service.get('deploy', {}) if isinstance(target_service.get('deploy'), dict) else {}
-    deploy_labels = deploy.get('labels')
-    if deploy_labels is None:
-        deploy_labels = {}
-    elif isinstance(deploy_labels, list):
-        converted = {}
-        for item in deploy_labels:
-            if '=' in item:
-                k, v = item.split('=', 1)
-                converted[k] = v
-        deploy_labels = converted
-    elif not isinstance(deploy_labels, dict):
-        deploy_labels = {}
-    # mirror labels into deploy.labels for swarm compatibility
-    for k, v in labels.items():
-        deploy_labels[k] = v
-    deploy['labels'] = deploy_labels
-    target_service['deploy'] = deploy
-
-    # Attach to shared network
-    svc_networks = target_service.get('networks')
-    if svc_networks is None:
-        svc_networks = []
-    if isinstance(svc_networks, str):
-        svc_networks = [svc_networks]
-    if network_name not in svc_networks:
-        svc_networks.append(network_name)
-    target_service['networks'] = svc_networks
+    for route in routes:
+        service_name = route['service']
+        target_service = services[service_name]
+        # A cached route reaches the service through its sidecar, which gets the router and load balancer
+        routed_name = route['cache_service'] or service_name
+        routed_service = services[routed_name]
+
+        # Normalize labels container form (dict) for compose; mirrored into deploy.labels for swarm
+        labels = label_dict(routed_service.get('labels'))
+        labels.update(traefik_route_labels(route))
+        routed_service['labels'] = labels
+        routed_deploy = routed_service.get('deploy', {}) if isinstance(routed_service.get('deploy'), dict) else {}
+        deploy_labels = label_dict(routed_deploy.get('labels'))
+        for k, v in labels.items():
+            deploy_labels[k] = v
+        routed_deploy['labels'] = deploy_labels
+        routed_service['deploy'] = routed_deploy
+
+        deploy = target_service.get('deploy', {}) if isinstance(target_service.get('deploy'), dict) else {}
+        if route['replicas'] is not None:
+            if deploy.get('replicas') not in (None, route['replicas']):
+                echo(f"Warning: route '{route['router']}' changes replicas of '{service_name}' from {deploy['replicas']} to {route['replicas']}", fg='yellow')
+            deploy['replicas'] = route['replicas']
+            if route['replicas'] > 1:
+                # Traefik balances across every replica; fixed names and host ports would collide
+                if target_service.get('container_name'):
+                    echo(f"Warning: service '{service_name}' sets container_name, which prevents running {route['replicas']} replicas", fg='yellow')
+                if any(':' in str(p) for p in target_service.get('ports', []) or []):
+                    echo(f"Warning: service '{service_name}' publishes host ports; use 'expose' so replicas do not collide", fg='yellow')
+        target_service['deploy'] = deploy
+
+        # Attach to shared network
+        svc_networks = routed_service.get('networks')
+        if svc_networks is None:
+            svc_networks = []
+        if isinstance(svc_networks, str):
+            svc_networks = [svc_networks]
+        if isinstance(svc_networks, dict):
+            svc_networks.setdefault(network_name, None)
+        elif network_name not in svc_networks:
+            svc_networks.append(network_name)
+        routed_service['networks'] = svc_networks
+        if KATA_TRAEFIK_PROVIDER == 'file':
+            # The file provider addresses services by name, which must be unique on the shared network
+            add_network_alias(routed_service, network_name, f"{app_name}-{routed_name}")
 
     # Declare shared network as external
     networks = compose_def.get('networks', {})
@@ -457,26 +1128,292 @@ def apply_traefik(app_name, compose_def, traefik_cfg):
             if 'traefik' in services:
                 echo("Warning: traefik service already present in compose; skipping auto-injection", fg='yellow')
             else:
+                provider_args, provider_volumes = traefik_provider_args()
+                try:
+                    host_args, host_ports = traefik_host_args()
+                except ValueError as e:
+                    echo(f"Warning: ignoring {KATA_TRAEFIK_CONFIG}: {e}", fg='yellow')
+                    host_args, host_ports = [], []
                 services['traefik'] = {
                     'image': TRAEFIK_IMAGE,
-                    'command': [
-                        '--providers.docker=true',
-                        '--providers.docker.exposedbydefault=false',
+                    'command': provider_args + host_args + [
                         '--entrypoints.web.address=:80',
                         '--entrypoints.websecure.address=:443',
                         '--certificatesresolvers.default.acme.email=' + acme_email,
                         '--certificatesresolvers.default.acme.storage=/etc/traefik/acme.json',
                         '--certificatesresolvers.default.acme.httpchallenge.entrypoint=web'
                     ],
-                    'ports': ['80:80', '443:443'],
-                    'volumes': [
-                        '/var/run/docker.sock:/var/run/docker.sock:ro',
+                    'ports': ['80:80', '443:443'] + host_ports,
+                    'volumes': provider_volumes + [
                         f'{volume_name}:/etc/traefik'
                     ],
                     'networks': [network_name],
                     'restart': 'unless-stopped'
                 }
 
+def cache_options(value) -> dict:
+    """Validate a `cache` (or `x-kata-cache`) setting; returns None when caching is off.
+
+    Accepts true or a mapping with:
+      size: max cache size, e.g. 512m (default 1g)
+      memory: keep cached bodies in a tmpfs of `size` instead of a volume (default False)
+      keys_zone: shared memory for cache keys, ~8k keys per 1m (default 10m)
+      ttl: lifetime of 200/301 responses without Cache-Control/Expires (default 10m, 0 disables)
+      inactive: drop entries not requested for this long (default 1h)
+      rules: list of {path, ttl} overriding `ttl` for path prefixes (ttl 0 bypasses the cache)
+    Raises ValueError on bad input.
+    """
+    if value is None or value is False:
+        return None
+    if value is True:
+        value = {}
+    if not isinstance(value, dict):
+        raise ValueError("'cache' takes true or a mapping of options")
+    opts = {'size': '1g', 'memory': False, 'keys_zone': '10m', 'ttl': '10m', 'inactive': '1h', 'rules': [], **value}
+    unknown = set(opts) - {'size', 'memory', 'keys_zone', 'ttl', 'inactive', 'rules', 'service', 'port'}
+    if unknown:
+        raise ValueError(f"unknown cache option(s): {', '.join(sorted(unknown))}")
+    for key in ('size', 'keys_zone'):
+        opts[key] = str(opts[key]).strip().lower()
+        if not fullmatch(r'\d+[kmg]?', opts[key]):
+            raise ValueError(f"cache '{key}' must be a size like 512m or 1g, got '{opts[key]}'")
+    rules = opts['rules'] if isinstance(opts['rules'], list) else None
+    if rules is None or not all(isinstance(r, dict) and str(r.get('path', '')).startswith('/') for r in rules):
+        raise ValueError("cache 'rules' must be a list of {path, ttl} with paths starting with '/'")
+    for holder, key in [(opts, 'ttl'), (opts, 'inactive')] + [(r, 'ttl') for r in rules]:
+        holder[key] = str(holder.get(key, opts['ttl'])).strip()
+        if not fullmatch(r'(\d+[smhdwMy]?)+', holder[key]):
+            raise ValueError(f"cache '{key}' must be a duration like 30s, 10m or 1d, got '{holder[key]}'")
+    if any(c in str(r['path']) for r in rules for c in ' ;{}"\'$'):
+        raise ValueError("cache rule paths must not contain spaces, quotes, braces, ';' or '$'")
+    opts['memory'] = bool(opts['memory'])
+    return opts
+
+
+def cache_nginx_conf(upstream: str, opts: dict) -> str:
+    """Render the nginx.conf run by a kata/cache sidecar in front of `upstream` (host:port)."""
+    def location(path, ttl):
+        if ttl.strip('0') == '':
+            return f"        location {path} {{\n            proxy_cache off;\n            proxy_pass http://app;\n        }}\n"
+        return (f"        location {path} {{\n            proxy_cache_valid 200 301 {ttl};\n"
+                f"            proxy_pass http://app;\n        }}\n")
+
+    locations = location('/', opts['ttl'])
+    for rule in opts['rules']:
+        if rule['path'] != '/':
+            locations += location(rule['path'], rule['ttl'])
+        else:
+            locations = location('/', rule['ttl'])
+    return f"""worker_processes auto;
+events {{
+    worker_connections 4096;
+}}
+http {{
+    access_log off;
+    resolver 127.0.0.11 valid=10s ipv6=off;
+    proxy_cache_path {CACHE_PATH} levels=1:2 keys_zone=kata:{opts['keys_zone']} max_size={opts['size']} inactive={opts['inactive']} use_temp_path=off;
+    upstream app {{
+        zone app 64k;
+        server {upstream} resolve;
+        keepalive 32;
+    }}
+    server {{
+        listen {CACHE_PORT};
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host $host;
+        proxy_cache kata;
+        proxy_cache_key $host$request_uri;
+        proxy_cache_lock on;
+        proxy_cache_background_update on;
+        proxy_cache_use_stale error timeout updating http_500 http_502 http_503 http_504;
+        proxy_cache_bypass $http_authorization;
+        proxy_no_cache $http_authorization;
+        add_header X-Cache-Status $upstream_cache_status always;
+{locations}    }}
+}}
+"""
+
+
+def apply_cache(app_name, compose_def, traefik_cfg):
+    """Put a kata/cache sidecar in front of every routed service that has `cache` set.
+
+    Records the sidecar on those routes (as `cache_service`), so apply_traefik labels
+    `<service>-cache` (`<service>-cache-<port>` for further ports) for the router while
+    replicas still apply to the service it proxies to over the app's own network.
+    """
+    services = compose_def.get('services', {})
+    if not traefik_cfg or not isinstance(traefik_cfg, dict) or not services:
+        return
+    route_cfgs = traefik_cfg.get('routes')
+    route_cfgs = route_cfgs if isinstance(route_cfgs, list) else [traefik_cfg]
+    defaults = {k: v for k, v in traefik_cfg.items() if k != 'routes'}
+    upstreams = {}  # sidecar name -> the service port it proxies to
+    sidecar_opts = {}  # sidecar name -> the cache options it was created with
+    for route_cfg in route_cfgs:
+        if not isinstance(route_cfg, dict):
+            continue
+        cfg = {**defaults, **route_cfg}
+        opts = cache_options(cfg.get('cache'))
+        if not opts:
+            continue
+        service_name = opts.get('service') or cfg.get('service') or next(iter(services.keys()))
+        target = services.get(service_name)
+        if not isinstance(target, dict) or target.get('network_mode'):
+            echo(f"Warning: cannot cache service '{service_name}'; routing to it directly", fg='yellow')
+            continue
+        port = str(opts.get('port') or cfg.get('port') or 8000)
+        healthcheck = cfg.get('healthcheck')
+        health_path = str(healthcheck.get('path', '') if isinstance(healthcheck, dict) else healthcheck or '')
+        if health_path.startswith('/') and not any(c in health_path for c in ' ;{}"\'$'):
+            # Traefik probes through the sidecar, so the probe must reach the service rather than the cache
+            opts['rules'] = opts['rules'] + [{'path': health_path, 'ttl': '0'}]
+        opts.pop('service', None)
+        opts.pop('port', None)
+        cache_name = f"{service_name}-cache"
+        if upstreams.setdefault(cache_name, port) != port:
+            # Another route caches this service on a different port; give this one its own sidecar
+            cache_name = f"{service_name}-cache-{port}"
+            upstreams[cache_name] = port
+        route_cfg['service'] = service_name
+        route_cfg['cache_service'] = cache_name
+        route_cfg['port'] = CACHE_PORT
+        if cache_name in sidecar_opts:
+            if sidecar_opts[cache_name] != opts:
+                echo(f"Warning: routes caching '{service_name}' on port {port} set different cache options; "
+                     f"'{cache_name}' uses those of the first route", fg='yellow')
+            continue
+        sidecar_opts[cache_name] = opts
+        if cache_name in services:
+            continue
+
+        if not docker_ensure_runtime_image('kata/cache'):
+            exit(1)
+        # A per-app alias keeps the upstream name unique even on shared networks like traefik-proxy
+        alias = f"{app_name}-{service_name}"
+        networks = target.get('networks') or ['default']
+        names = [networks] if isinstance(networks, str) else list(networks)
+        first = 'default' if 'default' in names else names[0]
+        target['networks'] = networks
+        add_network_alias(target, first, alias)
+
+        echo(f"-----> Caching '{service_name}' through '{cache_name}' ({opts['size']}{' in memory' if opts['memory'] else ''})", fg='green')
+        cache_service = {
+            'image': 'kata/cache',
+            # compose interpolates $name, so nginx variables need escaping
+            'environment': {'KATA_CACHE_CONF': cache_nginx_conf(f"{alias}:{port}", opts).replace('$', '$$')},
+            'labels': {'kata.cache': service_name},
+            'networks': [first],
+            'depends_on': [service_name],
+            'restart': 'unless-stopped',
+        }
+        if opts['memory']:
+            cache_service['tmpfs'] = [f"{CACHE_PATH}:size={opts['size']}"]
+            # tmpfs pages are charged to the container, so leave room for nginx itself
+            cache_service['mem_limit'] = format_memory(memory_bytes(opts['size']) + 128 * 1024 ** 2)
+        else:
+            compose_def.setdefault('volumes', {})[cache_name] = {}
+            cache_service['volumes'] = [f"{cache_name}:{CACHE_PATH}"]
+        services[cache_name] = cache_service
+
+# Label segments are case-insensitive, dynamic configuration files are not
+TRAEFIK_KEY_CASE = {k.lower(): k for k in (
+    'entryPoints', 'certResolver', 'loadBalancer', 'healthCheck', 'httpOnly', 'sameSite', 'passHostHeader',
+    'redirectScheme', 'stripPrefix', 'rateLimit', 'inFlightReq', 'circuitBreaker', 'checkPeriod',
+    'fallbackDuration', 'recoveryDuration', 'responseCode', 'initialInterval', 'maxRequestBodyBytes',
+    'memRequestBodyBytes', 'maxResponseBodyBytes', 'memResponseBodyBytes', 'retryExpression',
+    'minResponseBodyBytes', 'excludedContentTypes', 'includedContentTypes', 'serversTransport')}
+TRAEFIK_LIST_KEYS = {'entryPoints', 'middlewares', 'prefixes', 'excludedContentTypes', 'includedContentTypes', 'encodings'}
+TRAEFIK_STRUCT_KEYS = {'tls', 'compress', 'cookie', 'buffering'}  # `key=true` in labels means an empty section
+
+
+def traefik_dynamic_config(app: str, compose_def: dict, mode: str) -> dict:
+    """Translate the Traefik labels of a generated compose file into file-provider configuration.
+
+    Load balancers point at the app's containers by name on the shared network:
+    compose replicas individually (`<app>-<service>-<n>`), swarm services through
+    their `<app>-<service>` alias.
+    """
+    config = {}
+    ports = {}
+    services = compose_def.get('services', {}) if isinstance(compose_def, dict) else {}
+    for service_name, service in services.items():
+        if not isinstance(service, dict):
+            continue
+        deploy = service.get('deploy') if isinstance(service.get('deploy'), dict) else {}
+        labels = {**label_dict(service.get('labels')), **label_dict(deploy.get('labels'))}
+        if str(labels.get('traefik.enable', '')).lower() != 'true':
+            continue
+        for key, value in labels.items():
+            parts = key.split('.')[1:]
+            if len(parts) < 4 or parts[0] != 'http':
+                continue
+            parts = parts[:3] + [TRAEFIK_KEY_CASE.get(part.lower(), part.lower()) for part in parts[3:]]
+            if parts[1] == 'services' and parts[3:] == ['loadBalancer', 'server', 'port']:
+                ports[parts[2]] = (service_name, str(value))
+                continue
+            node = config
+            for part in parts[:-1]:
+                if not isinstance(node.get(part), dict):
+                    node[part] = {}
+                node = node[part]
+            leaf, value = parts[-1], str(value)
+            if isinstance(node.get(leaf), dict):
+                continue
+            if leaf in TRAEFIK_STRUCT_KEYS and value.lower() == 'true':
+                node[leaf] = {}
+            elif leaf in TRAEFIK_LIST_KEYS:
+                node[leaf] = as_list(value)
+            elif value.lower() in ('true', 'false'):
+                node[leaf] = value.lower() == 'true'
+            elif fullmatch(r'\d+', value):
+                node[leaf] = int(value)
+            else:
+                node[leaf] = value
+
+    for lb_name, (service_name, port) in ports.items():
+        service = services[service_name]
+        deploy = service.get('deploy') if isinstance(service.get('deploy'), dict) else {}
+        if mode == 'swarm':
+            hosts = [f"{app}-{service_name}"]
+        elif service.get('container_name'):
+            hosts = [service['container_name']]
+        else:
+            replicas = get_scale_overrides(app).get(service_name, deploy.get('replicas', 1))
+            hosts = [f"{app}-{service_name}-{i}" for i in range(1, int(replicas or 1) + 1)]
+        lb = config.setdefault('http', {}).setdefault('services', {}).setdefault(lb_name, {}).setdefault('loadBalancer', {})
+        lb['servers'] = [{'url': f"http://{host}:{port}"} for host in hosts]
+    return config
+
+
+def write_traefik_dynamic(app: str, compose_path: str) -> None:
+    """Atomically (re)write an app's file-provider config from its generated compose file."""
+    if KATA_TRAEFIK_PROVIDER != 'file':
+        return
+    try:
+        compose_def = safe_load(open(compose_path, 'r', encoding='utf-8')) or {}
+        config = traefik_dynamic_config(app, compose_def, get_app_mode(app))
+        makedirs(TRAEFIK_DYNAMIC_ROOT, exist_ok=True)
+        path = join(TRAEFIK_DYNAMIC_ROOT, f"{app}.yaml")
+        if not config:
+            remove_traefik_dynamic(app)
+            return
+        # Traefik only loads *.yaml/*.yml/*.toml, so it never sees the half-written temp file
+        tmp = join(TRAEFIK_DYNAMIC_ROOT, f".{app}.yaml.{getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(safe_dump(config, default_flow_style=False))
+        replace(tmp, path)
+    except Exception as e:
+        echo(f"Warning: could not write Traefik config for '{app}': {e}", fg='yellow')
+
+
+def remove_traefik_dynamic(app: str) -> None:
+    """Drop an app's file-provider config so Traefik stops routing to it."""
+    path = join(TRAEFIK_DYNAMIC_ROOT, f"{app}.yaml")
+    if exists(path):
+        remove(path)
+
+
 # === Utility functions ===
 
 def echo(message, fg=None, nl=True, err=False) -> None:
@@ -484,6 +1421,27 @@ def echo(message, fg=None, nl=True, err=False) -> None:
     click_echo(message, color=True if fg else None, nl=nl, err=err)
 
 
+def record_metric(event: str, **fields) -> None:
+    """Append an event to METRICS_ROOT/events.jsonl for `kata metrics:serve`; never fails the caller."""
+    try:
+        makedirs(METRICS_ROOT, exist_ok=True)
+        path = join(METRICS_ROOT, 'events.jsonl')
+        while True:
+            with open(path, 'a', encoding='utf-8') as handle:
+                flock(handle, LOCK_EX)
+                # Another writer may have rotated the file while we waited; append to the new one
+                if not exists(path) or not samestat(fstat(handle.fileno()), stat(path)):
+                    continue
+                handle.write(dumps({'event': event, 'at': round(time(), 3), **fields}) + "\n")
+                handle.flush()
+                if handle.tell() >= KATA_METRICS_MAX_BYTES:
+                    # the reader finishes the rotated file by inode before moving on
+                    replace(path, path + '.1')
+                return
+    except Exception:
+        pass
+
+
 def base_env(app, env=None) -> dict:
     """Get the environment variables for an app"""
     base = {'PGID': str(PGID), 'PUID': str(PUID)}
@@ -560,18 +1518,49 @@ def setup_authorized_keys(ssh_fingerprint, script_path, pubkey):
 def docker_check_image_exists(image_name):
     """Check if a Docker image exists locally"""
     output = check_output(['docker', 'image', 'list', '--format', '{{.Repository}}:{{.Tag}}'], stderr=STDOUT, universal_newlines=True)
-    if image_name in output:
+    wanted = image_name if ':' in image_name.rsplit('/', 1)[-1] else f"{image_name}:latest"
+    return wanted in output.split()
+
+
+def runtime_image_parent(image_name: str):
+    """The built-in kata/* image a runtime image is built FROM, if any"""
+    parents = findall(r'(?m)^FROM\s+(kata/\S+)', RUNTIME_IMAGES.get(image_name, ''))
+    return parents[0] if parents else None
+
+
+def runtime_image_descendants(image_name: str) -> list:
+    """Built-in images derived (directly or not) from `image_name`, in build order"""
+    found = [image_name]
+    for image in RUNTIME_IMAGES:
+        if runtime_image_parent(image) in found:
+            found.append(image)
+    return found[1:]
+
+
+def docker_ensure_runtime_image(image_name: str) -> bool:
+    """Build a built-in runtime image, and the kata/* images it derives from, unless present"""
+    if docker_check_image_exists(image_name):
         return True
-    return False
+    parent = runtime_image_parent(image_name)
+    if parent and not docker_ensure_runtime_image(parent):
+        return False
+    return docker_create_runtime_image(image_name, RUNTIME_IMAGES[image_name])
 
 
 def docker_create_runtime_image(image_name, dockerfile_content):
     """Create a Docker image from a Dockerfile content"""
+    started = time()
     try:
         with NamedTemporaryFile(delete=False, mode='w', suffix='.Dockerfile') as dockerfile:
             dockerfile.write(dockerfile_content)
             dockerfile_path = dockerfile.name
-        output = check_output(['docker', 'build', '-t', image_name, '-f', dockerfile_path, '.'], stderr=STDOUT, universal_newlines=True)
+        # Stream build output so it shows up live and in the deploy log
+        ok = call(['docker', 'build', '-t', image_name, '-f', dockerfile_path, '.'],
+                  stdout=stdout, stderr=stderr, universal_newlines=True) == 0
+        record_metric('image_build', image=image_name, seconds=time() - started, ok=ok)
+        if not ok:
+            echo(f"Error creating image: docker build failed for '{image_name}'", fg='red')
+            return False
         echo(f"Created '{image_name}' successfully.", fg='green')
         return True
     except Exception as e:
@@ -610,9 +1599,14 @@ def docker_rebuild_runtime(runtime: str) -> bool:
     if not dockerfile_content:
         echo(f"Error: unknown runtime '{runtime}'. Valid: {', '.join([i.split('/',1)[1] for i in RUNTIME_IMAGES.keys()])}", fg='red')
         return False
-    echo(f"-----> Rebuilding {image_name}", fg='yellow')
-    docker_remove_image(image_name, warn=False)
-    return docker_create_runtime_image(image_name, dockerfile_content)
+    all_ok = True
+    # Derived images (kata/<runtime>-build, or everything for kata/base) would keep the old layers
+    for image_name in [image_name] + runtime_image_descendants(image_name):
+        echo(f"-----> Rebuilding {image_name}", fg='yellow')
+        docker_remove_image(image_name, warn=False)
+        if not docker_create_runtime_image(image_name, RUNTIME_IMAGES[image_name]):
+            all_ok = False
+    return all_ok
 
 
 def docker_remove_runtime_images() -> None:
@@ -622,50 +1616,216 @@ def docker_remove_runtime_images() -> None:
         docker_remove_image(image_name, warn=True)
 
 
-def docker_handle_runtime_environment(app_name, runtime, destroy=False, env=None):
-    image = f"kata/{runtime}"
-    if not docker_check_image_exists(image) and not destroy:
-        if not docker_create_runtime_image(image, RUNTIME_IMAGES[image]):
-            exit(1)
+def runtime_image_report(runs: int = 3) -> list:
+    """Size, size over its kata/* parent, and median container cold start for each built-in image"""
+    rows = []
+    sizes = {}
+    for image in RUNTIME_IMAGES:
+        row = {'image': image, 'parent': runtime_image_parent(image), 'size': None, 'own_size': None, 'cold_start_ms': None}
+        rows.append(row)
+        try:
+            sizes[image] = row['size'] = int(check_output(['docker', 'image', 'inspect', '-f', '{{.Size}}', image],
+                                                           stderr=DEVNULL, universal_newlines=True).strip())
+        except Exception:
+            continue
+        # Layers shared with the parent are stored once; only the difference costs disk and pulls
+        row['own_size'] = row['size'] - sizes.get(row['parent'], 0)
+        timings = []
+        for _ in range(runs):
+            started = time()
+            if call(['docker', 'run', '--rm', '--network', 'none', '--entrypoint', 'true', image],
+                    stdout=DEVNULL, stderr=DEVNULL) != 0:
+                break
+            timings.append(time() - started)
+        if timings:
+            row['cold_start_ms'] = round(sorted(timings)[len(timings) // 2] * 1000)
+    return rows
+
+
+def docker_wipe_paths(paths: list) -> None:
+    """Delete host directories that may hold root-owned files created inside containers.
+
+    Contents are removed from inside a root BusyBox container first (this avoids
+    host-side PermissionError), then the now-empty directories are removed with rmtree().
+    """
+    mounts: list[str] = []
+    targets: list[str] = []
+    for index, host_path in enumerate(paths):
+        if exists(host_path):
+            mounts += ['-v', f"{realpath(host_path)}:/wipe/{index}"]
+            targets.append(f"/wipe/{index}")
+
+    if mounts:
+        try:
+            # Run BusyBox as root (explicitly). On bind mounts this can delete root-owned files.
+            # Note: on rootless Docker / userns remap, ownership semantics may differ.
+            # It cannot remove the mountpoint itself, so host-side rmtree() finishes the job.
+            wipe_script = (
+                "for d; do "
+                "rm -rf \"$d\" 2>/dev/null || true; "
+                "done"
+            )
+            call(['docker', 'run', '--rm', '--user', '0:0'] + mounts
+                 + ['busybox:stable-musl', 'sh', '-c', wipe_script, 'sh'] + targets,
+                 stdout=stdout, stderr=stderr, universal_newlines=True)
+        except Exception as exc:
+            echo(f"Warning: container-side removal failed: {exc}", fg='yellow')
+
+    for path in paths:
+        if not exists(path):
+            continue
+        try:
+            rmtree(path)
+        except Exception as e:
+            echo(f"Error removing {path}: {str(e)}", fg='red')
+
+
+def runtime_install_image(runtime: str) -> str:
+    """Image that runs a runtime's install steps: its -build variant when there is one"""
+    return f"kata/{runtime}-build" if f"kata/{runtime}-build" in RUNTIME_IMAGES else f"kata/{runtime}"
+
+
+def docker_handle_runtime_environment(app_name, runtime, env=None, app_path=None, packages=None):
+    image = runtime_install_image(runtime)
+    if not docker_ensure_runtime_image(image):
+        exit(1)
+    if app_path is None:
+        app_path = app_code_path(app_name)
     volumes = [
-        "-v", f"{join(APP_ROOT, app_name)}:/app",
+        "-v", f"{app_path}:/app",
         "-v", f"{join(CONFIG_ROOT, app_name)}:/config",
         "-v", f"{join(DATA_ROOT, app_name)}:/data",
         "-v", f"{join(ENV_ROOT, app_name)}:/venv"
     ]
-    if destroy:
-        cmds = {
-            'python': [['chown', '-hR', f'{PUID}:{PGID}', '/data'],
-                       ['chown', '-hR', f'{PUID}:{PGID}', '/app'],
-                       ['chown', '-hR', f'{PUID}:{PGID}', '/venv'],
-                       ['chown', '-hR', f'{PUID}:{PGID}', '/config']],
-            'nodejs': [['chown', '-hR', f'{PUID}:{PGID}', '/data'],
-                       ['chown', '-hR', f'{PUID}:{PGID}', '/app'],
-                       ['chown', '-hR', f'{PUID}:{PGID}', '/venv'],
-                       ['chown', '-hR', f'{PUID}:{PGID}', '/config']],
-            'php': [['chown', '-hR', f'{PUID}:{PGID}', '/data'],
-                    ['chown', '-hR', f'{PUID}:{PGID}', '/app'],
-                    ['chown', '-hR', f'{PUID}:{PGID}', '/venv'],
-                    ['chown', '-hR', f'{PUID}:{PGID}', '/config']],
-            'bun': [['chown', '-hR', f'{PUID}:{PGID}', '/data'],
-                    ['chown', '-hR', f'{PUID}:{PGID}', '/app'],
-                    ['chown', '-hR', f'{PUID}:{PGID}', '/venv'],
-                    ['chown', '-hR', f'{PUID}:{PGID}', '/config']],
-            'static': []
-        }
-    else:
-        cmds = {
-            'python': [['python3', '-m', 'venv', '/venv'],
-                       ['pip3', 'install', '-r', '/app/requirements.txt']],
-            'nodejs': [['npm', 'install']],
-            'php': [['composer', 'install', '--no-dev', '--optimize-autoloader']],
-            'bun': [['bun', 'install']],
-            'static': []
-        }
+    cmds = {
+        'python': [['python3', '-m', 'venv', '/venv'],
+                   ['pip3', 'install', '-r', '/app/requirements.txt'] + sorted(packages or []),
+                   ['python3', '-m', 'compileall', '-q', '-j', '0', '/venv'],
+                   ['python3', '-m', 'compileall', '-q', '-j', '0', '-x', r'/\.git/', '/app']],
+        'nodejs': [node_install_command('nodejs', app_path)],
+        'php': [['composer', 'install', '--no-dev', '--optimize-autoloader']],
+        'bun': [node_install_command('bun', app_path)],
+        'static': [['kata-precompress', (env or {}).get('DOCROOT', '/app')]]
+    }
+    # Keep installs from starving running apps
+    limits = []
+    if KATA_INSTALL_CPUS:
+        limits += ['--cpus', KATA_INSTALL_CPUS]
+    if KATA_INSTALL_MEMORY:
+        limits += ['--memory', KATA_INSTALL_MEMORY]
+    started = time()
+    ok = True
     for cmd in cmds.get(runtime, []):
         echo(f"Running: {' '.join(cmd)}", fg='green')
-        call(['docker', 'run', '--rm'] + volumes + ['-i', f'kata/{runtime}'] + cmd,
-             cwd=join(APP_ROOT, app_name), env=env, stdout=stdout, stderr=stderr, universal_newlines=True)
+        code = call(['docker', 'run', '--rm'] + limits + volumes + ['-i', image] + cmd,
+                    cwd=app_path, env=env, stdout=stdout, stderr=stderr, universal_newlines=True)
+        if code == 137:
+            # SIGKILL, which for an installer almost always means the OOM killer
+            hint = f"raise KATA_INSTALL_MEMORY (currently {KATA_INSTALL_MEMORY})" if KATA_INSTALL_MEMORY else "the host ran out of memory"
+            echo(f"Error: '{' '.join(cmd)}' was killed (exit code 137), most likely out of memory; {hint}", fg='red')
+        ok = code == 0 and ok
+    if cmds.get(runtime):
+        record_metric('install', app=app_name, runtime=runtime, seconds=time() - started, ok=ok)
+
+
+def node_install_command(runtime: str, app_path: str) -> list:
+    """Production-only install; a clean, lockfile-exact one when the app ships a lockfile"""
+    def has(*names):
+        return any(exists(join(app_path, name)) for name in names)
+    if runtime == 'bun':
+        return ['bun', 'install', '--production'] + (['--frozen-lockfile'] if has('bun.lock', 'bun.lockb') else [])
+    if has('package-lock.json', 'npm-shrinkwrap.json'):
+        return ['npm', 'ci', '--omit=dev']
+    if has('yarn.lock'):
+        return ['yarnpkg', 'install', '--frozen-lockfile', '--production']
+    return ['npm', 'install', '--omit=dev']
+
+
+def node_cluster_command(code_path: str, runtime: str, cluster, command) -> list:
+    """Wrap a nodejs/bun service's entry script in the cluster launcher; raises ValueError"""
+    if cluster is True or cluster == 'auto':
+        cluster = {}
+    elif isinstance(cluster, int) and not isinstance(cluster, bool):
+        cluster = {'workers': cluster}
+    if not isinstance(cluster, dict):
+        raise ValueError("'cluster' must be true, a worker count or a mapping")
+    unknown = set(cluster) - {'workers', 'entry'}
+    if unknown:
+        raise ValueError(f"unknown 'cluster' settings: {', '.join(sorted(unknown))}")
+    workers = cluster.get('workers', 'auto')
+    if workers != 'auto' and (not isinstance(workers, int) or isinstance(workers, bool) or workers < 1):
+        raise ValueError("'cluster.workers' must be 'auto' or a positive integer")
+    binary = 'bun' if runtime == 'bun' else 'node'
+    args = []
+    entry = cluster.get('entry')
+    if not entry and command:
+        # Reuse the script (and its arguments) from `node app.js ...` / `bun server.ts ...`
+        argv = split(command) if isinstance(command, str) else [str(arg) for arg in command]
+        if len(argv) < 2 or argv[0] not in ('node', 'bun') or argv[1].startswith('-') or argv[1] == 'run':
+            raise ValueError(f"cannot cluster '{' '.join(argv)}'; set 'cluster.entry' to the server script")
+        entry, args = argv[1], argv[2:]
+    if not entry:
+        try:
+            with open(join(code_path, 'package.json'), 'r', encoding='utf-8') as f:
+                entry = loads(f.read()).get('main')
+        except (OSError, ValueError, AttributeError):
+            pass
+    entry = entry or ('index.js' if runtime == 'bun' else 'app.js')
+    return [binary, NODE_CLUSTER_SCRIPT, str(workers), str(entry)] + args
+
+
+def detect_python_app(code_path: str) -> tuple:
+    """Find a WSGI/ASGI app in a checkout; returns (interface, 'module:attribute') or (None, None)"""
+    seen = set()
+    for pattern in PYTHON_ENTRYPOINTS:
+        for path in sorted(glob(join(code_path, pattern))):
+            if path in seen or not isfile(path):
+                continue
+            seen.add(path)
+            try:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    source = f.read()
+            except OSError:
+                continue
+            module = relpath(path, code_path)[:-len('.py')].replace('/', '.').removesuffix('.__init__')
+            for attribute, factory in findall(r'(?m)^(\w+)\s*(?::[^=\n]*)?=\s*([\w.]+)\(', source):
+                for interface, factories in PYTHON_APP_FACTORIES.items():
+                    if any(factory == name or factory.endswith('.' + name) for name in factories):
+                        return interface, f"{module}:{attribute}"
+    return None, None
+
+
+def python_server_command(code_path: str, server) -> tuple:
+    """Resolve a service's `server:` option to (command, pip requirement); raises ValueError"""
+    if server is None or isinstance(server, str):
+        server = {'name': server or 'auto'}
+    if not isinstance(server, dict):
+        raise ValueError("'server' must be a server name or a mapping")
+    unknown = set(server) - {'name', 'app', 'interface', 'workers'}
+    if unknown:
+        raise ValueError(f"unknown 'server' settings: {', '.join(sorted(unknown))}")
+    name, interface, target = server.get('name', 'auto'), server.get('interface'), server.get('app')
+    if not target:
+        detected, target = detect_python_app(code_path)
+        if not target:
+            raise ValueError("no WSGI/ASGI app found; set 'server.app' to 'module:attribute'")
+        interface = interface or detected
+    interface = interface or 'wsgi'
+    if interface not in PYTHON_DEFAULT_SERVERS:
+        raise ValueError(f"'server.interface' must be one of: {', '.join(PYTHON_DEFAULT_SERVERS)}")
+    if name == 'auto':
+        name = PYTHON_DEFAULT_SERVERS[interface]
+    if name not in PYTHON_SERVERS:
+        raise ValueError(f"'server.name' must be 'auto' or one of: {', '.join(PYTHON_SERVERS)}")
+    requirement, interfaces = PYTHON_SERVERS[name]
+    if interface not in interfaces:
+        raise ValueError(f"{name} cannot serve {interface.upper()} apps")
+    command = ['kata-serve', name, interface, str(target)]
+    if server.get('workers') is not None:
+        if not isinstance(server['workers'], int) or isinstance(server['workers'], bool) or server['workers'] < 1:
+            raise ValueError("'server.workers' must be a positive integer")
+        command.append(str(server['workers']))
+    return command, requirement
 
 # === App Management ===
 
@@ -679,6 +1839,47 @@ def exit_if_invalid(app, deployed=False):
     return app
 
 
+def select_apps(patterns, all_apps: bool = False) -> list:
+    """Resolve app names and shell-style globs (or --all) to deployed apps; exit if none match"""
+    deployed = sorted(a for a in listdir(APP_ROOT) if not a.startswith('.')) if exists(APP_ROOT) else []
+    if all_apps:
+        selected = deployed
+    else:
+        selected = []
+        for pattern in patterns:
+            if any(c in pattern for c in '*?['):
+                matches = [a for a in deployed if fnmatch(a, pattern)]
+            else:
+                matches = [exit_if_invalid(pattern)]
+            selected.extend(m for m in matches if m not in selected)
+    if not selected:
+        echo("Error: no matching apps (give app names, globs or --all)", fg='red')
+        exit(1)
+    return selected
+
+
+def run_fleet(action, apps: list, jobs: int = KATA_FLEET_JOBS) -> None:
+    """Run `action(app)` over apps with a bounded worker pool; report per app and exit 1 on any failure"""
+    def run_one(app):
+        try:
+            return action(app) is not False
+        except SystemExit as e:
+            return e.code in (None, 0)
+        except Exception as e:
+            echo(f"Error: {app}: {e}", fg='red')
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(apps)))) as pool:
+        results = dict(zip(apps, pool.map(run_one, apps)))
+    failed = [app for app, ok in results.items() if not ok]
+    if len(apps) > 1:
+        echo(f"-----> {len(apps) - len(failed)}/{len(apps)} apps succeeded", fg='green' if not failed else 'yellow')
+        for app, ok in results.items():
+            echo(f"  {'ok    ' if ok else 'FAILED'} {app}", fg='green' if ok else 'red')
+    if failed:
+        exit(1)
+
+
 def sanitize_app_name(app) -> str:
     """Sanitize the app name"""
     if app:
@@ -686,11 +1887,1126 @@ def sanitize_app_name(app) -> str:
     return app
 
 
-def parse_compose(app_name, filename) -> tuple:
-    """Parses the kata-compose.yaml"""
+# === Logs ===
+
+class RotatingLog:
+    """Append-only text log that is gzip-compressed and rotated when it reaches max_bytes.
+
+    Rotated files are named <stem>-<timestamp>.log.gz next to the live file; only the
+    newest `keep` are retained.
+    """
+
+    def __init__(self, path: str, max_bytes: int = KATA_LOG_MAX_BYTES, keep: int = KATA_LOG_KEEP):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+        makedirs(dirname(path), exist_ok=True)
+        self.handle = open(path, 'a', encoding='utf-8')
+
+    def write(self, text: str) -> None:
+        self.handle.write(text)
+        if self.handle.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self) -> None:
+        self.handle.close()
+        stem = self.path[:-4] if self.path.endswith('.log') else self.path
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        with open(self.path, 'rb') as src, gzip_open(f"{stem}-{stamp}.log.gz", 'wb') as dst:
+            copyfileobj(src, dst)
+        remove(self.path)
+        prefix = basename(stem) + '-'
+        rotated = sorted(name for name in listdir(dirname(self.path))
+                         if name.startswith(prefix) and name.endswith('.log.gz'))
+        for name in rotated[:-self.keep] if self.keep > 0 else rotated:
+            remove(join(dirname(self.path), name))
+        self.handle = open(self.path, 'a', encoding='utf-8')
+
+    def close(self) -> None:
+        self.handle.close()
+
+
+def log_sort_key(timestamp: str) -> str:
+    """Make Docker's RFC3339Nano timestamps (trailing zeros trimmed) sort correctly as strings."""
+    base, _, fraction = timestamp.rstrip('Z').partition('.')
+    return f"{base}.{fraction.ljust(9, '0')}"
+
+
+def app_log_sources(app: str, services: tuple, follow: bool, since: str, tail: str) -> list:
+    """Return (label, command) pairs producing timestamped logs for an app's containers or tasks."""
+    flags = ['--timestamps', '--tail', str(tail)]
+    if follow:
+        flags.append('--follow')
+    if since:
+        flags += ['--since', since]
+    sources = []
+    if get_app_mode(app) == 'swarm':
+        names = check_output(['docker', 'stack', 'services', app, '--format', '{{.Name}}'],
+                             stderr=DEVNULL, universal_newlines=True).split()
+        for name in names:
+            if not services or name[len(app) + 1:] in services:
+                # task context ("<task>@<node> | ") is part of each line
+                sources.append((None, ['docker', 'service', 'logs', '--no-trunc'] + flags + [name]))
+        return sources
+    rows = check_output(['docker', 'ps', '-a', '--filter', f'label=com.docker.compose.project={app}',
+                         '--format', '{{.Names}}\t{{.Label "com.docker.compose.service"}}'],
+                        stderr=DEVNULL, universal_newlines=True).splitlines()
+    for row in sorted(rows):
+        name, _, service = row.partition('\t')
+        if not services or service in services:
+            label = name[len(app) + 1:] if name.startswith(app + '-') else name
+            sources.append((label, ['docker', 'logs'] + flags + [name]))
+    return sources
+
+
+def read_log_source(label, cmd):
+    """Yield (sort_key, timestamp, source, message) for each line one log command prints."""
+    proc = Popen(cmd, stdout=PIPE, stderr=STDOUT, universal_newlines=True, errors='replace')
+    try:
+        for line in proc.stdout:
+            timestamp, _, message = line.rstrip('\n').partition(' ')
+            source = label
+            if source is None:
+                source, _, message = message.partition(' | ')
+                source = source.strip()
+            yield (log_sort_key(timestamp), timestamp, source, message)
+    finally:
+        if proc.poll() is None:
+            proc.terminate()
+        proc.wait()
+
+
+def follow_log_sources(sources: list):
+    """Merge live log streams, holding at most KATA_LOG_BUFFER lines to restore time order."""
+    incoming = Queue(maxsize=KATA_LOG_BUFFER)
+    done = object()
+
+    def pump(label, cmd):
+        for entry in read_log_source(label, cmd):
+            incoming.put(entry)
+        incoming.put(done)
+
+    for label, cmd in sources:
+        Thread(target=pump, args=(label, cmd), daemon=True).start()
+    running = len(sources)
+    pending = []  # heap of (sort_key, arrival, entry)
+    while running or pending:
+        try:
+            entry = incoming.get(timeout=0.1)
+            if entry is done:
+                running -= 1
+            else:
+                heappush(pending, (entry[0], time(), entry))
+        except Empty:
+            pass
+        now = time()
+        while pending and (not running or len(pending) >= KATA_LOG_BUFFER
+                           or now - pending[0][1] >= LOG_REORDER_WINDOW):
+            yield heappop(pending)[2]
+
+def open_deploy_log(path: str, mode: str = 'rb'):
+    if path.endswith('.zst'):
+        if not zstd_open:
+            raise RuntimeError("reading .zst logs needs Python 3.14+ or the 'zstandard' package")
+        return zstd_open(path, mode)
+    return gzip_open(path, mode)
+
+
+def deploy_logs(app: str) -> list:
+    """Return an app's deploy log paths, oldest first."""
+    logs_path = join(LOG_ROOT, app, 'deploys')
+    if not exists(logs_path):
+        return []
+    return sorted(join(logs_path, name) for name in listdir(logs_path) if name.endswith(('.log.zst', '.log.gz')))
+
+
+def prune_deploy_logs(app: str) -> None:
+    """Keep at most KATA_DEPLOY_LOGS_KEEP logs and KATA_DEPLOY_LOGS_MAX_BYTES per app (the newest always stays)."""
+    logs = deploy_logs(app)
+    total = sum(getsize(path) for path in logs)
+    while len(logs) > 1 and (len(logs) > KATA_DEPLOY_LOGS_KEEP or total > KATA_DEPLOY_LOGS_MAX_BYTES):
+        oldest = logs.pop(0)
+        total -= getsize(oldest)
+        remove(oldest)
+
+
+@contextmanager
+def deploy_log(app: str):
+    """Tee everything written to stdout/stderr (including subprocesses) into a compressed deploy log.
+
+    Works at the file descriptor level, so it must not be nested or used from
+    several threads of one process at once.
+    """
+    try:
+        stdout.flush()
+        stderr.flush()
+        saved_out, saved_err = dup(stdout.fileno()), dup(stderr.fileno())
+    except (AttributeError, OSError, ValueError):
+        # not attached to real file descriptors; nothing to tee
+        yield None
+        return
+    path = join(LOG_ROOT, app, 'deploys', datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + DEPLOY_LOG_EXT)
+    makedirs(dirname(path), exist_ok=True)
+    log = open_deploy_log(path, 'wb')
+    read_end, write_end = pipe()
+
+    def pump():
+        # The reader owns the pipe, the log and the saved stdout, and closes them only at EOF
+        try:
+            while chunk := read(read_end, 65536):
+                view = memoryview(chunk)
+                while view:
+                    view = view[write(saved_out, view):]
+                log.write(chunk)
+        finally:
+            close(read_end)
+            close(saved_out)
+            log.close()
+
+    reader = Thread(target=pump, daemon=True)
+    reader.start()
+    dup2(write_end, stdout.fileno())
+    dup2(write_end, stderr.fileno())
+    close(write_end)
+    try:
+        yield path
+    finally:
+        stdout.flush()
+        stderr.flush()
+        # Restoring the original descriptors closes the pipe, which ends the reader
+        dup2(saved_out, stdout.fileno())
+        dup2(saved_err, stderr.fileno())
+        close(saved_err)
+        reader.join(timeout=10)
+        if reader.is_alive():
+            # A detached child inherited the pipe; the reader closes the log once the child lets go,
+            # so nothing is closed under it, but output after this process exits is not kept
+            echo(f"Warning: a background process still holds the deploy output; the end of {path} may be missing", fg='yellow')
+        prune_deploy_logs(app)
+
+# === Resource usage ===
+
+SIZE_UNITS = {'b': 1, 'kb': 1e3, 'mb': 1e6, 'gb': 1e9, 'tb': 1e12,
+              'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'tib': 1024 ** 4}
+
+
+def parse_size(text: str) -> float:
+    """Parse sizes as printed by `docker stats` ('12.5MiB', '1.2kB', '0B') into bytes."""
+    match = fullmatch(r'\s*([\d.]+)\s*([a-zA-Z]*)\s*', text or '')
+    if not match:
+        return 0.0
+    return float(match.group(1)) * SIZE_UNITS.get(match.group(2).lower() or 'b', 1)
+
+
+def parse_pair(text: str) -> tuple:
+    """Parse 'a / b' columns such as MemUsage, NetIO and BlockIO."""
+    first, _, second = (text or '').partition('/')
+    return parse_size(first), parse_size(second)
+
+
+def collect_app_stats() -> dict:
+    """Sample every running container once and aggregate usage per app and service.
+
+    Uses a single `docker stats --no-stream` plus a single `docker ps` for labels,
+    regardless of how many apps or containers there are.
+    """
+    owners = {}
+    rows = check_output(['docker', 'ps', '--no-trunc', '--format',
+                         '{{.ID}}\t{{.Names}}\t{{.Label "com.docker.compose.project"}}\t{{.Label "com.docker.compose.service"}}'
+                         '\t{{.Label "com.docker.stack.namespace"}}\t{{.Label "com.docker.swarm.service.name"}}'],
+                        stderr=DEVNULL, universal_newlines=True).splitlines()
+    for row in rows:
+        cid, name, project, service, stack, swarm_service = (row.split('\t') + [''] * 6)[:6]
+        if stack:
+            owners[cid[:12]] = (stack, swarm_service[len(stack) + 1:] or swarm_service)
+        elif project:
+            owners[cid[:12]] = (project, service or name)
+        else:
+            owners[cid[:12]] = ('(other)', name)
+    samples = check_output(['docker', 'stats', '--no-stream', '--no-trunc', '--format', '{{json .}}'],
+                           stderr=DEVNULL, universal_newlines=True).splitlines()
+    apps = {}
+    for line in samples:
+        try:
+            sample = loads(line)
+        except ValueError:
+            continue
+        app, service = owners.get(sample.get('ID', '')[:12], ('(other)', sample.get('Name', '?')))
+        memory, _ = parse_pair(sample.get('MemUsage'))
+        net_rx, net_tx = parse_pair(sample.get('NetIO'))
+        block_read, block_write = parse_pair(sample.get('BlockIO'))
+        usage = {'cpu': float(sample.get('CPUPerc', '0').rstrip('%') or 0), 'memory': round(memory),
+                 'net_rx': round(net_rx), 'net_tx': round(net_tx), 'block_read': round(block_read),
+                 'block_write': round(block_write), 'containers': 1}
+        totals = apps.setdefault(app, {'services': {}})
+        for target in (totals, totals['services'].setdefault(service, {})):
+            for key, value in usage.items():
+                target[key] = target.get(key, 0) + value
+    return apps
+
+
+def print_app_stats(apps: dict, sort_key: str, services: bool) -> None:
+    echo(f"{'APP':<28}{'CPU%':>8}{'MEM':>11}{'NET RX/TX':>22}{'BLOCK R/W':>22}{'N':>4}", fg='green')
+    for app, usage in sorted(apps.items(), key=lambda item: item[1].get(sort_key, 0), reverse=True):
+        rows = [(app, usage)]
+        if services:
+            rows += [(f"  {name}", svc) for name, svc in
+                     sorted(usage['services'].items(), key=lambda item: item[1].get(sort_key, 0), reverse=True)]
+        for label, u in rows:
+            net = f"{format_size(u['net_rx'])} / {format_size(u['net_tx'])}"
+            block = f"{format_size(u['block_read'])} / {format_size(u['block_write'])}"
+            echo(f"{label[:27]:<28}{u['cpu']:>8.1f}{format_size(u['memory']):>11}{net:>22}{block:>22}{u['containers']:>4}",
+                 fg='white')
+
+def memory_bytes(value) -> int:
+    """Bytes from a Docker memory size such as 512m, 1g or 1.5GiB (binary units)."""
+    match = fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*', str(value).lower())
+    if not match:
+        raise ValueError(f"invalid memory size '{value}'")
+    return int(float(match.group(1)) * 1024 ** ' kmgt'.index(match.group(2) or ' '))
+
+
+def format_memory(size: int) -> str:
+    """Docker memory notation for a byte count (whole MiB where possible)."""
+    return f"{size // 1024 ** 2}m" if size % 1024 ** 2 == 0 else str(size)
+
+
+def docker_host_capacity() -> tuple:
+    """(CPUs, memory bytes) of the Docker host; memory is None if Docker can't be asked."""
+    try:
+        ncpu, mem = check_output(['docker', 'info', '--format', '{{.NCPU}} {{.MemTotal}}'],
+                                 stderr=DEVNULL, universal_newlines=True).split()
+        return int(ncpu), int(mem)
+    except Exception:
+        return cpu_count() or 1, None
+
+
+def service_resources(service: dict) -> dict:
+    """Limits and reservations already set on a compose service, as x-kata-resources keys."""
+    deploy = service.get('deploy') if isinstance(service.get('deploy'), dict) else {}
+    resources = deploy.get('resources') if isinstance(deploy.get('resources'), dict) else {}
+    limits, reservations = resources.get('limits') or {}, resources.get('reservations') or {}
+    found = {
+        'cpus': service.get('cpus', limits.get('cpus')),
+        'memory': service.get('mem_limit', limits.get('memory')),
+        'reserve_cpus': reservations.get('cpus'),
+        'reserve_memory': service.get('mem_reservation', reservations.get('memory')),
+    }
+    return {k: v for k, v in found.items() if v is not None}
+
+
+def resource_settings(settings: dict, host_cpus: int, host_memory: int = None) -> dict:
+    """Validate x-kata-resources keys into (cpus as float, memory in bytes), clamped to the host."""
+    unknown = set(settings) - set(RESOURCE_KEYS)
+    if unknown:
+        raise ValueError(f"unknown resource key(s): {', '.join(sorted(unknown))} (expected: {', '.join(RESOURCE_KEYS)})")
+    result = {}
+    for key, value in settings.items():
+        if key.endswith('cpus'):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{key}' must be a number of CPUs, got '{value}'")
+            if value <= 0:
+                raise ValueError(f"'{key}' must be positive")
+            result[key] = min(value, float(host_cpus))
+        else:
+            value = memory_bytes(value)
+            if value <= 0:
+                raise ValueError(f"'{key}' must be positive")
+            result[key] = min(value, host_memory) if host_memory else value
+    # A reservation above the limit can never be honoured
+    for limit, reserve in (('cpus', 'reserve_cpus'), ('memory', 'reserve_memory')):
+        if limit in result and reserve in result:
+            result[reserve] = min(result[reserve], result[limit])
+    return result
+
+
+def apply_resources(compose_def: dict, resources_cfg: dict) -> None:
+    """Give services CPU/memory limits and reservations, in both compose and deploy.resources form.
+
+    Precedence (later wins): runtime defaults (RUNTIME_RESOURCES), x-kata-resources['*'],
+    values already in the service definition, x-kata-resources[<service>].
+    Raises ValueError on invalid settings.
+    """
+    services = compose_def.get('services', {})
+    host_cpus, host_memory = docker_host_capacity()
+    for name in resources_cfg:
+        if name != '*' and name not in services:
+            raise ValueError(f"x-kata-resources: unknown service '{name}'")
+    for name, service in services.items():
+        if not isinstance(service, dict):
+            continue
+        image = str(service.get('image', ''))
+        defaults = RUNTIME_RESOURCES.get(image.split('/', 1)[1], {}) if image in RUNTIME_IMAGES else {}
+        wanted = {**defaults, **(resources_cfg.get('*') or {}), **service_resources(service), **(resources_cfg.get(name) or {})}
+        if not wanted:
+            continue
+        try:
+            settings = resource_settings(wanted, host_cpus, host_memory)
+        except ValueError as e:
+            raise ValueError(f"service '{name}': {e}")
+        if not isinstance(service.get('deploy'), dict):
+            service['deploy'] = {}
+        resources = service['deploy'].setdefault('resources', {})
+        if 'cpus' in settings:
+            service['cpus'] = settings['cpus']
+            resources.setdefault('limits', {})['cpus'] = str(settings['cpus'])
+        if 'memory' in settings:
+            service['mem_limit'] = format_memory(settings['memory'])
+            resources.setdefault('limits', {})['memory'] = format_memory(settings['memory'])
+        if 'reserve_cpus' in settings:
+            resources.setdefault('reservations', {})['cpus'] = str(settings['reserve_cpus'])
+        if 'reserve_memory' in settings:
+            service['mem_reservation'] = format_memory(settings['reserve_memory'])
+            resources.setdefault('reservations', {})['memory'] = format_memory(settings['reserve_memory'])
+
+
+def collect_capacity() -> dict:
+    """Resources committed by running containers, per app, from their generated compose files."""
+    host_cpus, host_memory = docker_host_capacity()
+    running = {}
+    rows = check_output(['docker', 'ps', '--format',
+                         '{{.Label "com.docker.compose.project"}}\t{{.Label "com.docker.compose.service"}}'
+                         '\t{{.Label "com.docker.stack.namespace"}}\t{{.Label "com.docker.swarm.service.name"}}'],
+                        stderr=DEVNULL, universal_newlines=True).splitlines()
+    for row in rows:
+        project, service, stack, swarm_service = (row.split('\t') + [''] * 4)[:4]
+        app, service = (stack, swarm_service[len(stack) + 1:]) if stack else (project, service)
+        if app:
+            running[(app, service)] = running.get((app, service), 0) + 1
+    apps = {}
+    for app in sorted({app for app, _ in running}):
+        compose_path = join(app_code_path(app), DOCKER_COMPOSE)
+        try:
+            services = (safe_load(open(compose_path, 'r', encoding='utf-8')) or {}).get('services', {})
+        except Exception:
+            services = {}
+        totals = apps.setdefault(app, {'containers': 0, 'unbounded': 0, 'cpus': 0.0, 'memory': 0,
+                                       'reserve_cpus': 0.0, 'reserve_memory': 0})
+        for (owner, service), count in running.items():
+            if owner != app:
+                continue
+            definition = services.get(service)
+            try:
+                settings = resource_settings(service_resources(definition), host_cpus) if isinstance(definition, dict) else {}
+            except ValueError:
+                settings = {}
+            totals['containers'] += count
+            if 'memory' not in settings:
+                totals['unbounded'] += count
+            for key in RESOURCE_KEYS:
+                totals[key] += settings.get(key, 0) * count
+    return {'host': {'cpus': host_cpus, 'memory': host_memory}, 'apps': apps}
+
+# === Placement ===
+
+PLACEMENT_KEYS = ('constraints', 'spread', 'max_replicas_per_node')  # x-kata-placement settings
+
+
+def node_attribute(name: str) -> str:
+    """Swarm node attribute for a placement key: bare names are node labels"""
+    name = str(name).strip()
+    return name if name.startswith(('node.', 'engine.labels.')) else f"node.labels.{name}"
+
+
+def placement_settings(settings: dict) -> dict:
+    """Validate x-kata-placement keys into (constraint strings, spread attributes, per-node cap)."""
+    unknown = set(settings) - set(PLACEMENT_KEYS)
+    if unknown:
+        raise ValueError(f"unknown placement key(s): {', '.join(sorted(unknown))} (expected: {', '.join(PLACEMENT_KEYS)})")
+    result = {}
+    constraints = settings.get('constraints')
+    if isinstance(constraints, dict):
+        # {zone: eu-west, node.role: worker} shorthand for equality constraints
+        result['constraints'] = [f"{node_attribute(k)}=={v}" for k, v in constraints.items()]
+    elif constraints is not None:
+        result['constraints'] = [str(c).replace(' ', '') for c in as_list(constraints)]
+        for constraint in result['constraints']:
+            if '==' not in constraint and '!=' not in constraint:
+                raise ValueError(f"constraint '{constraint}' must use == or !=")
+    if settings.get('spread') is not None:
+        result['spread'] = [node_attribute(s) for s in as_list(settings['spread'])]
+    if settings.get('max_replicas_per_node') is not None:
+        cap = settings['max_replicas_per_node']
+        if not isinstance(cap, int) or isinstance(cap, bool) or cap < 1:
+            raise ValueError("'max_replicas_per_node' must be a positive integer")
+        result['max_replicas_per_node'] = cap
+    return result
+
+
+def apply_placement(compose_def: dict, placement_cfg: dict) -> None:
+    """Generate deploy.placement from x-kata-placement for each service (swarm mode only uses it).
+
+    Constraints and spread preferences from x-kata-placement['*'], the service definition
+    and x-kata-placement[<service>] are combined; for max_replicas_per_node the later wins.
+    Raises ValueError on invalid settings.
+    """
+    services = compose_def.get('services', {})
+    for name in placement_cfg:
+        if name != '*' and name not in services:
+            raise ValueError(f"x-kata-placement: unknown service '{name}'")
+    for name, service in services.items():
+        if not isinstance(service, dict) or not (placement_cfg.get('*') or placement_cfg.get(name)):
+            continue
+        try:
+            common, own = placement_settings(placement_cfg.get('*') or {}), placement_settings(placement_cfg.get(name) or {})
+        except ValueError as e:
+            raise ValueError(f"service '{name}': {e}")
+        if not isinstance(service.get('deploy'), dict):
+            service['deploy'] = {}
+        placement = service['deploy'].setdefault('placement', {})
+        constraints = common.get('constraints', []) + list(placement.get('constraints') or []) + own.get('constraints', [])
+        if constraints:
+            placement['constraints'] = list(dict.fromkeys(constraints))
+        spread = [p['spread'] for p in placement.get('preferences') or [] if isinstance(p, dict) and 'spread' in p]
+        preferences = list(dict.fromkeys(common.get('spread', []) + spread + own.get('spread', [])))
+        if preferences:
+            placement['preferences'] = [{'spread': attribute} for attribute in preferences]
+        cap = own.get('max_replicas_per_node', placement.get('max_replicas_per_node', common.get('max_replicas_per_node')))
+        if cap is not None:
+            placement['max_replicas_per_node'] = cap
+
+
+def collect_placement(app: str) -> dict:
+    """Where an app's running tasks are, as {service: {node: tasks}}, plus pending tasks and ready nodes."""
+    services, pending = {}, {}
+    if get_app_mode(app) == 'swarm':
+        rows = check_output(['docker', 'stack', 'ps', app, '--filter', 'desired-state=running',
+                             '--format', '{{.Name}}\t{{.Node}}\t{{.CurrentState}}'],
+                            stderr=DEVNULL, universal_newlines=True).splitlines()
+        for row in rows:
+            name, node, state = (row.split('\t') + [''] * 3)[:3]
+            service = name[len(app) + 1:].rsplit('.', 1)[0]
+            if not node or not state.startswith('Running'):
+                pending[service] = pending.get(service, 0) + 1
+            else:
+                services.setdefault(service, {})[node] = services.get(service, {}).get(node, 0) + 1
+        nodes = check_output(['docker', 'node', 'ls', '--format', '{{.Status}} {{.Availability}}'],
+                             stderr=DEVNULL, universal_newlines=True).split('\n')
+        ready = sum(1 for node in nodes if node.strip() == 'Ready Active')
+    else:
+        node = uname().nodename
+        rows = check_output(['docker', 'ps', '--filter', f'label=com.docker.compose.project={app}',
+                             '--format', '{{.Label "com.docker.compose.service"}}'],
+                            stderr=DEVNULL, universal_newlines=True).split()
+        for service in rows:
+            services.setdefault(service, {})[node] = services.get(service, {}).get(node, 0) + 1
+        ready = 1
+    return {'services': services, 'pending': pending, 'nodes': ready}
+
+# === Metrics ===
+
+class MetricsCollector:
+    """Prometheus metrics for `kata metrics:serve`, collected incrementally.
+
+    Deploy events are tailed from METRICS_ROOT/events.jsonl (only new bytes are
+    read per scrape), docker stats are sampled in the background every `interval`
+    seconds, and container exits/restarts come from a `docker events` stream.
+    """
+
+    def __init__(self, interval: int = 15):
+        self.interval = interval
+        self.lock = Lock()
+        self.counters = {}  # (metric, labels) -> value
+        self.apps = {}
+        self.sampled_at = 0
+        self.events_inode = None
+        self.events_offset = 0
+        self.died = set()
+
+    def add(self, metric: str, labels: dict, value: float = 1) -> None:
+        key = (metric, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def apply(self, event: dict) -> None:
+        kind, app, ok = event.get('event'), event.get('app', ''), event.get('ok', True)
+        seconds = float(event.get('seconds', 0))
+        if kind == 'deploy':
+            self.add('kata_deploys_total', {'app': app, 'result': 'success' if ok else 'failure'})
+            self.add('kata_deploy_duration_seconds_sum', {'app': app}, seconds)
+            self.add('kata_deploy_duration_seconds_count', {'app': app})
+        elif kind == 'phase':
+            labels = {'app': app, 'phase': event.get('phase', '')}
+            self.add('kata_deploy_phase_duration_seconds_sum', labels, seconds)
+            self.add('kata_deploy_phase_duration_seconds_count', labels)
+            if not ok:
+                self.add('kata_deploy_phase_failures_total', labels)
+        elif kind == 'install':
+            labels = {'app': app, 'runtime': event.get('runtime', '')}
+            self.add('kata_installs_total', {**labels, 'result': 'success' if ok else 'failure'})
+            self.add('kata_install_duration_seconds_sum', labels, seconds)
+            self.add('kata_install_duration_seconds_count', labels)
+        elif kind == 'image_build':
+            labels = {'image': event.get('image', '')}
+            self.add('kata_image_builds_total', {**labels, 'result': 'success' if ok else 'failure'})
+            self.add('kata_image_build_duration_seconds_sum', labels, seconds)
+            self.add('kata_image_build_duration_seconds_count', labels)
+        elif kind == 'image_push':
+            labels = {'image': event.get('image', '')}
+            self.add('kata_image_pushes_total', {**labels, 'result': 'success' if ok else 'failure'})
+            self.add('kata_image_push_duration_seconds_sum', labels, seconds)
+            self.add('kata_image_push_duration_seconds_count', labels)
+        elif kind == 'scale':
+            for service in event.get('replicas', {}):
+                self.add('kata_scale_operations_total', {'app': app, 'service': service})
+        elif kind == 'queue':
+            labels = {'priority': event.get('priority', '')}
+            self.add('kata_deploy_queue_wait_seconds_sum', labels, seconds)
+            self.add('kata_deploy_queue_wait_seconds_count', labels)
+
+    def read_events(self) -> None:
+        """Apply events appended since the last call, following one rotation to events.jsonl.1."""
+        path = join(METRICS_ROOT, 'events.jsonl')
+        if not exists(path):
+            return
+        inode = stat(path).st_ino
+        if self.events_inode not in (None, inode):
+            rotated = path + '.1'
+            if exists(rotated) and stat(rotated).st_ino == self.events_inode:
+                self.read_from(rotated)
+            self.events_offset = 0
+        self.events_inode = inode
+        self.read_from(path)
+
+    def read_from(self, path: str) -> None:
+        with open(path, 'rb') as handle:
+            handle.seek(self.events_offset)
+            for line in handle:
+                if not line.endswith(b"\n"):
+                    break  # partially written; pick it up next time
+                self.events_offset += len(line)
+                try:
+                    self.apply(loads(line))
+                except ValueError:
+                    pass
+
+    def sample_docker(self) -> None:
+        while True:
+            try:
+                apps = collect_app_stats()
+                with self.lock:
+                    self.apps, self.sampled_at = apps, time()
+            except Exception:
+                pass
+            sleep(self.interval)
+
+    def watch_docker_events(self) -> None:
+        cmd = ['docker', 'events', '--filter', 'type=container', '--filter', 'event=die',
+               '--filter', 'event=start', '--format', '{{json .}}']
+        while True:
+            try:
+                proc = Popen(cmd, stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+                for line in proc.stdout:
+                    event = loads(line)
+                    attrs = event.get('Actor', {}).get('Attributes', {})
+                    app = attrs.get('com.docker.stack.namespace') or attrs.get('com.docker.compose.project') or '(other)'
+                    service = attrs.get('com.docker.compose.service') or attrs.get('com.docker.swarm.service.name', '')
+                    labels = {'app': app, 'service': service}
+                    cid = event.get('id', '')
+                    with self.lock:
+                        if event.get('status') == 'die':
+                            self.died.add(cid)
+                            self.add('kata_container_exits_total', labels)
+                        elif cid in self.died:
+                            self.died.discard(cid)
+                            self.add('kata_container_restarts_total', labels)
+                proc.wait()
+            except Exception:
+                pass
+            sleep(self.interval)
+
+    def start(self) -> None:
+        for target in (self.sample_docker, self.watch_docker_events):
+            Thread(target=target, daemon=True).start()
+
+    def render(self) -> str:
+        with self.lock:
+            self.read_events()
+            counters = dict(self.counters)
+            apps, sampled_at = self.apps, self.sampled_at
+        gauges = {}
+        for app, usage in apps.items():
+            gauges[('kata_app_containers', (('app', app),))] = usage.get('containers', 0)
+            gauges[('kata_app_cpu_percent', (('app', app),))] = usage.get('cpu', 0)
+            gauges[('kata_app_memory_bytes', (('app', app),))] = usage.get('memory', 0)
+        status = scheduler_status()
+        gauges[('kata_deploy_slots', ())] = status['slots']
+        gauges[('kata_deploy_slots_busy', ())] = len(status['running'])
+        gauges[('kata_deploy_queue_depth', ())] = len(status['queued'])
+        gauges[('kata_stats_sample_timestamp_seconds', ())] = round(sampled_at)
+
+        lines = []
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            families = {}
+            for (metric, labels), value in sorted(series.items()):
+                family = metric.rsplit('_', 1)[0] if metric.endswith(('_sum', '_count')) else metric
+                families.setdefault(family, []).append((metric, labels, value))
+            for family, samples in sorted(families.items()):
+                lines.append(f"# TYPE {family} {kind if samples[0][0] == family else 'summary'}")
+                for metric, labels, value in samples:
+                    rendered = ",".join(f'{k}="{prometheus_escape(v)}"' for k, v in labels)
+                    value = int(value) if value == int(value) else round(value, 6)
+                    lines.append(f"{metric}{{{rendered}}} {value}" if rendered else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def prometheus_escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def metrics_handler(collector: MetricsCollector):
+    """Build a request handler class serving `collector` on /metrics."""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = collector.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+# === Scaling ===
+
+def get_scale_overrides(app: str) -> dict:
+    """Replica counts set with `kata scale`, which outlive redeploys."""
+    path = join(APP_ROOT, app, KATA_SCALE_FILE)
+    try:
+        return {str(k): int(v) for k, v in loads(open(path, 'r', encoding='utf-8').read()).items()}
+    except Exception:
+        return {}
+
+
+def set_scale_overrides(app: str, counts: dict) -> None:
+    path = join(APP_ROOT, app, KATA_SCALE_FILE)
+    if not counts:
+        if exists(path):
+            remove(path)
+        return
+    tmp = f"{path}.{getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(dumps(counts, sort_keys=True))
+    replace(tmp, path)
+
+
+def get_replicas(app: str) -> dict:
+    """Running replicas per service of an app."""
+    counts = {}
+    if get_app_mode(app) == 'swarm':
+        rows = check_output(['docker', 'service', 'ls', '--filter', f'label=com.docker.stack.namespace={app}',
+                             '--format', '{{.Name}} {{.Replicas}}'], stderr=DEVNULL, universal_newlines=True)
+        for row in rows.splitlines():
+            name, _, replicas = row.partition(' ')
+            counts[name[len(app) + 1:]] = int(replicas.split('/')[0] or 0) if replicas.split('/')[0].isdigit() else 0
+        return counts
+    rows = check_output(['docker', 'ps', '--filter', f'label=com.docker.compose.project={app}',
+                         '--format', '{{.Label "com.docker.compose.service"}}'], stderr=DEVNULL, universal_newlines=True)
+    for service in rows.split():
+        counts[service] = counts.get(service, 0) + 1
+    return counts
+
+
+def scale_app(app: str, counts: dict, wait: bool = True) -> bool:
+    """Change replica counts of a running app in place, without regenerating its stack.
+
+    Holds the app's deploy lock, so a scale never mixes in a release being swapped; with
+    `wait` False (the autoscaler) it skips the change instead of waiting for a deploy.
+    """
+    if not exists(join(APP_ROOT, app)):
+        echo(f"Error: app '{app}' has no generated {DOCKER_COMPOSE}; deploy it first.", fg='red')
+        return False
+    with file_lock(join(APP_ROOT, app, KATA_DEPLOY_LOCK),
+                   f"-----> A deploy of '{app}' is in progress; waiting for it to finish", wait=wait) as lock:
+        if lock is None:
+            echo(f"-----> A deploy of '{app}' is in progress; not scaling it now", fg='yellow')
+            return False
+        return scale_current_release(app, counts)
+
+
+def scale_current_release(app: str, counts: dict) -> bool:
+    """Scale the services of an app's current release; the caller holds the deploy lock."""
+    compose_path = join(app_code_path(app), DOCKER_COMPOSE)
+    if not exists(compose_path):
+        echo(f"Error: app '{app}' has no generated {DOCKER_COMPOSE}; deploy it first.", fg='red')
+        return False
+    with open(compose_path, 'r', encoding='utf-8') as f:
+        services = (safe_load(f) or {}).get('services', {})
+    unknown = [s for s in counts if s not in services]
+    if unknown:
+        echo(f"Error: unknown service(s) for '{app}': {', '.join(unknown)}", fg='red')
+        return False
+    echo(f"-----> Scaling '{app}': {', '.join(f'{s}={n}' for s, n in counts.items())}", fg='yellow')
+    if get_app_mode(app) == 'swarm':
+        cmd = ['docker', 'service', 'scale', '--detach'] + [f"{app}_{s}={n}" for s, n in counts.items()]
+    else:
+        cmd = get_compose_cmd() + ['-p', app, '-f', compose_path, 'up', '-d', '--no-recreate', '--no-deps']
+        for service, replicas in counts.items():
+            cmd += ['--scale', f"{service}={replicas}"]
+        cmd += list(counts)
+    if call(cmd, cwd=dirname(compose_path), stdout=stdout, stderr=stderr, universal_newlines=True) != 0:
+        return False
+    set_scale_overrides(app, {**get_scale_overrides(app), **counts})
+    write_traefik_dynamic(app, compose_path)
+    record_metric('scale', app=app, replicas=counts)
+    return True
+
+
+def parse_duration(value) -> float:
+    """Seconds from a number or a string like 90s, 5m or 1h."""
+    match = fullmatch(r'\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*', str(value))
+    if not match:
+        raise ValueError(f"invalid duration '{value}'")
+    return float(match.group(1)) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[match.group(2) or 's']
+
+
+def autoscale_policies(app: str) -> dict:
+    """Validated `x-kata-autoscale` policies from an app's kata-compose.yaml, per service.
+
+    Each service takes min (default 1), max, and at least one target: cpu (average
+    CPU percent per replica, 100 = one core) or rps (Traefik requests/s per replica),
+    plus optional cooldown (before scaling up, default 60s) and cooldown_down
+    (before scaling down, default 5m).
+    """
+    path = join(app_code_path(app), KATA_COMPOSE)
+    try:
+        cfg = safe_load(open(path, 'r', encoding='utf-8')) or {}
+    except Exception:
+        return {}
+    policies = {}
+    for service, policy in (cfg.get('x-kata-autoscale') or {}).items():
+        try:
+            if not isinstance(policy, dict) or 'max' not in policy or not ({'cpu', 'rps'} & set(policy)):
+                raise ValueError("needs 'max' and a 'cpu' or 'rps' target")
+            low, high = int(policy.get('min', 1)), int(policy['max'])
+            if not 0 < low <= high:
+                raise ValueError("needs 0 < min <= max")
+            policies[service] = {
+                'min': low, 'max': high,
+                'cpu': float(policy['cpu']) if 'cpu' in policy else None,
+                'rps': float(policy['rps']) if 'rps' in policy else None,
+                'cooldown': parse_duration(policy.get('cooldown', 60)),
+                'cooldown_down': parse_duration(policy.get('cooldown_down', 300)),
+            }
+        except (TypeError, ValueError) as e:
+            echo(f"Warning: ignoring autoscale policy for '{app}/{service}': {e}", fg='yellow')
+    return policies
+
+
+def traefik_request_totals() -> dict:
+    """Cumulative request counts per Traefik service (provider suffix stripped) from its metrics endpoint."""
+    url = urlparse(KATA_TRAEFIK_METRICS_URL)
+    conn = (HTTPSConnection if url.scheme == 'https' else HTTPConnection)(url.netloc, timeout=5)
+    try:
+        conn.request('GET', url.path or '/metrics')
+        body = conn.getresponse().read().decode('utf-8', 'replace')
+    finally:
+        conn.close()
+    totals = {}
+    for line in body.splitlines():
+        match = fullmatch(r'traefik_service_requests_total\{(.*)\}\s+(\S+)', line.strip())
+        if not match:
+            continue
+        service = next((v for k, v in findall(r'(\w+)="([^"]*)"', match.group(1)) if k == 'service'), None)
+        if service:
+            service = service.split('@')[0]
+            totals[service] = totals.get(service, 0) + float(match.group(2))
+    return totals
+
+
+class Autoscaler:
+    """Adjusts replicas of apps with `x-kata-autoscale` policies, one tick at a time.
+
+    Desired replicas are current * observed / target (the largest of the CPU and
+    request-rate estimates), clamped to [min, max]. Changes within 10% of the target
+    are ignored, and each service waits out its cooldown after being scaled.
+    """
+
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.last_scaled = {}  # (app, service) -> time
+        self.last_requests = None  # (time, totals)
+
+    def request_rates(self) -> dict:
+        try:
+            totals = traefik_request_totals()
+        except Exception as e:
+            echo(f"Warning: could not read Traefik metrics from {KATA_TRAEFIK_METRICS_URL}: {e}", fg='yellow')
+            return {}
+        now, previous = time(), self.last_requests
+        self.last_requests = (now, totals)
+        if not previous or now <= previous[0]:
+            return {}
+        # Counters reset when Traefik restarts; treat a drop as no data for that service
+        return {name: (total - previous[1][name]) / (now - previous[0])
+                for name, total in totals.items() if name in previous[1] and total >= previous[1][name]}
+
+    def service_rates(self, app: str, rates: dict) -> dict:
+        """Map Traefik load balancer rates onto the compose services that carry them."""
+        compose_path = join(app_code_path(app), DOCKER_COMPOSE)
+        try:
+            services = (safe_load(open(compose_path, 'r', encoding='utf-8')) or {}).get('services', {})
+        except Exception:
+            return {}
+        result = {}
+        for name, service in services.items():
+            labels = label_dict(service.get('labels')) if isinstance(service, dict) else {}
+            for key in labels:
+                match = fullmatch(r'traefik\.http\.services\.([^.]+)\.loadbalancer\.server\.port', key)
+                if match and match.group(1) in rates:
+                    result[name] = result.get(name, 0) + rates[match.group(1)]
+        return result
+
+    def tick(self) -> None:
+        apps = sorted(a for a in listdir(APP_ROOT) if not a.startswith('.')) if exists(APP_ROOT) else []
+        policies = {app: p for app in apps for p in [autoscale_policies(app)] if p}
+        if not policies:
+            return
+        usage = collect_app_stats()
+        rates = self.request_rates() if any(p['rps'] for ps in policies.values() for p in ps.values()) else {}
+        now = time()
+        for app, services in policies.items():
+            replicas = get_replicas(app)
+            app_rates = self.service_rates(app, rates) if rates else {}
+            changes = {}
+            for service, policy in services.items():
+                current = replicas.get(service, 0)
+                if not current:
+                    continue  # stopped or not deployed; leave it alone
+                estimates = []
+                cpu = usage.get(app, {}).get('services', {}).get(service)
+                if policy['cpu'] and cpu and cpu.get('containers'):
+                    estimates.append(current * (cpu['cpu'] / cpu['containers']) / policy['cpu'])
+                if policy['rps'] and service in app_rates:
+                    estimates.append(app_rates[service] / policy['rps'])
+                if not estimates:
+                    continue
+                wanted = max(estimates)
+                if abs(wanted / current - 1) <= 0.1:
+                    continue
+                desired = min(policy['max'], max(policy['min'], int(-(-wanted // 1))))
+                if desired == current:
+                    continue
+                cooldown = policy['cooldown'] if desired > current else policy['cooldown_down']
+                if now - self.last_scaled.get((app, service), 0) < cooldown:
+                    continue
+                changes[service] = desired
+                echo(f"-----> {app}/{service}: {current} -> {desired} replicas (estimate {wanted:.1f})", fg='green')
+            if changes and not self.dry_run and scale_app(app, changes, wait=False):
+                for service in changes:
+                    self.last_scaled[(app, service)] = now
+
+
+# === Trash ===
+
+def move_to_trash(app: str, path: str) -> bool:
+    """Atomically move an app directory into TRASH_ROOT; False if it must be deleted in place."""
+    makedirs(TRASH_ROOT, exist_ok=True)
+    target = join(TRASH_ROOT, f"{time():.0f}-{getpid()}-{app}-{basename(dirname(path))}")
+    try:
+        rename(path, target)
+        return True
+    except OSError as e:
+        # e.g. EXDEV when the root lives on a different filesystem
+        echo(f"Warning: could not move {path} to trash ({e}); deleting in place", fg='yellow')
+        return False
+
+
+def trash_entries() -> list:
+    if not exists(TRASH_ROOT):
+        return []
+    return sorted(join(TRASH_ROOT, name) for name in listdir(TRASH_ROOT) if not name.startswith('.'))
+
+
+def disk_usage(path: str) -> int:
+    """Best-effort bytes allocated under path (unreadable subtrees are skipped)."""
+    total = 0
+    for root, dirs, files in walk(path):
+        for name in dirs + files:
+            try:
+                total += lstat(join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def reap_trash_entry(path: str) -> None:
+    """Delete one trash entry, falling back to a root container for root-owned files."""
+    try:
+        rmtree(path)
+    except OSError:
+        docker_wipe_paths([path])
+
+
+def reap_trash(jobs: int = KATA_REAP_JOBS, verbose: bool = False) -> None:
+    """Delete everything in TRASH_ROOT; only one reaper runs at a time."""
+    makedirs(TRASH_ROOT, exist_ok=True)
+    left = set()  # entries a pass failed to delete; retried by the next reaper, not this one
+    while True:
+        with open(join(TRASH_ROOT, '.reaper.lock'), 'a', encoding='utf-8') as handle:
+            try:
+                flock(handle, LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                if verbose:
+                    echo("-----> Another reaper is already running", fg='yellow')
+                return
+            while entries := [entry for entry in trash_entries() if entry not in left]:
+                if verbose:
+                    echo(f"-----> Reaping {len(entries)} trash entries", fg='yellow')
+                with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+                    list(pool.map(reap_trash_entry, entries))
+                left.update(entry for entry in entries if exists(entry))
+        # Entries trashed after we looked but before the lock was released are ours to pick up
+        if all(entry in left for entry in trash_entries()):
+            break
+    if left:
+        record_metric('trash_reap', left=sorted(left))
+        echo(f"Warning: could not delete {len(left)} trash entries: {', '.join(sorted(left))}", fg='yellow')
+
+
+def spawn_trash_reaper() -> None:
+    """Start a detached, low-priority `kata trash:reap` in the background."""
+    cmd = [executable, KATA_SCRIPT, 'trash:reap']
+    if which('nice'):
+        cmd = ['nice', '-n', '19'] + cmd
+    if which('ionice'):
+        cmd = ['ionice', '-c', '3'] + cmd
+    try:
+        Popen(cmd, cwd=KATA_ROOT, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+    except Exception as e:
+        echo(f"Warning: could not start the trash reaper ({e}); run 'kata trash:reap'", fg='yellow')
+
+# === Release helpers ===
+
+def git_env() -> dict:
+    """Environment for git subprocesses, minus the GIT_* variables set by hooks"""
+    return {k: v for k, v in environ.items() if not k.startswith('GIT_')}
+
+
+def app_code_path(app: str) -> str:
+    """Return the directory holding an app's active code and generated compose file.
+
+    Release-based apps resolve through the `current` symlink; apps deployed before
+    releases existed (or placed by hand) live directly in APP_ROOT/<app>.
+    """
+    current = join(APP_ROOT, app, CURRENT_RELEASE)
+    if exists(current):
+        return realpath(current)
+    return join(APP_ROOT, app)
+
+
+def release_path(app: str, release: str) -> str:
+    return join(APP_ROOT, app, RELEASES_DIR, release)
+
+
+def release_volume_name(app: str, release: str) -> str:
+    """Per-release name for the `app` volume, so a new release recreates its services"""
+    return f"{app}_app_{release[:12]}"
+
+
+def list_releases(app: str) -> list:
+    """Return the complete releases for an app, oldest deploy first."""
+    releases_root = join(APP_ROOT, app, RELEASES_DIR)
+    if not exists(releases_root):
+        return []
+    found = []
+    for name in listdir(releases_root):
+        marker = join(releases_root, name, KATA_RELEASE_FILE)
+        if exists(marker):
+            found.append((getmtime(marker), name))
+    return [name for _, name in sorted(found)]
+
+
+def get_current_release(app: str):
+    """Return the release the `current` symlink points at, or None."""
+    current = join(APP_ROOT, app, CURRENT_RELEASE)
+    if islink(current):
+        return basename(realpath(current))
+    return None
+
+
+def set_current_release(app: str, release: str) -> None:
+    """Atomically repoint APP_ROOT/<app>/current at a release."""
+    app_path = join(APP_ROOT, app)
+    tmp_link = join(app_path, f".{CURRENT_RELEASE}.tmp")
+    if lexists(tmp_link):
+        remove(tmp_link)
+    symlink(join(RELEASES_DIR, release), tmp_link)
+    replace(tmp_link, join(app_path, CURRENT_RELEASE))
+
+
+def create_release(app: str, rev: str):
+    """Check out a revision from the app's bare repo into its own release directory.
+
+    Returns the release path, or None on failure. An existing complete checkout of
+    the same revision is reused, since release contents never change.
+    """
+    path = release_path(app, rev)
+    marker = join(path, KATA_RELEASE_FILE)
+    if exists(marker):
+        echo(f"-----> Reusing release '{rev[:12]}'", fg='green')
+        utime(marker)
+        return path
+    if exists(path):
+        docker_wipe_paths([path])
+    makedirs(dirname(path), exist_ok=True)
+    echo(f"-----> Creating release '{rev[:12]}'", fg='green')
+    env = git_env()
+    steps = [
+        (['git', 'clone', '--quiet', '--shared', '--no-checkout', join(GIT_ROOT, app), path], APP_ROOT),
+        (['git', 'checkout', '--quiet', rev], path),
+        (['git', 'submodule', 'update', '--quiet', '--init', '--recursive'], path),
+    ]
+    for cmd, cwd in steps:
+        if call(cmd, cwd=cwd, env=env, stdout=stdout, stderr=stderr) != 0:
+            echo(f"Error: '{' '.join(cmd[:2])}' failed for release '{rev[:12]}'", fg='red')
+            docker_wipe_paths([path])
+            return None
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write(rev)
+    return path
+
+
+def prune_releases(app: str, keep: int = KATA_RELEASES_KEEP) -> None:
+    """Delete the oldest releases beyond `keep`, never touching the current one."""
+    releases = list_releases(app)
+    current = get_current_release(app)
+    excess = len(releases) - max(keep, 1)
+    stale = [r for r in releases if r != current][:max(excess, 0)]
+    for release in stale:
+        echo(f"-----> Pruning release '{release[:12]}'", fg='yellow')
+        call(['docker', 'volume', 'rm', release_volume_name(app, release)],
+             stdout=DEVNULL, stderr=DEVNULL)
+    if stale:
+        docker_wipe_paths([release_path(app, r) for r in stale])
+
+
+def parse_compose(app_name, filename, release=None) -> tuple:
+    """Parses the kata-compose.yaml
+
+    The directory holding `filename` is the app's code (a release checkout or the
+    legacy APP_ROOT/<app>); `release` names the release being deployed, if any.
+    """
+
+    code_path = dirname(abspath(filename))
 
     # First pass: load with base env so top-level vars resolve
-    env_base = base_env(app_name)
+    env_base = base_env(app_name, {'APP_ROOT': code_path})
     data = load_yaml(filename, env_base)
 
     if not data:
@@ -705,7 +3021,7 @@ def parse_compose(app_name, filename) -> tuple:
         env = {k: str(v) for k, v in data["environment"].items()}
 
     # Merge user env with base and re-expand placeholders across the loaded structure
-    env = base_env(app_name, env)
+    env = base_env(app_name, {'APP_ROOT': code_path, **env})
     data = expand_in_obj(data, env)
 
     # Prepare env as a dict; we'll merge into services preserving service-defined values
@@ -713,6 +3029,8 @@ def parse_compose(app_name, filename) -> tuple:
     if not "services" in data:
         echo(f"Warning: no 'services' section found in {filename}", fg='yellow')
     services = data.get("services", {})
+    precompressed = set()  # DOCROOTs already precompressed in this release
+    python_packages = None  # server packages for the app's shared venv, once a python service is seen
 
     for service_name, service in services.items():
         is_static = bool(service.pop('static', False)) if isinstance(service, dict) else False
@@ -725,12 +3043,45 @@ def parse_compose(app_name, filename) -> tuple:
                 service["environment"].setdefault("PORT", "8000")
                 service["environment"].setdefault("DOCROOT", "/app")
 
+        # Kata-only keys are consumed below for their runtimes; compose rejects them anywhere else
+        for key, runtimes in (('server', ('python',)), ('cluster', ('nodejs', 'bun'))):
+            if key in service and ('image' in service or service.get('runtime') not in runtimes):
+                echo(f"Error: service '{service_name}': '{key}' only applies to runtime: {' or '.join(runtimes)} services", fg='red')
+                exit(1)
+
         if not "image" in service:
             if "runtime" in service:
                 service["image"] = f"kata/{service['runtime']}"
                 echo(f"=====> '{service_name}' will use runtime '{service['runtime']}'", fg='green')
-                if service["image"] in RUNTIME_IMAGES:
-                    docker_handle_runtime_environment(app_name, service["runtime"], env=env)
+                if service["runtime"] in RUNTIMES:
+                    packages = []
+                    if service["runtime"] == 'python' and ('server' in service or 'command' not in service):
+                        # Run detected (or configured) WSGI/ASGI apps under a production server
+                        explicit = 'server' in service
+                        if explicit and 'command' in service:
+                            echo(f"Warning: service '{service_name}' sets both 'server' and 'command'; using 'server'", fg='yellow')
+                        try:
+                            service["command"], requirement = python_server_command(code_path, service.pop('server', None))
+                            packages.append(requirement)
+                            echo(f"=====> '{service_name}' will serve {service['command'][3]} with {service['command'][1]}", fg='green')
+                        except ValueError as e:
+                            if explicit:  # without 'server:', a missing app just leaves the service without a command
+                                echo(f"Error: service '{service_name}': {e}", fg='red')
+                                exit(1)
+                    if service["runtime"] in ('nodejs', 'bun') and service.get('cluster'):
+                        try:
+                            service["command"] = node_cluster_command(code_path, service["runtime"], service["cluster"],
+                                                                      service.get("command"))
+                        except ValueError as e:
+                            echo(f"Error: service '{service_name}': {e}", fg='red')
+                            exit(1)
+                        echo(f"=====> '{service_name}' will run {service['command'][3]} in cluster mode", fg='green')
+                    if service["runtime"] in ('nodejs', 'bun'):
+                        service.pop('cluster', None)
+                    if service["runtime"] == 'python':  # installed once below, into the venv all services share
+                        python_packages = (python_packages or set()) | set(packages)
+                    elif service["runtime"] != 'static':  # static assets are precompressed below, per DOCROOT
+                        docker_handle_runtime_environment(app_name, service["runtime"], env=env, app_path=code_path)
                 else:
                     echo(f"Error: runtime '{service['runtime']}' not supported", fg='red')
                     exit(1)
@@ -769,22 +3120,57 @@ def parse_compose(app_name, filename) -> tuple:
         for k, v in env.items():
             if k not in service["environment"]:
                 service["environment"][k] = str(v)
+        if service.get("image") == "kata/static":
+            # Write .gz/.br siblings next to the release's assets for gzip_static/brotli_static
+            docroot = service["environment"].get("DOCROOT", "/app")
+            if docroot not in precompressed:
+                precompressed.add(docroot)
+                docker_handle_runtime_environment(app_name, 'static', env={**env, 'DOCROOT': docroot}, app_path=code_path)
+
+    if python_packages is not None:
+        # All python services share the app's venv, so it gets every service's server in one install
+        docker_handle_runtime_environment(app_name, 'python', env=env, app_path=code_path,
+                                          packages=sorted(python_packages))
 
     traefik_config = {}
     if "traefik" in data.keys():
         traefik_config = data.get("traefik", {}) or {}
         del data["traefik"]
 
-    # If the selected traefik target service uses network_mode, skip injection
-    if traefik_config:
-        target = traefik_config.get('service') or (next(iter(services.keys())) if services else None)
-        if target and isinstance(services.get(target), dict) and services[target].get('network_mode'):
-            echo(f"Warning: service '{target}' uses network_mode; skipping Traefik label injection.", fg='yellow')
-            traefik_config = {}
+    placement_config = data.pop("x-kata-placement", None) or {}
+    if not isinstance(placement_config, dict) or not all(isinstance(v, dict) for v in placement_config.values()):
+        echo(f"Error: 'x-kata-placement' in {filename} must map service names (or '*') to settings", fg='red')
+        exit(1)
+
+    resources_config = data.pop("x-kata-resources", None) or {}
+    if not isinstance(resources_config, dict) or not all(isinstance(v, dict) for v in resources_config.values()):
+        echo(f"Error: 'x-kata-resources' in {filename} must map service names (or '*') to settings", fg='red')
+        exit(1)
+
+    if "x-kata-cache" in data.keys():
+        if isinstance(traefik_config, dict) and traefik_config:
+            traefik_config.setdefault('cache', data["x-kata-cache"])
+        else:
+            echo("Warning: 'x-kata-cache' needs a 'traefik' block to route through the cache; ignoring it", fg='yellow')
+        del data["x-kata-cache"]
+
+    # Reject malformed middleware presets and cache options up front rather than shipping broken labels
+    if isinstance(traefik_config, dict):
+        routes = traefik_config.get('routes')
+        defaults = {k: v for k, v in traefik_config.items() if k != 'routes'}
+        for cfg in [traefik_config] + (routes if isinstance(routes, list) else []):
+            try:
+                cfg = {**defaults, **cfg} if isinstance(cfg, dict) else {}
+                traefik_middleware_options(cfg)
+                if cache_options(cfg.get('cache')) and cfg.get('sticky'):
+                    raise ValueError("'sticky' cannot be combined with 'cache', whose sidecar is the route's only backend")
+            except ValueError as e:
+                echo(f"Error: invalid traefik settings in {filename}: {e}", fg='red')
+                exit(1)
 
     if not "volumes" in data.keys():
         volumes = {
-            "app": join(APP_ROOT, app_name),
+            "app": code_path,
             "config": join(CONFIG_ROOT, app_name),
             "data": join(DATA_ROOT, app_name),
             "venv": join(ENV_ROOT, app_name)
@@ -800,14 +3186,37 @@ def parse_compose(app_name, filename) -> tuple:
                     "device": volumes[volume]
                 }
             }
+        if release:
+            # A distinct volume per release makes compose/swarm recreate services on the new code
+            data["volumes"]["app"]["name"] = release_volume_name(app_name, release)
     else:
         echo(f"Warning: using app-specific volume setup.", fg='yellow')
     
     if "environment" in data:
         del data['environment']
 
-    # Apply Traefik labels and inject Traefik service if configured
+    # Insert caching sidecars, then apply Traefik labels and inject Traefik service if configured
+    apply_cache(app_name, data, traefik_config)
     apply_traefik(app_name, data, traefik_config)
+
+    # Replica counts set with `kata scale` (or the autoscaler) outlive deploys
+    for service_name, replicas in get_scale_overrides(app_name).items():
+        service = services.get(service_name)
+        if isinstance(service, dict):
+            if not isinstance(service.get('deploy'), dict):
+                service['deploy'] = {}
+            service['deploy']['replicas'] = replicas
+
+    try:
+        apply_resources(data, resources_config)
+    except ValueError as e:
+        echo(f"Error: invalid resources in {filename}: {e}", fg='red')
+        exit(1)
+    try:
+        apply_placement(data, placement_config)
+    except ValueError as e:
+        echo(f"Error: invalid placement in {filename}: {e}", fg='red')
+        exit(1)
     return (data, traefik_config)
 
 # === Orchestrator helpers ===
@@ -821,6 +3230,113 @@ def docker_supports_swarm() -> bool:
         return False
 
 
+def registry_image_ref(image: str, registry: str) -> str:
+    """Registry reference for a local image, tagged with its content (image id) so tags never move"""
+    image_id = check_output(['docker', 'image', 'inspect', '-f', '{{.Id}}', image],
+                            stderr=DEVNULL, universal_newlines=True).strip()
+    return f"{registry}/{image.split(':')[0]}:{image_id.split(':')[-1][:12]}"
+
+
+def push_runtime_images(compose_def: dict, registry: str = KATA_REGISTRY) -> bool:
+    """Push the built-in kata/* images a stack uses to `registry` and point its services at them.
+
+    Those images are built locally on the manager; without this, swarm can only
+    schedule their tasks there.
+    """
+    pushed = {}
+    for name, service in compose_def.get('services', {}).items():
+        image = service.get('image') if isinstance(service, dict) else None
+        if image not in RUNTIME_IMAGES:
+            continue
+        if image not in pushed:
+            try:
+                ref = registry_image_ref(image, registry)
+            except Exception:
+                echo(f"Error: image '{image}' for service '{name}' is not built on this node", fg='red')
+                return False
+            echo(f"-----> Pushing {image} as {ref}", fg='green')
+            started = time()
+            ok = call(['docker', 'tag', image, ref], stdout=DEVNULL, stderr=stderr) == 0 \
+                and call(['docker', 'push', '--quiet', ref], stdout=DEVNULL, stderr=stderr) == 0
+            record_metric('image_push', image=image, seconds=time() - started, ok=ok)
+            if not ok:
+                echo(f"Error: could not push '{ref}'; is the registry at '{registry}' reachable?", fg='red')
+                return False
+            pushed[image] = ref
+        service['image'] = pushed[image]
+    return True
+
+
+def sync_swarm_configs(app: str) -> dict:
+    """Create a Docker config for each file under CONFIG_ROOT/<app>; returns {relative path: config name}.
+
+    Names end in a hash of the content, so unchanged files reuse the existing config
+    and an edited file becomes a new config (configs are immutable). Raises ValueError.
+    """
+    root = join(CONFIG_ROOT, app)
+    existing = set(check_output(['docker', 'config', 'ls', '--filter', f'label=kata.app={app}', '--format', '{{.Name}}'],
+                                stderr=DEVNULL, universal_newlines=True).split())
+    configs = {}
+    for dirpath, dirnames, filenames in walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = join(dirpath, filename)
+            rel = relpath(path, root)
+            if not isfile(path):
+                continue
+            if getsize(path) > CONFIG_MAX_BYTES:
+                raise ValueError(f"'{rel}' is larger than {format_size(CONFIG_MAX_BYTES)}, the limit for a swarm config")
+            digest = sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    digest.update(chunk)
+            # Docker caps config names at 64 characters; keep the tail of the path, which names the file
+            slug = sub(r'[^A-Za-z0-9_.-]', '_', rel)[-(64 - len(app[:30]) - 14):]
+            name = f"{app[:30]}-{slug}-{digest.hexdigest()[:12]}"
+            if name not in existing and call(['docker', 'config', 'create', '--label', f'kata.app={app}',
+                                              '--label', f'kata.path={rel}', name, path],
+                                             stdout=DEVNULL, stderr=stderr) != 0:
+                raise ValueError(f"could not create config '{name}' for '{rel}'")
+            configs[rel] = name
+    return configs
+
+
+def apply_swarm_configs(compose_def: dict, configs: dict) -> None:
+    """Replace mounts of the `config` volume with the given swarm configs, one per file"""
+    for service in compose_def.get('services', {}).values():
+        if not isinstance(service, dict) or not isinstance(service.get('volumes'), list):
+            continue
+        kept, targets = [], []
+        for volume in service['volumes']:
+            if isinstance(volume, dict):
+                source, target = volume.get('source'), volume.get('target')
+            else:
+                source, _, target = str(volume).partition(':')
+                target = target.split(':')[0]
+            if source == 'config' and target:
+                targets.append(target)
+            else:
+                kept.append(volume)
+        if targets:
+            service['volumes'] = kept
+            service['configs'] = list(service.get('configs') or []) + [
+                {'source': name, 'target': f"{target.rstrip('/')}/{rel}", 'mode': 0o444}
+                for target in targets for rel, name in sorted(configs.items())]
+    compose_def.get('volumes', {}).pop('config', None)
+    compose_def.setdefault('configs', {}).update({name: {'external': True} for name in configs.values()})
+
+
+def prune_swarm_configs(app: str, keep=()) -> bool:
+    """Remove an app's configs that are not in `keep`; False if some are still in use (they are left)"""
+    try:
+        names = check_output(['docker', 'config', 'ls', '--filter', f'label=kata.app={app}', '--format', '{{.Name}}'],
+                             stderr=DEVNULL, universal_newlines=True).split()
+    except Exception:
+        return True  # not a swarm manager (or no docker): nothing we could remove
+    stale = [name for name in names if name not in set(keep)]
+    return not stale or call(['docker', 'config', 'rm'] + stale, stdout=DEVNULL, stderr=DEVNULL) == 0
+
+
 def docker_is_swarm_manager() -> bool:
     """Return True if this node is an active swarm manager (control available)."""
     try:
@@ -845,7 +3361,7 @@ def get_app_mode(app: str) -> str:
         except Exception:
             pass
     # compose file override
-    compose_path = join(app_path, KATA_COMPOSE)
+    compose_path = join(app_code_path(app), KATA_COMPOSE)
     if exists(compose_path):
         try:
             cfg = safe_load(open(compose_path, 'r', encoding='utf-8'))
@@ -857,122 +3373,627 @@ def get_app_mode(app: str) -> str:
     # default based on swarm manager availability
     return 'swarm' if docker_is_swarm_manager() else 'compose'
 
-def set_app_mode(app: str, mode: str):
-    app_path = join(APP_ROOT, app)
+def set_app_mode(app: str, mode: str):
+    app_path = join(APP_ROOT, app)
+    try:
+        with open(join(app_path, KATA_MODE_FILE), 'w', encoding='utf-8') as f:
+            f.write(mode)
+    except Exception:
+        pass
+
+def get_compose_cmd() -> list:
+    """Return the base compose command: ['docker','compose'] if available, else ['docker-compose']."""
+    # Prefer docker compose (V2)
+    try:
+        out = check_output(['docker', 'compose', 'version'], stderr=STDOUT, universal_newlines=True)
+        if out:
+            return ['docker', 'compose']
+    except Exception:
+        pass
+    # Fallback to docker-compose (V1)
+    if which('docker-compose'):
+        return ['docker-compose']
+    # Last resort: assume docker compose exists
+    return ['docker', 'compose']
+
+def require_swarm_or_warn() -> bool:
+    """Ensure Docker Swarm is active; print a helpful error if not."""
+    if not docker_is_swarm_manager():
+        echo("Error: Docker Swarm manager not available on this node. This command requires a Swarm manager.", fg='red')
+        echo("Tip: Initialize Swarm with 'docker swarm init' or switch app mode to 'compose' where applicable.", fg='yellow')
+        return False
+    return True
+
+class DockerSocketConnection(HTTPConnection):
+    """HTTP connection to the Docker Engine API over its unix socket"""
+
+    def __init__(self, socket_path: str, timeout: int = 60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket(AF_UNIX, SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def docker_api_connection():
+    """A keep-alive Docker Engine API connection, or None when the CLI would reach another daemon"""
+    config = join(environ.get('DOCKER_CONFIG') or join(environ.get('HOME', ''), '.docker'), 'config.json')
+    try:
+        with open(config, 'r', encoding='utf-8') as f:
+            context = loads(f.read()).get('currentContext')
+    except (OSError, ValueError):
+        context = None
+    if (environ.get('DOCKER_CONTEXT') or context or 'default') != 'default':
+        return None  # `docker context use` points the CLI elsewhere
+    host = environ.get('DOCKER_HOST', 'unix:///var/run/docker.sock')
+    if not host.startswith('unix://') or not exists(host[len('unix://'):]):
+        return None
+    return DockerSocketConnection(host[len('unix://'):])
+
+
+def docker_api(connection, method: str, path: str, body=None, headers=None) -> tuple:
+    """Send one request on an open API connection; returns (status, decoded JSON or None)"""
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    data = response.read()
+    try:
+        return response.status, loads(data) if data else None
+    except ValueError:
+        return response.status, {'message': data.decode('utf-8', errors='replace').strip()}
+
+
+def secret_sources(source: str) -> list:
+    """Secrets to import from a directory (one per file) or an env file ('-' for stdin).
+
+    Returns (name, path, data) tuples: files are referenced by path and read as raw
+    bytes later; env file values are kept as the exact bytes after the '='.
+    """
+    items = []
+    if source != '-' and isdir(source):
+        for dirpath, dirnames, filenames in walk(source):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(f for f in filenames if not f.startswith('.')):
+                path = join(dirpath, filename)
+                if isfile(path):
+                    items.append((sub(r'[^A-Za-z0-9_.-]', '_', relpath(path, source)), path, None))
+        return items
+    stream = stdin.buffer if source == '-' else open(source, 'rb')
+    try:
+        for line in stream:
+            line = line.rstrip(b'\r\n')
+            if not line.strip() or line.lstrip().startswith(b'#') or b'=' not in line:
+                continue
+            key, value = line.split(b'=', 1)
+            key = key.strip().removeprefix(b'export ').strip()
+            if len(value) >= 2 and value[:1] in (b'"', b"'") and value[-1:] == value[:1]:
+                value = value[1:-1]
+            items.append((sub(r'[^A-Za-z0-9_.-]', '_', key.decode('utf-8', errors='replace')), None, value))
+    finally:
+        if stream is not stdin.buffer:
+            stream.close()
+    return items
+
+
+def secret_chunks(path: str, data: bytes, size: int = 3 << 16):
+    """Yield a secret's bytes in chunks (multiples of 3, so they base64-encode independently)"""
+    if path is None:
+        yield data
+        return
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(size), b''):
+            yield chunk
+
+
+def import_secrets(items: list, prune: bool = False) -> dict:
+    """Create content-hash named secrets over one API session; returns {name: (secret, status)}.
+
+    Each secret is named <name>-<sha256 prefix> and labelled kata.secret=<name>, so an
+    unchanged value is found and skipped, and a changed one becomes a new version.
+    """
+    connection = docker_api_connection()
+    versions = {}  # secret name -> (id, kata.secret label), for all kata-managed secrets
+    if connection:
+        try:
+            status, listing = docker_api(connection, 'GET', '/secrets?filters=' + dumps({'label': ['kata.secret']}).replace(' ', ''))
+        except OSError:
+            # An unreachable or inaccessible socket; the CLI may still get through
+            connection.close()
+            connection = None
+        else:
+            if status != 200:
+                raise RuntimeError((listing or {}).get('message', f'HTTP {status}'))
+            versions = {s['Spec']['Name']: (s['ID'], s['Spec'].get('Labels', {}).get('kata.secret')) for s in listing or []}
+    if not connection:
+        for line in check_output(['docker', 'secret', 'ls', '--filter', 'label=kata.secret',
+                                  '--format', '{{.Name}}\t{{.Label "kata.secret"}}'],
+                                 stderr=DEVNULL, universal_newlines=True).splitlines():
+            secret, _, label = line.partition('\t')
+            versions[secret] = (secret, label)
+    results = {}
+    for name, path, data in items:
+        digest = sha256()
+        size = 0
+        for chunk in secret_chunks(path, data):
+            digest.update(chunk)
+            size += len(chunk)
+        secret = f"{name[:50]}-{digest.hexdigest()[:12]}"
+        if secret in versions:
+            results[name] = (secret, 'unchanged')
+            continue
+        labels = {'kata.secret': name, 'kata.sha256': digest.hexdigest()}
+        if connection:
+            # Stream the JSON body: base64 of the raw bytes between a fixed prefix and suffix
+            head = dumps({'Name': secret, 'Labels': labels})[:-1].encode() + b', "Data": "'
+            body = [head, *(b64encode(chunk) for chunk in secret_chunks(path, data)), b'"}']
+            length = len(head) + 4 * ((size + 2) // 3) + 2
+            status, reply = docker_api(connection, 'POST', '/secrets/create', body=iter(body),
+                                       headers={'Content-Type': 'application/json', 'Content-Length': str(length)})
+            ok, error = status == 201, (reply or {}).get('message', f'HTTP {status}')
+        else:
+            args = ['docker', 'secret', 'create'] + [f'--label={k}={v}' for k, v in labels.items()] + [secret, '-']
+            if path is None:
+                result = run(args, input=data, stdout=DEVNULL, stderr=PIPE)
+            else:
+                with open(path, 'rb') as f:
+                    result = run(args, stdin=f, stdout=DEVNULL, stderr=PIPE)
+            ok, error = result.returncode == 0, result.stderr.decode('utf-8', errors='replace').strip()
+        results[name] = (secret, 'created' if ok else f'failed: {error}')
+        if ok:
+            versions[secret] = (secret, name)
+    if prune:
+        # Older versions of what was just imported, by label since names are truncated;
+        # Docker refuses to remove ones services still use
+        current = {name: secret for name, (secret, status) in results.items() if not status.startswith('failed')}
+        for old, (ref, name) in list(versions.items()):
+            if name in current and current[name] != old:
+                if connection:
+                    removed = docker_api(connection, 'DELETE', f'/secrets/{ref}')[0] in (200, 204)
+                else:
+                    removed = call(['docker', 'secret', 'rm', ref], stdout=DEVNULL, stderr=DEVNULL) == 0
+                results[old] = (old, 'pruned' if removed else 'in use, kept')
+    if connection:
+        connection.close()
+    return results
+
+
+def resolve_secret_versions(compose_def: dict) -> None:
+    """Point `external: true` secrets at the newest version imported under their name (kata.secret label)"""
+    secrets = compose_def.get('secrets')
+    wanted = {key: entry.get('name') or key for key, entry in (secrets or {}).items()
+              if isinstance(entry, dict) and entry.get('external') is True}
+    if not wanted:
+        return
     try:
-        with open(join(app_path, KATA_MODE_FILE), 'w', encoding='utf-8') as f:
-            f.write(mode)
+        ids = check_output(['docker', 'secret', 'ls', '--filter', 'label=kata.secret', '--format', '{{.ID}}'],
+                           stderr=DEVNULL, universal_newlines=True).split()
+        rows = check_output(['docker', 'secret', 'inspect', '--format',
+                             '{{.CreatedAt.UnixNano}}\t{{.Spec.Name}}\t{{index .Spec.Labels "kata.secret"}}'] + ids,
+                            stderr=DEVNULL, universal_newlines=True).splitlines() if ids else []
     except Exception:
-        pass
+        echo("Warning: could not list imported secret versions; external secrets are used as named", fg='yellow')
+        return
+    newest = {}
+    for row in sorted(rows, key=lambda row: int(row.split('\t', 1)[0])):
+        _, secret, label = row.split('\t')
+        newest[label] = secret
+    for key, label in wanted.items():
+        if label in newest:
+            secrets[key]['name'] = newest[label]
+            echo(f"-----> Secret '{key}' uses version '{newest[label]}'", fg='green')
 
-def get_compose_cmd() -> list:
-    """Return the base compose command: ['docker','compose'] if available, else ['docker-compose']."""
-    # Prefer docker compose (V2)
+# Basic deployment functions
+
+def docker_app_health(app: str, mode: str) -> str:
+    """Summarise an app's containers (compose) or tasks (swarm) as 'healthy', 'starting' or 'unhealthy'."""
     try:
-        out = check_output(['docker', 'compose', 'version'], stderr=STDOUT, universal_newlines=True)
-        if out:
-            return ['docker', 'compose']
+        if mode == 'swarm':
+            lines = check_output(['docker', 'stack', 'ps', app, '--filter', 'desired-state=running',
+                                  '--format', '{{.CurrentState}}'], stderr=DEVNULL, universal_newlines=True).splitlines()
+            if not lines:
+                return 'starting'
+            if all(line.startswith('Running') for line in lines):
+                return 'healthy'
+            if any(line.startswith(('Failed', 'Rejected')) for line in lines):
+                return 'unhealthy'
+            return 'starting'
+        lines = check_output(['docker', 'ps', '-a', '--filter', f'label=com.docker.compose.project={app}',
+                              '--format', '{{.State}}\t{{.Status}}'], stderr=DEVNULL, universal_newlines=True).splitlines()
     except Exception:
-        pass
-    # Fallback to docker-compose (V1)
-    if which('docker-compose'):
-        return ['docker-compose']
-    # Last resort: assume docker compose exists
-    return ['docker', 'compose']
+        return 'starting'
+    if not lines:
+        return 'starting'
+    result = 'healthy'
+    for line in lines:
+        state, _, status = line.partition('\t')
+        if state == 'exited' and not status.startswith('Exited (0)'):
+            return 'unhealthy'
+        if '(unhealthy)' in status or state == 'dead':
+            return 'unhealthy'
+        if state in ('created', 'restarting') or '(health: starting)' in status:
+            result = 'starting'
+    return result
+
+
+def docker_wait_healthy(app: str, timeout: int = KATA_HEALTH_TIMEOUT) -> bool:
+    """Wait until an app is running (and passing healthchecks) on two consecutive polls."""
+    mode = get_app_mode(app)
+    deadline = time() + timeout
+    settled = 0
+    while time() < deadline:
+        health = docker_app_health(app, mode)
+        if health == 'unhealthy':
+            return False
+        settled = settled + 1 if health == 'healthy' else 0
+        if settled >= 2:
+            return True
+        sleep(2)
+    return False
 
-def require_swarm_or_warn() -> bool:
-    """Ensure Docker Swarm is active; print a helpful error if not."""
-    if not docker_is_swarm_manager():
-        echo("Error: Docker Swarm manager not available on this node. This command requires a Swarm manager.", fg='red')
-        echo("Tip: Initialize Swarm with 'docker swarm init' or switch app mode to 'compose' where applicable.", fg='yellow')
-        return False
-    return True
 
-# Basic deployment functions
+@contextmanager
+def file_lock(path: str, waiting_message: str = None, wait: bool = True):
+    """Hold an exclusive flock() on `path` for the duration of the block (None when busy and not `wait`)."""
+    with open(path, 'a', encoding='utf-8') as handle:
+        try:
+            flock(handle, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            if not wait:
+                yield None
+                return
+            if waiting_message:
+                echo(waiting_message, fg='yellow')
+            flock(handle, LOCK_EX)
+        yield handle
+
+
+def queue_deploy(app: str, rev: str) -> None:
+    """Record `rev` as the newest revision to deploy, replacing any older queued one."""
+    with open(join(APP_ROOT, app, KATA_DEPLOY_QUEUE), 'a+', encoding='utf-8') as handle:
+        flock(handle, LOCK_EX)
+        handle.seek(0)
+        handle.truncate()
+        handle.write(rev)
+
+
+def take_queued_deploy(app: str):
+    """Pop the queued revision for an app, or None if another deploy already took it."""
+    with open(join(APP_ROOT, app, KATA_DEPLOY_QUEUE), 'a+', encoding='utf-8') as handle:
+        flock(handle, LOCK_EX)
+        handle.seek(0)
+        rev = handle.read().strip()
+        handle.seek(0)
+        handle.truncate()
+    return rev or None
+
+
+def do_deploy_queued(app: str, newrev: str) -> bool:
+    """Deploy the newest queued revision under the app's deploy lock.
+
+    Concurrent pushes wait for the deploy in progress; only the newest revision
+    queued meanwhile is deployed, and the other waiters return without deploying.
+    """
+    queue_deploy(app, newrev)
+    with file_lock(join(APP_ROOT, app, KATA_DEPLOY_LOCK),
+                   f"-----> Another deploy of '{app}' is in progress; waiting for it to finish"):
+        rev = take_queued_deploy(app)
+        if not rev:
+            echo(f"-----> A concurrent deploy already picked up '{newrev[:12]}' or a newer revision", fg='yellow')
+            return True
+        if rev != newrev:
+            echo(f"-----> Coalesced queued pushes; deploying newest revision '{rev[:12]}'", fg='yellow')
+        return do_deploy(app, newrev=rev)
+
+
+# === Deploy scheduler ===
+
+def scheduler_tickets() -> list:
+    """Return live queue tickets as (rank, queued_at, pid, app, name), in admission order."""
+    queue_path = join(SCHEDULER_ROOT, 'queue')
+    tickets = []
+    if not exists(queue_path):
+        return tickets
+    for name in listdir(queue_path):
+        parts = name.split('-', 3)
+        try:
+            rank, queued_at, pid = int(parts[0]), float(parts[1]), int(parts[2])
+            app = parts[3]
+        except (ValueError, IndexError):
+            continue
+        try:
+            kill(pid, 0)
+        except ProcessLookupError:
+            # Owner died without cleaning up its ticket
+            try:
+                remove(join(queue_path, name))
+            except FileNotFoundError:
+                pass
+            continue
+        except PermissionError:
+            pass  # alive, owned by another user
+        tickets.append((rank, queued_at, pid, app, name))
+    return sorted(tickets)
+
+
+def claim_deploy_slot(app: str):
+    """Take a free host-wide slot, returning its locked handle, or None if all are busy."""
+    for index in range(max(KATA_DEPLOY_SLOTS, 1)):
+        handle = open(join(SCHEDULER_ROOT, f'slot-{index}'), 'a+', encoding='utf-8')
+        try:
+            flock(handle, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            continue
+        handle.seek(0)
+        handle.truncate()
+        handle.write(f"{app} {time():.0f} {getpid()}")
+        handle.flush()
+        return handle
+    return None
+
+
+def record_deploy_job(app: str, priority: str, waited: float, held: float) -> None:
+    """Append a finished job to the scheduler history, keeping the file small."""
+    history = join(SCHEDULER_ROOT, 'history')
+    with open(history, 'a+', encoding='utf-8') as handle:
+        flock(handle, LOCK_EX)
+        handle.write(dumps({'app': app, 'priority': priority, 'at': round(time()),
+                            'waited': round(waited, 2), 'held': round(held, 2)}) + "\n")
+        handle.seek(0)
+        lines = handle.readlines()
+        if len(lines) > 1000:
+            handle.seek(0)
+            handle.truncate()
+            handle.writelines(lines[-500:])
+
+
+@contextmanager
+def deploy_slot(app: str, priority: str = 'normal'):
+    """Admit a deploy job through one of KATA_DEPLOY_SLOTS host-wide slots.
+
+    Waiting jobs leave a ticket in SCHEDULER_ROOT/queue. Only the first
+    KATA_DEPLOY_SLOTS live tickets, ordered by priority class and then arrival,
+    may claim a free slot, so high-priority apps overtake queued low-priority ones.
+    """
+    if priority not in DEPLOY_PRIORITIES:
+        echo(f"Warning: unknown x-kata-priority '{priority}'; using 'normal'", fg='yellow')
+        priority = 'normal'
+    makedirs(join(SCHEDULER_ROOT, 'queue'), exist_ok=True)
+    queued_at = time()
+    ticket = join(SCHEDULER_ROOT, 'queue', f"{DEPLOY_PRIORITIES[priority]}-{queued_at:.6f}-{getpid()}-{app}")
+    open(ticket, 'w').close()
+    handle = None
+    announced = False
+    try:
+        while handle is None:
+            tickets = scheduler_tickets()
+            if basename(ticket) in [t[4] for t in tickets[:max(KATA_DEPLOY_SLOTS, 1)]]:
+                handle = claim_deploy_slot(app)
+            if handle is None:
+                if not announced:
+                    echo(f"-----> Waiting for a deploy slot ({len(tickets)} queued, priority: {priority})", fg='yellow')
+                    announced = True
+                sleep(1)
+    finally:
+        if exists(ticket):
+            remove(ticket)
+    admitted_at = time()
+    if announced:
+        echo(f"-----> Deploy slot acquired after {admitted_at - queued_at:.0f}s", fg='yellow')
+    try:
+        yield
+    finally:
+        handle.seek(0)
+        handle.truncate()
+        handle.close()
+        record_deploy_job(app, priority, admitted_at - queued_at, time() - admitted_at)
+        record_metric('queue', app=app, priority=priority, seconds=admitted_at - queued_at)
+
+
+def scheduler_status() -> dict:
+    """Snapshot of slot usage, queued jobs and recent wait times."""
+    now = time()
+    slots = []
+    for index in range(max(KATA_DEPLOY_SLOTS, 1)):
+        path = join(SCHEDULER_ROOT, f'slot-{index}')
+        if not exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as handle:
+            try:
+                flock(handle, LOCK_EX | LOCK_NB)
+                continue  # nobody holds it
+            except BlockingIOError:
+                parts = handle.read().split()
+        if len(parts) == 3:
+            slots.append({'slot': index, 'app': parts[0], 'running': round(now - float(parts[1]))})
+    ranks = {v: k for k, v in DEPLOY_PRIORITIES.items()}
+    queued = [{'app': app, 'priority': ranks.get(rank, str(rank)), 'waiting': round(now - queued_at)}
+              for rank, queued_at, pid, app, name in scheduler_tickets()]
+    jobs = []
+    history = join(SCHEDULER_ROOT, 'history')
+    if exists(history):
+        with open(history, 'r', encoding='utf-8') as handle:
+            for line in handle.readlines()[-100:]:
+                try:
+                    jobs.append(loads(line))
+                except ValueError:
+                    pass
+    waits = [j.get('waited', 0) for j in jobs]
+    return {
+        'slots': max(KATA_DEPLOY_SLOTS, 1),
+        'running': slots,
+        'queued': queued,
+        'recent_jobs': len(jobs),
+        'avg_wait': round(sum(waits) / len(waits), 2) if waits else 0,
+        'max_wait': max(waits) if waits else 0,
+    }
+
 
 def do_deploy(app, deltas={}, newrev=None):
-    """Deploy an app by resetting the work directory"""
+    """Deploy an app, saving the output to LOG_ROOT/<app>/deploys while echoing it live"""
+    if not exists(join(APP_ROOT, app)):
+        echo(f"Error: app '{app}' not found.", fg='red')
+        return False
+    started = time()
+    with deploy_log(app) as log_path:
+        ok = deploy_release(app, newrev)
+    record_metric('deploy', app=app, seconds=time() - started, ok=ok)
+    if log_path:
+        echo(f"-----> Deploy log saved to {log_path}", fg='green' if ok else 'yellow')
+    return ok
+
+
+def deploy_release(app, newrev=None):
+    """Deploy an app into a fresh release directory and activate it once healthy"""
 
     app_path = join(APP_ROOT, app)
-    compose_file = join(app_path, KATA_COMPOSE)
-
-    env = {'GIT_WORK_DIR': app_path}
-    if exists(app_path):
-        echo(f"-----> Deploying app '{app}'", fg='green')
-        call('git fetch --quiet', cwd=app_path, env=env, shell=True)
-        if newrev:
-            call(f'git reset --hard {newrev}', cwd=app_path, env=env, shell=True)
-        call('git submodule init', cwd=app_path, env=env, shell=True)
-        call('git submodule update', cwd=app_path, env=env, shell=True)
+    repo_path = join(GIT_ROOT, app)
+    echo(f"-----> Deploying app '{app}'", fg='green')
+    rev = newrev
+    if not rev:
+        try:
+            rev = check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_path, env=git_env(), universal_newlines=True).strip()
+        except Exception as e:
+            echo(f"Error: could not resolve a revision to deploy: {e}", fg='red')
+            return False
+    started = time()
+    path = create_release(app, rev)
+    record_metric('phase', app=app, phase='checkout', seconds=time() - started, ok=bool(path))
+    if not path:
+        return False
+    compose_file = join(path, KATA_COMPOSE)
+    cfg_override = safe_load(open(compose_file, 'r', encoding='utf-8')) if exists(compose_file) else {}
+    if not isinstance(cfg_override, dict):
+        cfg_override = {}
+    previous = get_current_release(app)
+    # Either an earlier release or a pre-release (legacy) checkout can take over again
+    can_fall_back = previous != rev and (previous is not None or exists(join(app_path, DOCKER_COMPOSE)))
+
+    # Installs, image builds and container start-up run inside a host-wide slot
+    with deploy_slot(app, str(cfg_override.get('x-kata-priority', 'normal'))):
+        started = time()
         ensure_shared_traefik()
-        compose, traefik = parse_compose(app, compose_file)
+        compose, traefik = parse_compose(app, compose_file, release=rev)
+        record_metric('phase', app=app, phase='build', seconds=time() - started, ok=bool(compose))
         if not compose:
             echo(f"Error: could not parse {compose_file}", fg='red')
-            return
-        with open(join(APP_ROOT, app, DOCKER_COMPOSE), "w", encoding='utf-8') as f:
+            return False
+        with open(join(path, DOCKER_COMPOSE), "w", encoding='utf-8') as f:
             f.write(safe_dump(compose))
         # Record chosen mode for subsequent lifecycle ops
         mode = 'swarm' if docker_supports_swarm() else 'compose'
-        cfg_override = safe_load(open(compose_file, 'r', encoding='utf-8')) if exists(compose_file) else {}
-        if isinstance(cfg_override, dict) and cfg_override.get('x-kata-mode') in ('swarm', 'compose'):
+        if cfg_override.get('x-kata-mode') in ('swarm', 'compose'):
             mode = cfg_override['x-kata-mode']
         set_app_mode(app, mode)
-        do_start(app)
-    else:
-        echo(f"Error: app '{app}' not found.", fg='red')
+        started = time()
+        ok = do_start(app, release=rev)
+        record_metric('phase', app=app, phase='start', seconds=time() - started, ok=ok)
+
+    started = time()
+    healthy = docker_wait_healthy(app)
+    record_metric('phase', app=app, phase='health', seconds=time() - started, ok=healthy)
+    if not healthy:
+        if can_fall_back:
+            echo(f"Error: release '{rev[:12]}' did not become healthy within {KATA_HEALTH_TIMEOUT}s; restoring previous release", fg='red')
+            do_start(app, release=previous)
+            return False
+        echo(f"Warning: release '{rev[:12]}' is not healthy yet and there is nothing to fall back to", fg='yellow')
+    set_current_release(app, rev)
+    prune_releases(app)
+    echo(f"-----> Release '{rev[:12]}' is now current for '{app}'", fg='green')
+    return True
 
 
-def do_start(app):
-    app_path = join(APP_ROOT, app)
-    if exists(join(app_path, DOCKER_COMPOSE)):
+def do_start(app, release=None):
+    """Start an app from its current release (or a specific one)"""
+    app_path = release_path(app, release) if release else app_code_path(app)
+    compose_path = join(app_path, DOCKER_COMPOSE)
+    if exists(compose_path):
         mode = get_app_mode(app)
         echo(f"-----> Starting app '{app}' (mode: {mode})", fg='yellow')
-        compose_path = join(app_path, DOCKER_COMPOSE)
         if mode == 'swarm':
             if not docker_is_swarm_manager():
                 echo("Error: Docker Swarm manager not available on this node; cannot deploy stack.", fg='red')
                 echo("Tip: run 'docker swarm init' on a manager or switch this app to compose mode (kata mode <app> compose).", fg='yellow')
-                return
-            call(['docker', 'stack', 'deploy', app, f'--compose-file={compose_path}', '--detach=true', '--resolve-image=never', '--prune'],
-                 cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True)
+                return False
+            # Swarm gets its own copy of the compose file, so changes here are redone on every start
+            with open(compose_path, 'r', encoding='utf-8') as f:
+                compose_def = safe_load(f) or {}
+            registry_args = []
+            if KATA_REGISTRY:
+                # Point kata/* images at registry copies so tasks can land on any node
+                if not push_runtime_images(compose_def):
+                    return False
+                registry_args = ['--with-registry-auth']
+            configs = None
+            if compose_def.get('x-kata-configs', KATA_SWARM_CONFIGS):
+                # Ship CONFIG_ROOT/<app> as swarm configs instead of a bind mount only this node has
+                try:
+                    configs = sync_swarm_configs(app)
+                except Exception as e:
+                    echo(f"Error: could not create swarm configs for '{app}': {e}", fg='red')
+                    return False
+                apply_swarm_configs(compose_def, configs)
+            # Services follow `kata secrets:import` without editing hashed names into kata-compose.yaml
+            resolve_secret_versions(compose_def)
+            swarm_path = join(app_path, SWARM_COMPOSE)
+            with open(swarm_path, 'w', encoding='utf-8') as f:
+                f.write(safe_dump(compose_def))
+            ok = call(['docker', 'stack', 'deploy', app, f'--compose-file={swarm_path}', '--detach=true', '--resolve-image=never', '--prune']
+                      + registry_args, cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True) == 0
+            if ok:
+                # Also clears every version once x-kata-configs is turned off
+                prune_swarm_configs(app, configs.values() if configs is not None else ())
         else:
-            # docker compose up -d
-            call(get_compose_cmd() + ['-f', compose_path, 'up', '-d', '--remove-orphans'],
-                 cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True)
+            # docker compose up -d; the project name is pinned since release directories are named by revision
+            ok = call(get_compose_cmd() + ['-p', app, '-f', compose_path, 'up', '-d', '--remove-orphans'],
+                      cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True) == 0
+        if ok:
+            write_traefik_dynamic(app, compose_path)
+        return ok
+    echo(f"Error: app '{app}' has no generated {DOCKER_COMPOSE}; deploy it first.", fg='red')
+    return False
 
 
 def do_stop(app):
-    app_path = join(APP_ROOT, app)
+    app_path = app_code_path(app)
     if exists(join(app_path, DOCKER_COMPOSE)):
         mode = get_app_mode(app)
         echo(f"-----> Stopping app '{app}' (mode: {mode})", fg='yellow')
         compose_path = join(app_path, DOCKER_COMPOSE)
+        remove_traefik_dynamic(app)
         if mode == 'swarm':
-            call(['docker', 'stack', 'rm', app],
-                 cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True)
-        else:
-            call(get_compose_cmd() + ['-f', compose_path, 'down', '--remove-orphans'],
-                 cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True)
+            return call(['docker', 'stack', 'rm', app],
+                        cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True) == 0
+        return call(get_compose_cmd() + ['-p', app, '-f', compose_path, 'down', '--remove-orphans'],
+                    cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True) == 0
+    echo(f"Error: app '{app}' has no generated {DOCKER_COMPOSE}; deploy it first.", fg='red')
+    return False
 
 
 def do_remove(app, wipe: bool = False):
-    app_path = join(APP_ROOT, app)
+    app_path = app_code_path(app)
     if exists(join(app_path, DOCKER_COMPOSE)):
-        yaml = safe_load(open(join(app_path, KATA_COMPOSE), 'r', encoding='utf-8').read())
-        if 'services' in yaml:
-            for service_name, service in yaml['services'].items():
-                echo("---> Removing service: " + service_name, fg='yellow')
-                if 'runtime' in service:
-                    runtime = service['runtime']
-                    docker_handle_runtime_environment(app, runtime, destroy=True)
+        # Root-owned files left by runtime installers are handled by the trash reaper,
+        # so there is no ownership fix-up pass here.
         mode = get_app_mode(app)
         echo(f"-----> Removing '{app}' (mode: {mode})", fg='yellow')
         compose_path = join(app_path, DOCKER_COMPOSE)
+        remove_traefik_dynamic(app)
         if mode == 'swarm':
             call(['docker', 'stack', 'rm', app],
                  cwd=app_path, stdout=stdout, stderr=stderr, universal_newlines=True)
+            # Configs are external to the stack, and can only be removed once its tasks are gone
+            for _ in range(30):
+                if prune_swarm_configs(app):
+                    break
+                sleep(1)
+            else:
+                echo(f"Warning: some swarm configs of '{app}' are still in use; remove them with "
+                     f"'docker config rm $(docker config ls -q --filter label=kata.app={app})'", fg='yellow')
         else:
-            cmd = get_compose_cmd() + ['-f', compose_path, 'down', '--remove-orphans']
+            cmd = get_compose_cmd() + ['-p', app, '-f', compose_path, 'down', '--remove-orphans']
             if wipe:
                 cmd.insert(-1, '--volumes')
             call(cmd,
@@ -982,8 +4003,20 @@ def do_remove(app, wipe: bool = False):
 def do_restart(app):
     """Restarts a deployed app"""
     do_stop(app)
-    do_start(app)
-    pass
+    return do_start(app)
+
+
+def do_redeploy(app):
+    """Redeploy an app's current revision (re-running installs), e.g. after a runtime upgrade"""
+    rev = get_current_release(app)
+    if not rev:
+        try:
+            rev = check_output(['git', 'rev-parse', 'HEAD'], cwd=join(GIT_ROOT, app), env=git_env(),
+                               stderr=DEVNULL, universal_newlines=True).strip()
+        except Exception:
+            echo(f"Error: no release or git repository to redeploy '{app}' from", fg='red')
+            return False
+    return do_deploy_queued(app, rev)
 
 # === CLI Commands ===
 
@@ -1017,7 +4050,7 @@ def cmd_config(app):
     """Show configuration for an app"""
     app = exit_if_invalid(app)
 
-    config_file = join(APP_ROOT, app, KATA_COMPOSE)
+    config_file = join(app_code_path(app), KATA_COMPOSE)
     if exists(config_file):
         echo(open(config_file).read().strip(), fg='white')
     else:
@@ -1045,22 +4078,16 @@ def cmd_secrets_set(secrets):
                 if v == '-':
                     # Read from stdin
                     echo(f"Reading secret '{k}' from stdin (end with EOF / Ctrl-D):", fg='yellow')
-                    content = stdin.read()
+                    content = stdin.buffer.read()
                 elif v.startswith('@'):
-                    # Read from file
+                    # Read from file, as bytes so binary files arrive unmodified
                     filename = v[1:]  # Remove the @ prefix
                     if not exists(filename):
                         echo(f"Error: File '{filename}' not found", fg='red')
                         continue
                     try:
-                        # Try to read as text first, fall back to binary if needed
-                        try:
-                            with open(filename, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                        except UnicodeDecodeError:
-                            # File contains binary data, read as bytes and decode
-                            with open(filename, 'rb') as f:
-                                content = f.read().decode('utf-8', errors='replace')
+                        with open(filename, 'rb') as f:
+                            content = f.read()
                         echo(f"Reading secret '{k}' from file '{filename}'", fg='green')
                     except Exception as e:
                         echo(f"Error reading file '{filename}': {str(e)}", fg='red')
@@ -1068,30 +4095,23 @@ def cmd_secrets_set(secrets):
                 elif exists(v):
                     # If value looks like a file path and the file exists, read from it
                     try:
-                        # Try to read as text first, fall back to binary if needed
-                        try:
-                            with open(v, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                        except UnicodeDecodeError:
-                            # File contains binary data, read as bytes and decode
-                            with open(v, 'rb') as f:
-                                content = f.read().decode('utf-8', errors='replace')
+                        with open(v, 'rb') as f:
+                            content = f.read()
                         echo(f"Reading secret '{k}' from file '{v}'", fg='green')
                     except Exception as e:
                         echo(f"Error reading file '{v}': {str(e)}", fg='red')
                         continue
                 else:
                     # Treat as literal value
-                    content = v
+                    content = v.encode('utf-8')
             else:
                 # No = sign, prompt for value
                 k = s
                 echo(f"Enter value for secret '{k}' (end with EOF / Ctrl-D):", fg='yellow')
-                content = stdin.read()
+                content = stdin.buffer.read()
             
             echo(f"Setting secret '{k}'", fg='white')
-            run(['docker', 'secret', 'create', k, '-'], input=content,
-                 stdout=stdout, stderr=stderr, universal_newlines=True, text=True, check=True)
+            run(['docker', 'secret', 'create', k, '-'], input=content, stdout=stdout, stderr=stderr, check=True)
                  
         except ValueError:
             echo(f"Error: Invalid format '{s}'. Use 'name=value', 'name=@filename', 'name=-', or just 'name'", fg='red')
@@ -1101,6 +4121,45 @@ def cmd_secrets_set(secrets):
             continue
 
 
+@command('secrets:import')
+@argument('source')
+@option('--prune', is_flag=True, help='Remove older versions of the imported secrets that no service uses')
+@option('--json', 'as_json', is_flag=True, help='Output as JSON')
+def cmd_secrets_import(source, prune, as_json):
+    """Import secrets from a directory (one per file) or env file (- for stdin), named by content hash"""
+    if not require_swarm_or_warn():
+        return
+    if source != '-' and not exists(source):
+        echo(f"Error: '{source}' not found", fg='red')
+        exit(1)
+    try:
+        items = secret_sources(source)
+    except OSError as e:
+        echo(f"Error reading '{source}': {e}", fg='red')
+        exit(1)
+    if not items:
+        echo(f"Warning: no secrets found in '{source}'", fg='yellow')
+        return
+    try:
+        results = import_secrets(items, prune=prune)
+    except Exception as e:
+        echo(f"Error: could not import secrets: {e}", fg='red')
+        exit(1)
+    failed = [name for name, (_, status) in results.items() if status.startswith('failed')]
+    if as_json:
+        echo(dumps({name: {'secret': secret, 'status': status} for name, (secret, status) in results.items()}, indent=2))
+    else:
+        colors = {'created': 'green', 'unchanged': 'white', 'pruned': 'white'}
+        for name, (secret, status) in results.items():
+            echo(f"{name[:31]:<32}{secret:<64}{status}", fg=colors.get(status, 'yellow' if status.endswith('kept') else 'red'))
+        counts = {key: sum(1 for _, status in results.values() if status == key) for key in ('created', 'unchanged')}
+        echo(f"-----> {counts['created']} created, {counts['unchanged']} unchanged, {len(failed)} failed", fg='green')
+        if counts['created']:
+            echo("-----> Run 'kata start APP' to roll apps with `external: true` secrets onto the new versions", fg='green')
+    if failed:
+        exit(1)
+
+
 @command('secrets:rm')
 @argument('secret', required=True)
 def cmd_secrets_rm(secret):
@@ -1123,7 +4182,7 @@ def cmd_secrets_ls():
 def cmd_config_live(app):
     """Show live config for running app"""
     app = exit_if_invalid(app)
-    config_file = join(APP_ROOT, app, DOCKER_COMPOSE)
+    config_file = join(app_code_path(app), DOCKER_COMPOSE)
     if exists(config_file):
         echo(open(config_file).read().strip(), fg='white')
     else:
@@ -1136,7 +4195,7 @@ def cmd_config_live(app):
 def cmd_config_traefik(app, as_json=False):
     """Show generated Traefik labels for an app (from saved compose)."""
     app = exit_if_invalid(app)
-    config_file = join(APP_ROOT, app, DOCKER_COMPOSE)
+    config_file = join(app_code_path(app), DOCKER_COMPOSE)
     if not exists(config_file):
         echo(f"Warning: app '{app}' not deployed, no config found.", fg='yellow')
         return
@@ -1180,7 +4239,7 @@ def cmd_config_traefik(app, as_json=False):
 def cmd_traefik_ls(app):
     """List Traefik routers/services for an app from saved compose."""
     app = exit_if_invalid(app)
-    config_file = join(APP_ROOT, app, DOCKER_COMPOSE)
+    config_file = join(app_code_path(app), DOCKER_COMPOSE)
     if not exists(config_file):
         echo(f"Warning: app '{app}' not deployed, no config found.", fg='yellow')
         return
@@ -1240,9 +4299,71 @@ def cmd_traefik_inspect(app):
         echo(f"Warning: could not find a running Traefik service/container for '{app}'.", fg='yellow')
 
 
+@command('traefik:sync')
+def cmd_traefik_sync():
+    """Rewrite the file-provider config of every running app"""
+    if KATA_TRAEFIK_PROVIDER != 'file':
+        echo("Error: set KATA_TRAEFIK_PROVIDER=file to use file-provider configs", fg='red')
+        exit(1)
+    apps = sorted(a for a in listdir(APP_ROOT) if not a.startswith('.')) if exists(APP_ROOT) else []
+    running = set(check_output(['docker', 'ps', '--format', '{{.Label "com.docker.compose.project"}} {{.Label "com.docker.stack.namespace"}}'],
+                               universal_newlines=True).split())
+    for app in apps:
+        compose_path = join(app_code_path(app), DOCKER_COMPOSE)
+        if app in running and exists(compose_path):
+            write_traefik_dynamic(app, compose_path)
+            echo(f"-----> Wrote Traefik config for '{app}'", fg='green')
+        else:
+            remove_traefik_dynamic(app)
+    for name in listdir(TRAEFIK_DYNAMIC_ROOT) if exists(TRAEFIK_DYNAMIC_ROOT) else []:
+        if name.endswith('.yaml') and name[:-len('.yaml')] not in apps:
+            remove(join(TRAEFIK_DYNAMIC_ROOT, name))
+
+
+@command('cache:purge')
+@argument('app')
+@argument('paths', nargs=-1)
+@option('--service', '-s', help='Only purge the cache in front of this service')
+def cmd_cache_purge(app, paths, service):
+    """Purge cached responses (all, or those under PATH prefixes)"""
+    app = exit_if_invalid(app)
+    try:
+        rows = check_output(['docker', 'ps', '--filter', 'label=kata.cache', '--format',
+                             '{{.ID}}\t{{.Label "kata.cache"}}\t{{.Label "com.docker.compose.project"}}\t{{.Label "com.docker.stack.namespace"}}'],
+                            universal_newlines=True).splitlines()
+    except Exception as e:
+        echo(f"Error: could not list cache containers: {e}", fg='red')
+        exit(1)
+    containers = [row.split('\t') for row in rows if row.count('\t') == 3]
+    containers = [(cid, target) for cid, target, project, stack in containers
+                  if app in (project, stack) and (not service or target == service)]
+    if not containers:
+        echo(f"Warning: no running cache for '{app}'", fg='yellow')
+        return
+    for path in paths:
+        if not path.startswith('/'):
+            echo(f"Error: path '{path}' must start with '/'", fg='red')
+            exit(1)
+    if paths:
+        # Each cache file carries a "KEY: <host><uri>" header line; match the URI prefix on any host
+        patterns = ['^KEY: [^/]*' + sub(r'([.\[\]()*+?{}|^$\\])', r'\\\1', p) for p in paths]
+        script = f"grep -rlE {' '.join('-e ' + quote(p) for p in patterns)} {CACHE_PATH} | xargs -r rm -f"
+    else:
+        script = f"find {CACHE_PATH} -type f -delete"
+    failed = False
+    for cid, target in containers:
+        if call(['docker', 'exec', cid, 'sh', '-c', script], stdout=stdout, stderr=stderr) == 0:
+            echo(f"-----> Purged {' '.join(paths) or 'everything'} from the '{target}' cache", fg='green')
+        else:
+            echo(f"Error: purging the '{target}' cache failed", fg='red')
+            failed = True
+    if failed:
+        exit(1)
+
+
 @command('runtime:rebuild-all')
 def cmd_runtime_rebuild_all():
-    """Rebuild all built-in runtime images (python/nodejs/php/bun/static)."""
+    """Rebuild all built-in runtime images (base, python/nodejs/php/bun with their -build images, static, cache)."""
     ok = docker_rebuild_all_runtimes()
     if ok:
         echo("-----> Runtime images rebuilt successfully", fg='green')
@@ -1253,7 +4374,7 @@ def cmd_runtime_rebuild_all():
 @command('runtime:rebuild')
 @argument('runtime', required=True)
 def cmd_runtime_rebuild(runtime):
-    """Rebuild a single built-in runtime image (python/nodejs/php/bun/static)."""
+    """Rebuild a built-in runtime image (python/nodejs/php/bun/static/cache/base) and the images derived from it."""
     ok = docker_rebuild_runtime(runtime)
     if ok:
         echo(f"-----> Runtime '{runtime}' rebuilt successfully", fg='green')
@@ -1268,6 +4389,79 @@ def cmd_runtime_clean():
     echo("-----> Runtime images removed (kata/*)", fg='green')
 
 
+@command('runtime:report')
+@option('--runs', default=3, show_default=True, help='Container starts to time per image (0 to skip)')
+@option('--build', is_flag=True, help='Build missing images first')
+@option('--json', 'as_json', is_flag=True, help='Output as JSON')
+def cmd_runtime_report(runs, build, as_json):
+    """Show runtime image sizes, shared layers and container cold-start times."""
+    if build:
+        for image in RUNTIME_IMAGES:
+            docker_ensure_runtime_image(image)
+    try:
+        rows = runtime_image_report(max(0, runs))
+    except Exception as e:
+        echo(f"Error: could not query Docker: {e}", fg='red')
+        exit(1)
+    if as_json:
+        echo(dumps(rows, indent=2))
+        return
+    echo(f"{'IMAGE':<20}{'FROM':<14}{'SIZE':>10}{'OWN':>10}{'COLD START':>12}", fg='green')
+    for row in rows:
+        if row['size'] is None:
+            echo(f"{row['image']:<20}{row['parent'] or '':<14}{'not built':>10}", fg='white')
+            continue
+        started = f"{row['cold_start_ms']}ms" if row['cold_start_ms'] is not None else '-'
+        echo(f"{row['image']:<20}{row['parent'] or '':<14}{format_size(row['size']):>10}"
+             f"{format_size(row['own_size']):>10}{started:>12}", fg='white')
+    echo(f"{'TOTAL ON DISK':<34}{'':>10}{format_size(sum(r['own_size'] or 0 for r in rows)):>10}", fg='green')
+
+
+@command('registry:start')
+@option('--port', default=KATA_REGISTRY_PORT, show_default=True, help='Port to publish the registry on')
+def cmd_registry_start(port):
+    """Run a local registry for swarm deploys to push runtime images to."""
+    if docker_is_swarm_manager():
+        if call(['docker', 'service', 'inspect', 'kata-registry'], stdout=DEVNULL, stderr=DEVNULL) == 0:
+            echo("-----> kata-registry service already exists", fg='green')
+        else:
+            # Published through the routing mesh, so 127.0.0.1:<port> reaches it from every node;
+            # pinned to a manager so its storage volume stays in one place
+            ok = call(['docker', 'service', 'create', '--name', 'kata-registry', '--detach',
+                       '--publish', f'published={port},target=5000', '--constraint', 'node.role==manager',
+                       '--mount', 'type=volume,source=kata-registry,target=/var/lib/registry', REGISTRY_IMAGE],
+                      stdout=stdout, stderr=stderr) == 0
+            if not ok:
+                echo("Error: could not create the kata-registry service", fg='red')
+                exit(1)
+    elif call(['docker', 'container', 'inspect', 'kata-registry'], stdout=DEVNULL, stderr=DEVNULL) == 0:
+        call(['docker', 'start', 'kata-registry'], stdout=DEVNULL, stderr=stderr)
+        echo("-----> kata-registry container already exists", fg='green')
+    else:
+        ok = call(['docker', 'run', '-d', '--name', 'kata-registry', '--restart', 'unless-stopped',
+                   '-p', f'127.0.0.1:{port}:5000', '-v', 'kata-registry:/var/lib/registry', REGISTRY_IMAGE],
+                  stdout=DEVNULL, stderr=stderr) == 0
+        if not ok:
+            echo("Error: could not start the kata-registry container", fg='red')
+            exit(1)
+    echo(f"-----> Registry listening on 127.0.0.1:{port}", fg='green')
+    if KATA_REGISTRY != f'127.0.0.1:{port}':
+        echo(f"Set KATA_REGISTRY=127.0.0.1:{port} for swarm deploys to use it", fg='yellow')
+
+
+@command('registry:stop')
+def cmd_registry_stop():
+    """Remove the local registry (its image storage volume is kept)."""
+    if call(['docker', 'service', 'inspect', 'kata-registry'], stdout=DEVNULL, stderr=DEVNULL) == 0:
+        ok = call(['docker', 'service', 'rm', 'kata-registry'], stdout=DEVNULL, stderr=stderr) == 0
+    else:
+        ok = call(['docker', 'rm', '-f', 'kata-registry'], stdout=DEVNULL, stderr=stderr) == 0
+    if not ok:
+        echo("Error: could not remove kata-registry", fg='red')
+        exit(1)
+    echo("-----> kata-registry removed", fg='green')
+
+
 @command('traefik:dashboard')
 @option('--port', 'dash_port', default=8080, show_default=True, help='Host port to bind the Traefik dashboard.')
 @option('--bind', 'dash_bind', default='127.0.0.1', show_default=True, help='Bind address for the dashboard (use 0.0.0.0 to expose externally).')
@@ -1284,6 +4478,12 @@ def cmd_traefik_dashboard(dash_port, dash_bind, web_bind, websecure_bind, off, r
         return
     if not ensure_docker_volume(volume_name):
         return
+    # Check host-level settings before tearing down the running router
+    try:
+        traefik_host_args(websecure_bind)
+    except ValueError as e:
+        echo(f"Error: {e}", fg='red')
+        exit(1)
 
     if replace:
         try:
@@ -1323,7 +4523,10 @@ def cmd_destroy(app, force, wipe):
             echo("Aborted.", fg='yellow')
             return
 
+    releases = list_releases(app)
     do_remove(app, wipe=wipe)
+    for release in releases:
+        call(['docker', 'volume', 'rm', release_volume_name(app, release)], stdout=DEVNULL, stderr=DEVNULL)
 
     paths = [join(APP_ROOT, app), join(ENV_ROOT, app), join(LOG_ROOT, app), join(GIT_ROOT, app)]
     data_path = join(DATA_ROOT, app)
@@ -1331,69 +4534,244 @@ def cmd_destroy(app, force, wipe):
     if wipe:
         paths.extend([data_path, config_path])
 
-    # Pre-wipe contents from inside a root container.
-    # This avoids host-side PermissionError when files were created as root inside containers.
-    mount_map = [
-        (join(APP_ROOT, app), '/app'),
-        (join(ENV_ROOT, app), '/venv'),
-        (join(LOG_ROOT, app), '/logs'),
-        (join(GIT_ROOT, app), '/repos'),
-    ]
-    if wipe:
-        mount_map.extend([
-            (data_path, '/data'),
-            (config_path, '/config'),
-        ])
+    # Directories are renamed into the trash and deleted by a background reaper
+    echo(f"-----> {'Wiping all' if wipe else 'Removing code'} app directories", fg='yellow')
+    leftovers = [path for path in paths if exists(path) and not move_to_trash(app, path)]
+    if leftovers:
+        docker_wipe_paths(leftovers)
+    spawn_trash_reaper()
+    echo(f"-----> '{app}' destroyed", fg='green')
+    if not wipe:
+        echo("Data and config directories were not deleted. Use --wipe to remove them.", fg='yellow')
 
-    mounts: list[str] = []
-    targets: list[str] = []
-    for host_path, container_path in mount_map:
-        if exists(host_path):
-            mounts += ['-v', f"{realpath(host_path)}:{container_path}"]
-            targets.append(container_path)
+@command('logs')
+@argument('app')
+@argument('services', nargs=-1)
+@option('--follow', '-f', is_flag=True, help='Keep streaming new log lines')
+@option('--since', default=None, help='Only show lines since a timestamp or duration (e.g. 10m)')
+@option('--tail', default='all', show_default=True, help='Lines to show from the end of each container log')
+@option('--timestamps', '-t', is_flag=True, help='Prefix lines with their timestamp')
+@option('--save', is_flag=True, help='Also append lines to rotating compressed files in LOG_ROOT/<app>')
+def cmd_logs(app, services, follow, since, tail, timestamps, save):
+    """Show the merged, time-ordered logs of an app's containers"""
+    app = exit_if_invalid(app)
+    sources = app_log_sources(app, services, follow, since, tail)
+    if not sources:
+        echo(f"Warning: no containers or services found for '{app}'.", fg='yellow')
+        return
+    if follow:
+        entries = follow_log_sources(sources)
+    else:
+        # every stream is already time-ordered, so a k-way merge keeps one line per source in memory
+        entries = merge(*[read_log_source(label, cmd) for label, cmd in sources])
+    saved = RotatingLog(join(LOG_ROOT, app, f"{app}.log")) if save else None
+    try:
+        for _, timestamp, source, message in entries:
+            line = f"{timestamp} {source} | {message}"
+            if saved:
+                saved.write(line + "\n")
+            echo(line if timestamps else f"{source} | {message}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if saved:
+            saved.close()
 
-    if mounts:
+
+@command('deploy:log')
+@argument('app')
+@argument('n', type=int, default=1, required=False)
+@option('--list', 'list_logs', is_flag=True, help='List saved deploy logs instead')
+def cmd_deploy_log(app, n, list_logs):
+    """Show the nth most recent deploy log for an app (default: the last one)"""
+    app = exit_if_invalid(app)
+    logs = deploy_logs(app)
+    if list_logs:
+        for index, path in enumerate(reversed(logs), 1):
+            echo(f"{index:>3}  {basename(path)}  {format_size(getsize(path))}", fg='white')
+        return
+    if not 1 <= n <= len(logs):
+        echo(f"Error: '{app}' has {len(logs)} saved deploy logs.", fg='red')
+        return
+    try:
+        with open_deploy_log(logs[-n], 'rb') as f:
+            copyfileobj(f, stdout.buffer)
+    except Exception as e:
+        echo(f"Error reading {logs[-n]}: {e}", fg='red')
+
+
+@command('stats')
+@option('--watch', '-w', is_flag=True, help='Refresh continuously')
+@option('--interval', default=5, show_default=True, help='Seconds between refreshes with --watch')
+@option('--sort', 'sort_key', type=Choice(['cpu', 'memory', 'net_rx', 'net_tx', 'block_read', 'block_write']),
+        default='cpu', show_default=True, help='Column to sort by')
+@option('--services', '-s', is_flag=True, help='Break each app down by service')
+@option('--json', 'as_json', is_flag=True, help='Output a single sample as JSON')
+def cmd_stats(watch, interval, sort_key, services, as_json):
+    """Show CPU, memory, network and block I/O per app"""
+    while True:
         try:
-            echo(f"-----> {'Wiping all' if wipe else 'Removing code'} app directories", fg='yellow')
-            # Run BusyBox as root (explicitly). On bind mounts this can delete root-owned files.
-            # Note: on rootless Docker / userns remap, ownership semantics may differ.
-            # It cannot remove the mountpoint itself, so we also fix perms/ownership
-            # on the directory to let host-side rmtree() remove it.
-            wipe_script = (
-                "for d; do "
-                "rm -rf \"$d\" 2>/dev/null || true; "
-                #f"chown {PUID}:{PGID} \"$d\" 2>/dev/null || true; "
-                #"chmod u+rwx \"$d\" 2>/dev/null || true; "
-                "done"
-            )
-            call(
-                ['docker', 'run', '--rm', '--user', '0:0']
-                + mounts
-                + [
-                    'busybox:stable-musl',
-                    'sh',
-                    '-c',
-                    wipe_script,
-                    'sh',
-                ]
-                + targets,
-                stdout=stdout,
-                stderr=stderr,
-                universal_newlines=True,
-            )
-        except Exception as exc:
-            echo(f"Warning: {'Wipe' if wipe else 'Remove'} failed: {exc}", fg='yellow')
+            apps = collect_app_stats()
+        except Exception as e:
+            echo(f"Error collecting container stats: {e}", fg='red')
+            exit(1)
+        if as_json:
+            echo(dumps(apps, indent=2), fg='white')
+            return
+        if watch:
+            clear()
+        print_app_stats(apps, sort_key, services)
+        if not watch:
+            return
+        try:
+            sleep(interval)
+        except KeyboardInterrupt:
+            return
 
-    for path in paths:
-        if not exists(path):
+
+@command('capacity')
+@option('--json', 'as_json', is_flag=True, help='Output as JSON')
+def cmd_capacity(as_json):
+    """Compare CPU/memory committed by running apps with host capacity"""
+    try:
+        report = collect_capacity()
+    except Exception as e:
+        echo(f"Error: could not query Docker: {e}", fg='red')
+        exit(1)
+    if as_json:
+        echo(dumps(report, indent=2))
+        return
+    host, apps = report['host'], report['apps']
+    echo(f"{'APP':<24}{'CPU RES':>9}{'CPU LIMIT':>11}{'MEM RES':>11}{'MEM LIMIT':>11}{'CONTAINERS':>12}{'UNBOUNDED':>11}", fg='green')
+    totals = {key: sum(a[key] for a in apps.values()) for key in RESOURCE_KEYS + ('containers', 'unbounded')}
+    for app, usage in sorted(apps.items()) + [('TOTAL', totals)]:
+        echo(f"{app[:23]:<24}{usage['reserve_cpus']:>9.2f}{usage['cpus']:>11.2f}{format_size(usage['reserve_memory']):>11}"
+             f"{format_size(usage['memory']):>11}{usage['containers']:>12}{usage['unbounded']:>11}", fg='white')
+    memory = format_size(host['memory']) if host['memory'] else '?'
+    echo(f"{'HOST':<24}{host['cpus']:>9}{host['cpus']:>11}{memory:>11}{memory:>11}", fg='green')
+    for label, key, capacity in (('CPU', 'cpus', host['cpus']), ('memory', 'memory', host['memory'])):
+        if not capacity:
             continue
+        reserved, limited = totals[f'reserve_{key}'] / capacity, totals[key] / capacity
+        if reserved > 1:
+            echo(f"Error: {label} reservations are {reserved:.0%} of the host; some tasks cannot be placed", fg='red')
+        elif limited > 1:
+            echo(f"Warning: {label} limits add up to {limited:.0%} of the host (overcommitted)", fg='yellow')
+    if totals['unbounded']:
+        echo(f"Warning: {totals['unbounded']} container(s) have no memory limit", fg='yellow')
+
+
+@command('placement')
+@argument('app')
+@option('--json', 'as_json', is_flag=True, help='Output as JSON')
+def cmd_placement(app, as_json):
+    """Show which nodes an app's tasks landed on"""
+    app = exit_if_invalid(app)
+    try:
+        report = collect_placement(app)
+    except Exception as e:
+        echo(f"Error: could not query Docker: {e}", fg='red')
+        exit(1)
+    if as_json:
+        echo(dumps(report, indent=2))
+        return
+    services, pending = report['services'], report['pending']
+    echo(f"{'SERVICE':<24}{'NODE':<32}{'TASKS':>6}", fg='green')
+    for service in sorted(set(services) | set(pending)):
+        for node, tasks in sorted(services.get(service, {}).items()):
+            echo(f"{service[:23]:<24}{node[:31]:<32}{tasks:>6}", fg='white')
+        if pending.get(service):
+            echo(f"{service[:23]:<24}{'(not running yet)':<32}{pending[service]:>6}", fg='yellow')
+    for service, nodes in sorted(services.items()):
+        tasks = sum(nodes.values())
+        if len(nodes) == 1 and tasks > 1 and report['nodes'] > 1:
+            echo(f"Warning: all {tasks} tasks of '{service}' run on {next(iter(nodes))}; "
+                 f"see x-kata-placement to spread them", fg='yellow')
+
+
+@command('metrics:serve')
+@option('--bind', default='127.0.0.1', show_default=True, help='Address to listen on')
+@option('--port', default=9102, show_default=True, help='Port to listen on')
+@option('--interval', default=15, show_default=True, help='Seconds between docker stats samples')
+def cmd_metrics_serve(bind, port, interval):
+    """Serve Prometheus metrics for deploys and per-app resource usage"""
+    collector = MetricsCollector(interval)
+    collector.start()
+    server = ThreadingHTTPServer((bind, port), metrics_handler(collector))
+    echo(f"-----> Serving metrics on http://{bind}:{port}/metrics", fg='green')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@command('scale')
+@argument('app')
+@argument('counts', nargs=-1)
+@option('--reset', is_flag=True, help='Forget saved replica counts; the next deploy uses kata-compose.yaml again')
+def cmd_scale(app, counts, reset):
+    """Show or set replicas: scale APP [SERVICE=N...]"""
+    app = exit_if_invalid(app)
+    if reset:
+        set_scale_overrides(app, {})
+        echo(f"-----> Cleared saved replica counts for '{app}'", fg='green')
+        return
+    if not counts:
+        saved = get_scale_overrides(app)
+        for service, replicas in sorted(get_replicas(app).items()):
+            echo(f"{service:<30}{replicas:>4}{'  (saved: ' + str(saved[service]) + ')' if service in saved else ''}", fg='white')
+        return
+    wanted = {}
+    for item in counts:
+        service, _, replicas = item.partition('=')
+        if not service or not replicas.isdigit():
+            echo(f"Error: expected SERVICE=N, got '{item}'", fg='red')
+            exit(1)
+        wanted[service] = int(replicas)
+    if not scale_app(app, wanted):
+        exit(1)
+
+
+@command('autoscale')
+@option('--interval', default=30, show_default=True, help='Seconds between evaluations')
+@option('--dry-run', is_flag=True, help='Only print the decisions')
+def cmd_autoscale(interval, dry_run):
+    """Scale services with x-kata-autoscale policies from CPU and request rates"""
+    scaler = Autoscaler(dry_run)
+    echo(f"-----> Autoscaling every {interval}s{' (dry run)' if dry_run else ''}", fg='green')
+    while True:
         try:
-            rmtree(path)
+            scaler.tick()
+        except KeyboardInterrupt:
+            return
         except Exception as e:
-            echo(f"Error removing {path}: {str(e)}", fg='red')
-    echo(f"-----> '{app}' destroyed", fg='green')
-    if not wipe:
-        echo("Data and config directories were not deleted. Use --wipe to remove them.", fg='yellow')
+            echo(f"Warning: autoscale pass failed: {e}", fg='yellow')
+        try:
+            sleep(interval)
+        except KeyboardInterrupt:
+            return
+
+
+@command('trash')
+def cmd_trash():
+    """Show destroyed app directories still waiting to be deleted"""
+    entries = trash_entries()
+    total = 0
+    for path in entries:
+        size = disk_usage(path)
+        total += size
+        echo(f"{format_size(size):>10}  {basename(path)}", fg='white')
+    echo(f"{len(entries)} entries, {format_size(total)} reclaimable", fg='green')
+
+
+@command('trash:reap')
+@option('--jobs', '-j', default=KATA_REAP_JOBS, show_default=True, help='Entries deleted in parallel')
+def cmd_trash_reap(jobs):
+    """Delete trashed app directories now (normally done in the background)"""
+    reap_trash(jobs, verbose=stdout.isatty())
+
 
 @command('docker', add_help_option=False, context_settings=dict(ignore_unknown_options=True))
 @argument('args', nargs=-1, required=True, type=UNPROCESSED)
@@ -1426,11 +4804,11 @@ def cmd_service_ps(service):
         return
 
     # Compose mode
-    compose_path = join(APP_ROOT, app, DOCKER_COMPOSE)
+    compose_path = join(app_code_path(app), DOCKER_COMPOSE)
     if not exists(compose_path):
         echo(f"Error: compose file not found for app '{app}' at {compose_path}", fg='red')
         return
-    call(get_compose_cmd() + ['-f', compose_path, 'ps'] + extras,
+    call(get_compose_cmd() + ['-p', app, '-f', compose_path, 'ps'] + extras,
          stdout=stdout, stderr=stderr, universal_newlines=True)
 
 
@@ -1444,11 +4822,93 @@ def cmd_run(service, command):
 
 
 @command('restart')
+@argument('apps', nargs=-1)
+@option('--all', 'all_apps', is_flag=True, help='Apply to every deployed app')
+@option('--jobs', '-j', default=KATA_FLEET_JOBS, show_default=True, help='Number of apps processed in parallel')
+def cmd_restart(apps, all_apps, jobs):
+    """Restart apps (names or globs)"""
+    run_fleet(do_restart, select_apps(apps, all_apps), jobs)
+
+
+@command('start')
+@argument('apps', nargs=-1)
+@option('--all', 'all_apps', is_flag=True, help='Apply to every deployed app')
+@option('--jobs', '-j', default=KATA_FLEET_JOBS, show_default=True, help='Number of apps processed in parallel')
+def cmd_start(apps, all_apps, jobs):
+    """Start apps (names or globs)"""
+    run_fleet(do_start, select_apps(apps, all_apps), jobs)
+
+
+@command('redeploy')
+@argument('apps', nargs=-1)
+@option('--all', 'all_apps', is_flag=True, help='Apply to every deployed app')
+@option('--jobs', '-j', default=KATA_FLEET_JOBS, show_default=True, help='Number of apps processed in parallel')
+def cmd_redeploy(apps, all_apps, jobs):
+    """Redeploy the current revision of apps, re-running installs (names or globs)"""
+    apps = select_apps(apps, all_apps)
+    if len(apps) == 1:
+        run_fleet(do_redeploy, apps, jobs)
+        return
+    # One process per app, as deploy logging redirects this process' stdout/stderr
+    run_fleet(lambda app: call([executable, KATA_SCRIPT, 'redeploy', app]) == 0, apps, jobs)
+
+
+@command('releases')
 @argument('app')
-def cmd_restart(app):
-    """Restart an app"""
+def cmd_releases(app):
+    """List releases for an app (asterisk marks the current one)"""
     app = exit_if_invalid(app)
-    do_restart(app)
+    current = get_current_release(app)
+    for release in list_releases(app):
+        echo(('*' if release == current else ' ') + release, fg='green')
+
+
+@command('rollback')
+@argument('app')
+@argument('release', required=False)
+def cmd_rollback(app, release=None):
+    """Switch an app to a previous release without rebuilding it"""
+    app = exit_if_invalid(app)
+    # Resolve the target under the deploy lock, so a deploy we waited for is taken into account
+    with file_lock(join(APP_ROOT, app, KATA_DEPLOY_LOCK),
+                   f"-----> A deploy of '{app}' is in progress; waiting for it to finish"):
+        releases = list_releases(app)
+        current = get_current_release(app)
+        if release:
+            matches = [r for r in releases if r.startswith(release)]
+            if len(matches) != 1:
+                echo(f"Error: release '{release}' {'is ambiguous' if matches else 'not found'}. See 'kata releases {app}'.", fg='red')
+                return
+            target = matches[0]
+        else:
+            older = releases[:releases.index(current)] if current in releases else []
+            if not older:
+                echo(f"Error: no release older than the current one for '{app}'.", fg='red')
+                return
+            target = older[-1]
+        if target == current:
+            echo(f"Release '{target[:12]}' is already current", fg='yellow')
+            return
+        echo(f"-----> Rolling back '{app}' to release '{target[:12]}'", fg='yellow')
+        set_current_release(app, target)
+        do_start(app)
+
+
+@command('queue')
+@option('--json', 'as_json', is_flag=True, help='Output status as JSON')
+def cmd_queue(as_json=False):
+    """Show host-wide deploy slots, queued deploys and recent wait times"""
+    status = scheduler_status()
+    if as_json:
+        echo(dumps(status, indent=2), fg='white')
+        return
+    echo(f"Slots: {len(status['running'])}/{status['slots']} in use", fg='green')
+    for job in status['running']:
+        echo(f"  slot {job['slot']}: {job['app']} (running {job['running']}s)", fg='white')
+    echo(f"Queued: {len(status['queued'])}", fg='green')
+    for job in status['queued']:
+        echo(f"  {job['priority']:<7} {job['app']} (waiting {job['waiting']}s)", fg='white')
+    echo(f"Recent waits ({status['recent_jobs']} jobs): avg {status['avg_wait']}s, max {status['max_wait']}s", fg='green')
 
 
 @command('mode')
@@ -1477,11 +4937,12 @@ def cmd_mode(app, mode=None):
 
 
 @command('stop')
-@argument('app')
-def cmd_stop(app):
-    """Stop an app"""
-    app = exit_if_invalid(app)
-    do_stop(app)
+@argument('apps', nargs=-1)
+@option('--all', 'all_apps', is_flag=True, help='Apply to every deployed app')
+@option('--jobs', '-j', default=KATA_FLEET_JOBS, show_default=True, help='Number of apps processed in parallel')
+def cmd_stop(apps, all_apps, jobs):
+    """Stop apps (names or globs)"""
+    run_fleet(do_stop, select_apps(apps, all_apps), jobs)
 
 
 @command('setup')
@@ -1558,19 +5019,24 @@ def cmd_update():
 def cmd_git_hook(app):
     # INTERNAL: Post-receive git hook
     app = sanitize_app_name(app)
-    repo_path = join(GIT_ROOT, app)
     app_path = join(APP_ROOT, app)
     data_path = join(DATA_ROOT, app)
 
+    # Several refs can arrive in one push; only the last updated one is deployed
+    newrev = None
     for line in stdin:
-        oldrev, newrev, refname = line.strip().split(" ")
-        if not exists(app_path):
-            echo("-----> Creating app '{}'".format(app), fg='green')
-            makedirs(app_path)
-            if not exists(data_path):
-                makedirs(data_path)
-            call("git clone --quiet {} {}".format(repo_path, app), cwd=APP_ROOT, shell=True)
-        do_deploy(app, newrev=newrev)
+        oldrev, rev, refname = line.strip().split(" ")
+        if rev.strip('0'):
+            newrev = rev
+    if not newrev:
+        return
+    if not exists(app_path):
+        echo("-----> Creating app '{}'".format(app), fg='green')
+        makedirs(app_path)
+        if not exists(data_path):
+            makedirs(data_path)
+    # Code is checked out per release from the bare repo by do_deploy
+    do_deploy_queued(app, newrev)
 
 
 @command("git-receive-pack", hidden=True)
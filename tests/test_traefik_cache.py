@@ -0,0 +1,51 @@
+"""Regression checks for traefik routes that put a cache sidecar in front of a service."""
+
+from importlib.util import module_from_spec, spec_from_file_location
+from os import environ
+from os.path import dirname, join
+from sys import version_info
+from tempfile import mkdtemp
+
+import pytest
+
+pytestmark = pytest.mark.skipif(version_info < (3, 12), reason="kata requires Python 3.12")
+
+
+@pytest.fixture(scope='module')
+def kata():
+    environ.setdefault('KATA_ROOT', mkdtemp())
+    spec = spec_from_file_location('kata', join(dirname(dirname(__file__)), 'kata.py'))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.docker_ensure_runtime_image = lambda image: True
+    return module
+
+
+def routed(kata, traefik_cfg):
+    compose = {'services': {'web': {'image': 'kata/python'}}}
+    traefik_cfg = {'host': 'app.example.com', 'inject_service': False, **traefik_cfg}
+    kata.apply_cache('app', compose, traefik_cfg)
+    kata.apply_traefik('app', compose, traefik_cfg)
+    return compose['services']
+
+
+def test_cached_route_scales_the_service_not_the_sidecar(kata):
+    services = routed(kata, {'port': 8000, 'replicas': 4, 'cache': True})
+    assert services['web']['deploy']['replicas'] == 4
+    assert 'replicas' not in services['web-cache']['deploy']
+    assert services['web-cache']['labels']['traefik.http.routers.app.rule'] == 'Host(`app.example.com`)'
+    assert not any(k.startswith('traefik.') for k in services['web'].get('labels', {}))
+
+
+def test_cached_route_healthcheck_bypasses_the_cache(kata):
+    services = routed(kata, {'port': 8000, 'healthcheck': '/health', 'cache': True})
+    assert services['web-cache']['labels']['traefik.http.services.app.loadbalancer.healthcheck.path'] == '/health'
+    assert 'location /health {\n            proxy_cache off;' in services['web-cache']['environment']['KATA_CACHE_CONF']
+
+
+def test_sticky_cached_route_is_rejected(kata, tmp_path):
+    compose_file = tmp_path / 'kata-compose.yaml'
+    compose_file.write_text("services:\n  web:\n    image: nginx\n"
+                            "traefik:\n  host: app.example.com\n  port: 80\n  sticky: true\n  cache: true\n")
+    with pytest.raises(SystemExit):
+        kata.parse_compose('app', str(compose_file))